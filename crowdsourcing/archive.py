@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from crowdsourcing import sql
+from crowdsourcing.models import Project, TaskWorker
+
+# live and archive table pairs, children come first and restores walk the list backwards;
+# the <live table>_all views read both sides
+ARCHIVED_TABLES = (
+    ('crowdsourcing_taskworkerresult', 'crowdsourcing_archivedtaskworkerresult'),
+    ('crowdsourcing_taskworker', 'crowdsourcing_archivedtaskworker'),
+    ('crowdsourcing_task', 'crowdsourcing_archivedtask'),
+)
+
+# rows of each table that belong to a project group, parents are looked up through the views so that the
+# filters hold whichever side the parents are on while their children move
+GROUP_FILTERS = {
+    'crowdsourcing_taskworkerresult': '''
+        x.task_worker_id IN (SELECT tw.id FROM crowdsourcing_taskworker_all tw
+                               INNER JOIN crowdsourcing_task_all t ON t.id = tw.task_id
+                               INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                             WHERE p.group_id = %(group_id)s)
+    ''',
+    'crowdsourcing_taskworker': '''
+        x.task_id IN (SELECT t.id FROM crowdsourcing_task_all t
+                        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                      WHERE p.group_id = %(group_id)s)
+    ''',
+    'crowdsourcing_task': '''
+        x.project_id IN (SELECT p.id FROM crowdsourcing_project p WHERE p.group_id = %(group_id)s)
+    ''',
+}
+
+
+# noinspection SqlResolve
+sql.register('archivable_groups', '''
+    SELECT p.group_id
+    FROM crowdsourcing_project p
+    GROUP BY p.group_id
+    HAVING bool_and(p.tasks_archived_at IS NULL)
+      AND bool_and(p.status <> %(draft)s)
+      AND bool_and(p.deleted_at IS NOT NULL OR p.status = %(completed)s OR p.deadline < %(cutoff)s)
+      AND max(p.updated_at) < %(cutoff)s
+      AND NOT exists(
+        SELECT 1 FROM crowdsourcing_project rp
+        WHERE rp.parent_id = p.group_id AND rp.is_review = TRUE AND rp.deleted_at IS NULL
+          AND rp.tasks_archived_at IS NULL)
+      AND NOT exists(
+        SELECT 1 FROM crowdsourcing_task t
+          INNER JOIN crowdsourcing_project tp ON tp.id = t.project_id
+          LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id
+        WHERE tp.group_id = p.group_id
+          AND (tw.updated_at >= %(cutoff)s OR tw.status = ANY(%(pending)s)
+            OR exists(SELECT 1 FROM mturk_mturkhit h WHERE h.task_id = t.id)
+            OR exists(SELECT 1 FROM crowdsourcing_match m WHERE m.task_id = t.id)
+            OR exists(SELECT 1 FROM crowdsourcing_rating r WHERE r.task_id = t.id)
+            OR exists(SELECT 1 FROM crowdsourcing_rawratingfeedback f WHERE f.task_id = t.id)
+            OR exists(SELECT 1 FROM crowdsourcing_taskcomment c WHERE c.task_id = t.id)
+            OR exists(SELECT 1 FROM mturk_mturkassignment a WHERE a.task_worker_id = tw.id)
+            OR exists(SELECT 1 FROM crowdsourcing_matchworker mw WHERE mw.task_worker_id = tw.id)
+            OR exists(SELECT 1 FROM crowdsourcing_workermatchscore s WHERE s.worker_id = tw.id)
+            OR exists(SELECT 1 FROM crowdsourcing_returnfeedback rf WHERE rf.task_worker_id = tw.id)))
+    ORDER BY max(p.updated_at)
+    LIMIT %(limit)s
+''')
+
+# archive tables are created LIKE the live ones, both sides share their column order
+# noinspection SqlResolve
+MOVE_QUERY = '''
+    WITH moved AS (
+        DELETE FROM {source} x WHERE {where} RETURNING x.*
+    )
+    INSERT INTO {target} SELECT * FROM moved
+'''
+
+
+def _register_moves():
+    """
+    One named statement per table and direction, keyed by (source table, target table).
+    """
+    statements = {}
+    for live, archive in ARCHIVED_TABLES:
+        for source, target, action in ((live, archive, 'archive'), (archive, live, 'restore')):
+            name = '{}_{}'.format(action, live.replace('crowdsourcing_', ''))
+            sql.register(name, MOVE_QUERY.format(source=source, target=target, where=GROUP_FILTERS[live]))
+            statements[(source, target)] = name
+    return statements
+
+
+MOVE_STATEMENTS = _register_moves()
+
+
+def get_archivable_groups(limit):
+    """
+    Project groups whose work is finished: every revision is deleted or past its deadline, nothing has been
+    touched for ARCHIVE_AFTER_DAYS and no task worker still waits on a worker or a requester.
+
+    Groups whose tasks or task workers are referenced from outside the archived tables (MTurk, matches,
+    ratings, comments, feedback) or that still have a live review project stay in the hot tables.
+    """
+    cursor = connection.cursor()
+    sql.execute('archivable_groups', {
+        'draft': Project.STATUS_DRAFT,
+        'completed': Project.STATUS_COMPLETED,
+        'cutoff': timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS),
+        'pending': [TaskWorker.STATUS_IN_PROGRESS, TaskWorker.STATUS_SUBMITTED],
+        'limit': limit
+    }, cursor)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _move_group(group_id, source_index, target_index, tables):
+    cursor = connection.cursor()
+    for table in tables:
+        sql.execute(MOVE_STATEMENTS[(table[source_index], table[target_index])], {'group_id': group_id}, cursor)
+
+
+def archive_project_group(group_id):
+    """
+    Moves the tasks, task workers and results of a project group into the archive tables.
+    """
+    with transaction.atomic():
+        _move_group(group_id, 0, 1, ARCHIVED_TABLES)
+        Project.objects.filter(group_id=group_id).update(tasks_archived_at=timezone.now())
+
+
+def restore_project_group(group_id):
+    """
+    Moves an archived project group back into the hot tables, does nothing for groups that are live.
+    """
+    if not Project.objects.filter(group_id=group_id, tasks_archived_at__isnull=False).exists():
+        return False
+    with transaction.atomic():
+        _move_group(group_id, 1, 0, tuple(reversed(ARCHIVED_TABLES)))
+        Project.objects.filter(group_id=group_id).update(tasks_archived_at=None)
+    return True
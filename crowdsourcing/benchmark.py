@@ -0,0 +1,74 @@
+import random
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from crowdsourcing import models
+from crowdsourcing.utils import hash_task
+
+USERNAME_PREFIX = 'benchmark_'
+
+
+def create_benchmark_data(projects, tasks, workers, repetition, seed=0):
+    """
+    Fills the database with synthetic projects, tasks and task workers to measure queries against, the same seed
+    gives the same statuses and assignments. Returns the requester owning the projects and the number of task
+    workers created.
+    """
+    random.seed(seed)
+    with transaction.atomic():
+        requester, _ = User.objects.get_or_create(username=USERNAME_PREFIX + 'requester')
+        worker_ids = get_workers(workers)
+        template = models.Template.objects.create(name='Benchmark', owner=requester)
+        template.group_id = template.id
+        template.save()
+        models.TemplateItem.objects.create(name='radio_0', template=template, type='radio', position=1,
+                                           role=models.TemplateItem.ROLE_INPUT, aux_attributes={
+                                               "question": {"value": "{{ text }}", "data_source": None},
+                                               "options": [{"value": "Yes", "position": 1, "data_source": None},
+                                                           {"value": "No", "position": 2, "data_source": None}]
+                                           })
+        statuses = [models.Project.STATUS_IN_PROGRESS] * 3 + [models.Project.STATUS_COMPLETED,
+                                                              models.Project.STATUS_PAUSED]
+        task_worker_count = 0
+        for p in range(projects):
+            project = models.Project.objects.create(name='Benchmark {}'.format(p), owner=requester,
+                                                    template=template, status=random.choice(statuses),
+                                                    repetition=repetition, price=0.1,
+                                                    published_at=timezone.now())
+            project.group_id = project.id
+            project.save()
+            task_worker_count += create_tasks(project, tasks, worker_ids)
+    return requester, task_worker_count
+
+
+def get_workers(count):
+    usernames = [USERNAME_PREFIX + 'worker_{}'.format(i) for i in range(count)]
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    User.objects.bulk_create([User(username=u) for u in usernames if u not in existing])
+    return list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+
+
+def create_tasks(project, count, workers):
+    tasks = []
+    for row in range(count):
+        data = {"text": "Benchmark task {} of project {}".format(row, project.id)}
+        tasks.append(models.Task(project=project, data=data, hash=hash_task(data), row_number=row + 1))
+    models.Task.objects.bulk_create(tasks)
+    models.Task.objects.filter(project=project).update(group_id=F('id'))
+
+    statuses = [models.TaskWorker.STATUS_ACCEPTED] * 4 + [models.TaskWorker.STATUS_SUBMITTED,
+                                                          models.TaskWorker.STATUS_IN_PROGRESS,
+                                                          models.TaskWorker.STATUS_REJECTED,
+                                                          models.TaskWorker.STATUS_SKIPPED,
+                                                          models.TaskWorker.STATUS_EXPIRED]
+    task_workers = []
+    for task_id in models.Task.objects.filter(project=project).values_list('id', flat=True):
+        assigned = random.randint(0, project.repetition + 1)
+        for worker_id in random.sample(workers, min(assigned, len(workers))):
+            task_workers.append(models.TaskWorker(task_id=task_id, worker_id=worker_id,
+                                                  status=random.choice(statuses)))
+    models.TaskWorker.objects.bulk_create(task_workers, batch_size=5000)
+    return len(task_workers)
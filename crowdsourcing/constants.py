@@ -8,3 +8,7 @@ TASK_SKIPPED = 'SKIPPED'
 
 ACTION_GROUPADD = 'GROUPADD'
 ACTION_UPDATE_PROFILE = 'UPDATE_PROFILE'
+
+EXPORT_IN_PROGRESS = 'IN_PROGRESS'
+EXPORT_JOB_TIMEOUT = 3600
+EXPORT_FILE_TTL = 604800
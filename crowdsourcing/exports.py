@@ -0,0 +1,267 @@
+import csv
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+
+from crowdsourcing.models import TaskWorker, TemplateItem
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON_LINES = 'jsonl'
+EXPORT_FORMATS = (FORMAT_CSV, FORMAT_JSON_LINES)
+
+FORMAT_CONTENT_TYPES = {
+    FORMAT_CSV: 'text/csv',
+    FORMAT_JSON_LINES: 'application/x-ndjson'
+}
+
+
+def encode_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class ResultsExport(object):
+    """
+    Reads the submitted results of a project, batch or rerun key one task worker at a time, limited to the
+    projects of owner_id when given.
+
+    Rows are built from a server-side cursor fetched in chunks, the column set is resolved up front so that
+    writers never need to see the whole result set. Tasks are read through the views that also cover archived
+    project groups.
+    """
+    CHUNK_SIZE = 2000
+    STATUSES = [TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_REJECTED, TaskWorker.STATUS_SUBMITTED]
+    RESULT_COLUMNS = ('id', 'task_id', 'created_at', 'submitted_timestamp', 'worker_alias', 'status')
+    FILTERS = (
+        ('project_id', 't.project_id'),
+        ('batch_id', 't.batch_id'),
+        ('rerun_key', 't.rerun_key'),
+    )
+
+    def __init__(self, project_id=None, batch_id=None, rerun_key=None, owner_id=None):
+        values = {'project_id': project_id, 'batch_id': batch_id, 'rerun_key': rerun_key}
+        self.filters = OrderedDict([(key, values[key]) for key, _ in self.FILTERS if values[key] is not None])
+        self.owner_id = owner_id
+        self._template_items = None
+
+    @property
+    def params(self):
+        params = {'statuses': self.STATUSES, 'owner_id': self.owner_id}
+        params.update(self.filters)
+        return params
+
+    @property
+    def scope_clause(self):
+        conditions = ['{} = (%({})s)'.format(column, key) for key, column in self.FILTERS if key in self.filters]
+        if self.owner_id is not None:
+            conditions.append('t.project_id IN (SELECT p.id FROM crowdsourcing_project p '
+                              'WHERE p.owner_id = (%(owner_id)s))')
+        return ' AND '.join(conditions) or 'TRUE'
+
+    @property
+    def where_clause(self):
+        return 'tw.status = ANY(%(statuses)s) AND ' + self.scope_clause
+
+    def has_tasks(self):
+        """
+        Whether any task, submitted or not, falls into the scope of the export.
+        """
+        if len(self.filters) == 0:
+            return False
+        cursor = connection.cursor()
+        # noinspection SqlResolve
+        query = 'SELECT exists(SELECT 1 FROM crowdsourcing_task_all t WHERE {})'.format(self.scope_clause)
+        cursor.execute(query, self.params)
+        return cursor.fetchone()[0]
+
+    @property
+    def template_items(self):
+        if self._template_items is None:
+            cursor = connection.cursor()
+            # noinspection SqlResolve
+            query = '''
+                SELECT DISTINCT r.template_item_id
+                FROM crowdsourcing_taskworkerresult_all r
+                  INNER JOIN crowdsourcing_taskworker_all tw ON tw.id = r.task_worker_id
+                  INNER JOIN crowdsourcing_task_all t ON t.id = tw.task_id
+                WHERE {}
+            '''.format(self.where_clause)
+            cursor.execute(query, self.params)
+            items = TemplateItem.objects.filter(id__in=[row[0] for row in cursor.fetchall()]).order_by('position')
+            self._template_items = OrderedDict([(item.id, item) for item in items])
+        return self._template_items
+
+    def is_empty(self):
+        return len(self.filters) == 0 or len(self.template_items) == 0
+
+    def get_cache_key(self, export_format):
+        """
+        Identifies an export by its scope, format and the last time any of its results changed.
+        """
+        cursor = connection.cursor()
+        # noinspection SqlResolve
+        query = '''
+            SELECT greatest(max(tw.updated_at), max(r.updated_at)), count(DISTINCT tw.id)
+            FROM crowdsourcing_taskworkerresult_all r
+              INNER JOIN crowdsourcing_taskworker_all tw ON tw.id = r.task_worker_id
+              INNER JOIN crowdsourcing_task_all t ON t.id = tw.task_id
+            WHERE {}
+        '''.format(self.where_clause)
+        cursor.execute(query, self.params)
+        last_updated, total = cursor.fetchone()
+        scope = json.dumps([self.filters, self.owner_id], cls=DjangoJSONEncoder)
+        last_updated = last_updated.isoformat() if last_updated is not None else ''
+        return hashlib.sha256('{}:{}:{}:{}'.format(scope, export_format, last_updated, total)).hexdigest()
+
+    def count(self):
+        cursor = connection.cursor()
+        # noinspection SqlResolve
+        query = '''
+            SELECT count(*)
+            FROM crowdsourcing_taskworker_all tw
+              INNER JOIN crowdsourcing_task_all t ON t.id = tw.task_id
+            WHERE {}
+        '''.format(self.where_clause)
+        cursor.execute(query, self.params)
+        return cursor.fetchone()[0]
+
+    def get_columns(self):
+        cursor = connection.cursor()
+        # noinspection SqlResolve
+        data_query = '''
+            SELECT DISTINCT jsonb_object_keys(t.data) column_name
+            FROM crowdsourcing_task_all t
+            WHERE jsonb_typeof(t.data) = 'object' AND exists(
+                SELECT 1 FROM crowdsourcing_taskworker_all tw WHERE tw.task_id = t.id AND {})
+            ORDER BY column_name
+        '''.format(self.where_clause)
+        cursor.execute(data_query, self.params)
+        columns = list(self.RESULT_COLUMNS) + [row[0] for row in cursor.fetchall()]
+
+        iframe_keys = []
+        iframe_items = [item_id for item_id, item in self.template_items.items() if item.type == 'iframe']
+        if len(iframe_items):
+            params = self.params
+            params.update({'items': iframe_items})
+            # noinspection SqlResolve
+            iframe_query = '''
+                SELECT DISTINCT jsonb_object_keys(r.result) column_name
+                FROM crowdsourcing_taskworkerresult_all r
+                  INNER JOIN crowdsourcing_taskworker_all tw ON tw.id = r.task_worker_id
+                  INNER JOIN crowdsourcing_task_all t ON t.id = tw.task_id
+                WHERE {} AND r.template_item_id = ANY(%(items)s) AND jsonb_typeof(r.result) = 'object'
+                ORDER BY column_name
+            '''.format(self.where_clause)
+            cursor.execute(iframe_query, params)
+            iframe_keys = [row[0] for row in cursor.fetchall()]
+
+        for item in self.template_items.values():
+            if item.type == 'iframe':
+                columns += ['result'] + iframe_keys
+            else:
+                columns.append(self.get_column_name(item))
+        return list(OrderedDict.fromkeys(columns))
+
+    def iter_rows(self, on_chunk=None):
+        """
+        Yields one dict per task worker, on_chunk is called with the number of rows produced after every chunk.
+        """
+        # noinspection SqlResolve
+        query = '''
+            SELECT
+              tw.id,
+              tw.task_id,
+              tw.created_at,
+              r.updated_at,
+              u.username,
+              tw.status,
+              t.data,
+              r.template_item_id,
+              r.result
+            FROM crowdsourcing_taskworkerresult_all r
+              INNER JOIN crowdsourcing_taskworker_all tw ON tw.id = r.task_worker_id
+              INNER JOIN crowdsourcing_task_all t ON t.id = tw.task_id
+              INNER JOIN auth_user u ON u.id = tw.worker_id
+              INNER JOIN crowdsourcing_templateitem i ON i.id = r.template_item_id
+            WHERE {}
+            ORDER BY tw.task_id, tw.worker_id, i.position
+        '''.format(self.where_clause)
+        status_labels = dict(TaskWorker.STATUS)
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name='results_export', withhold=True)
+        cursor.itersize = self.CHUNK_SIZE
+        try:
+            cursor.execute(query, self.params)
+            row = None
+            produced = 0
+            task_worker_id = -1
+            while True:
+                chunk = cursor.fetchmany(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                for result in chunk:
+                    if result[0] != task_worker_id:
+                        if row is not None:
+                            produced += 1
+                            yield row
+                        task_worker_id = result[0]
+                        row = {
+                            "id": result[0],
+                            "task_id": result[1],
+                            "created_at": result[2],
+                            "submitted_timestamp": result[3],
+                            "worker_alias": result[4],
+                            "status": status_labels.get(result[5])
+                        }
+                        if result[6]:
+                            row.update(result[6])
+                    row.update(self.result_to_dict(self.template_items[result[7]], result[8]))
+                if on_chunk is not None:
+                    on_chunk(produced)
+            if row is not None:
+                yield row
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def get_column_name(template_item):
+        return str(template_item.aux_attributes['question']['value'])
+
+    def result_to_dict(self, template_item, result):
+        if template_item.type == 'checkbox':
+            return {
+                self.get_column_name(template_item): ",".join(
+                    [x['value'] for x in result if 'answer' in x and x['answer']])
+            }
+        elif template_item.type == 'iframe' and isinstance(result, list):
+            return {
+                "result": result
+            }
+        elif template_item.type == 'iframe' and isinstance(result, dict):
+            return result
+        else:
+            return {
+                self.get_column_name(template_item): result
+            }
+
+    def write(self, output, export_format, on_chunk=None):
+        """
+        Writes the export to an open binary file.
+        """
+        columns = self.get_columns()
+        rows = self.iter_rows(on_chunk=on_chunk)
+        if export_format == FORMAT_CSV:
+            writer = csv.writer(output)
+            writer.writerow([encode_csv_value(c) for c in columns])
+            for row in rows:
+                writer.writerow([encode_csv_value(row.get(c)) for c in columns])
+        elif export_format == FORMAT_JSON_LINES:
+            for row in rows:
+                output.write(json.dumps(OrderedDict([(c, row.get(c)) for c in columns]), cls=DjangoJSONEncoder))
+                output.write('\n')
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Template
+from django.template.base import VariableNode
+
+from crowdsourcing.utils import get_template_string, replace_braces
+
+SAMPLE_ITEMS = (
+    (1, u'Is the sentence "{{ sentence }}" written in {{language}}?'),
+    (2, u'https://example.com/label?image={{ image_url }}&id={{ id }}'),
+    (3, u'{{ option_a }}'),
+    (4, u'Select the best caption'),
+    (5, u'<b>{{ title }}</b> by {{ author }} - {{ missing }}'),
+)
+
+
+def render_with_django(initial_data, data):
+    html_template = Template(replace_braces(initial_data))
+    return_value = ''
+    for node in html_template.nodelist:
+        if isinstance(node, VariableNode):
+            return_value += unicode(data.get(node.token.contents, ''))
+        else:
+            return_value += unicode(node.token.contents)
+    return return_value
+
+
+class Command(BaseCommand):
+    help = 'Compares parsing task template strings on every render with the compiled template cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        tasks = [{
+            'id': i,
+            'sentence': u'Sentence number {}'.format(i),
+            'language': 'English',
+            'image_url': 'https://example.com/{}.png'.format(i),
+            'option_a': i * 2,
+            'title': u'Title {}'.format(i),
+            'author': None
+        } for i in range(options['tasks'])]
+
+        start = time.time()
+        expected = [[render_with_django(s, data) for _, s in SAMPLE_ITEMS] for data in tasks]
+        parse_time = time.time() - start
+
+        start = time.time()
+        rendered = [[get_template_string(s, data, item_id) for item_id, s in SAMPLE_ITEMS] for data in tasks]
+        compiled_time = time.time() - start
+
+        if rendered != expected:
+            self.stderr.write('Compiled output does not match the template parser output')
+            return
+        self.stdout.write('{} tasks x {} items'.format(len(tasks), len(SAMPLE_ITEMS)))
+        self.stdout.write('parse per render: {:.3f}s'.format(parse_time))
+        self.stdout.write('compiled:         {:.3f}s ({:.1f}x)'.format(compiled_time,
+                                                                      parse_time / max(compiled_time, 1e-9)))
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from crowdsourcing.sql import find_plan_violations, get_registry, get_stats
+
+
+class Command(BaseCommand):
+    help = 'Fails if a captured plan of a named raw SQL statement scans the hot tables or exceeds its cost ceiling. ' \
+           'Plans are captured with SQL_EXPLAIN_SAMPLE_RATE, e.g. while exercising a generate_benchmark_data ' \
+           'database. crowdsourcing.tests.test_query_plans plans every statement against a fresh dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-seq-scan-rows', type=int, default=settings.SQL_PLAN_MAX_SEQ_SCAN_ROWS)
+        parser.add_argument('--require', nargs='*', default=None,
+                            help='statements that must have a captured plan, every registered statement by default')
+
+    def handle(self, *args, **options):
+        stats = dict([(s['name'], s) for s in get_stats()])
+        failures = []
+        required = options['require'] if options['require'] is not None else sorted(get_registry())
+        for name in required:
+            if name not in stats or stats[name]['plan'] is None:
+                failures.append('{}: no plan captured'.format(name))
+        for name, s in sorted(stats.items()):
+            if s['plan'] is None:
+                continue
+            for violation in find_plan_violations(s['plan']['plan'], options['max_seq_scan_rows'],
+                                                  settings.SQL_PLAN_COST_CEILINGS.get(name)):
+                failures.append('{}: {}'.format(name, violation))
+            self.stdout.write('{:<40} checked'.format(name))
+        if len(failures):
+            raise CommandError('Query plan regressions:\n' + '\n'.join(failures))
+        self.stdout.write('No query plan regressions')
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from crowdsourcing.benchmark import create_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic projects, tasks and task workers to measure queries against'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=50)
+        parser.add_argument('--tasks', type=int, default=200, help='tasks per project')
+        parser.add_argument('--workers', type=int, default=500)
+        parser.add_argument('--repetition', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='allow running when DEBUG is off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to write synthetic data with DEBUG off, use --force')
+        _, task_worker_count = create_benchmark_data(options['projects'], options['tasks'], options['workers'],
+                                                     options['repetition'], options['seed'])
+        self.stdout.write('Created {} projects, {} tasks and {} task workers'.format(
+            options['projects'], options['projects'] * options['tasks'], task_worker_count))
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crowdsourcing.sql import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows the calls and time of named raw SQL statements and their last captured plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plan', help='print the last captured plan of this statement')
+        parser.add_argument('--reset', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_stats()
+            self.stdout.write('SQL statistics cleared')
+            return
+        stats = get_stats()
+        if options['plan']:
+            plans = [s['plan'] for s in stats if s['name'] == options['plan'] and s['plan'] is not None]
+            if not len(plans):
+                self.stderr.write('No plan captured for {}'.format(options['plan']))
+                return
+            self.stdout.write(json.dumps(plans[0], indent=2))
+            return
+        self.stdout.write('{:<40} {:>10} {:>12} {:>12} {:>14}'.format('name', 'calls', 'total (s)', 'avg (ms)',
+                                                                      'last plan (ms)'))
+        for s in stats:
+            plan_time = ''
+            if s['plan'] is not None:
+                plan_time = '{:.1f}'.format(s['plan']['plan'][0].get('Execution Time', 0))
+            self.stdout.write('{:<40} {:>10} {:>12.3f} {:>12.2f} {:>14}'.format(s['name'], s['calls'], s['total'],
+                                                                             s['average'] * 1000, plan_time))
@@ -0,0 +1,175 @@
+import logging
+import random
+import threading
+import time
+
+from celery.signals import after_task_publish
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger('crowdsourcing.budget')
+_local = threading.local()
+
+
+class RequestBudget(object):
+    """
+    Records the SQL queries, database time, redis commands, celery tasks and external API calls of a block of code.
+
+    Used by RequestBudgetMiddleware for every request and directly in tests:
+
+        with RequestBudget() as budget:
+            self.client.post('/api/task-worker/', {'project': project.id})
+        budget.assert_within(queries=12)
+
+    Capturing queries forces the debug cursor and a database connection, without capture_queries only the cheap
+    counters are kept and queries and db_time stay None.
+    """
+
+    def __init__(self, name=None, capture_queries=True):
+        self.name = name
+        self.queries = None
+        self.db_time = None
+        self.redis_commands = 0
+        self.celery_tasks = 0
+        self.external_calls = 0
+        self.external_time = 0.0
+        self.duration = 0.0
+        self._captured = CaptureQueriesContext(connection) if capture_queries else None
+        self._parent = None
+        self._started = None
+
+    def __enter__(self):
+        self._parent = getattr(_local, 'budget', None)
+        _local.budget = self
+        if self._captured is not None:
+            self._captured.__enter__()
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.time() - self._started
+        if self._captured is not None:
+            self._captured.__exit__(exc_type, exc_value, traceback)
+            self.queries = len(self._captured.captured_queries)
+            self.db_time = sum([float(query['time']) for query in self._captured.captured_queries])
+        _local.budget = self._parent
+
+    def get_limits(self):
+        return settings.REQUEST_BUDGETS.get(self.name, {})
+
+    def exceeded(self, **limits):
+        limits = limits or self.get_limits()
+        return dict([(key, getattr(self, key)) for key, value in limits.items()
+                     if getattr(self, key) is not None and getattr(self, key) > value])
+
+    def assert_within(self, **limits):
+        exceeded = self.exceeded(**limits)
+        if len(exceeded):
+            raise AssertionError('{} exceeded its budget: {}'.format(self.name or 'Block', exceeded))
+
+    def as_dict(self):
+        return {
+            'view': self.name,
+            'queries': self.queries,
+            'db_time': round(self.db_time, 3) if self.db_time is not None else None,
+            'redis_commands': self.redis_commands,
+            'celery_tasks': self.celery_tasks,
+            'external_calls': self.external_calls,
+            'external_time': round(self.external_time, 3),
+            'duration': round(self.duration, 3)
+        }
+
+
+def get_current_budget():
+    return getattr(_local, 'budget', None)
+
+
+def get_active_budgets():
+    budget = get_current_budget()
+    while budget is not None:
+        yield budget
+        budget = budget._parent
+
+
+def record_redis_command():
+    for budget in get_active_budgets():
+        budget.redis_commands += 1
+
+
+def record_external_call(duration):
+    for budget in get_active_budgets():
+        budget.external_calls += 1
+        budget.external_time += duration
+
+
+@after_task_publish.connect
+def record_celery_task(**kwargs):
+    for budget in get_active_budgets():
+        budget.celery_tasks += 1
+
+
+def get_view_name(callback):
+    """
+    DRF views are named after the view class and the viewset action, e.g. TaskWorkerViewSet.create
+    """
+    view_class = getattr(callback, 'cls', None)
+    if view_class is None:
+        return getattr(callback, '__name__', None)
+    return view_class.__name__
+
+
+class RequestBudgetMiddleware(object):
+    def process_request(self, request):
+        # queries are only captured for a sample of the requests outside of DEBUG
+        capture_queries = settings.DEBUG or random.random() < settings.REQUEST_BUDGET_SAMPLE_RATE
+        request.budget = RequestBudget(capture_queries=capture_queries)
+        request.budget.__enter__()
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if not hasattr(request, 'budget'):
+            return None
+        name = get_view_name(callback)
+        actions = getattr(callback, 'actions', None)
+        if actions and request.method.lower() in actions:
+            name = '{}.{}'.format(name, actions[request.method.lower()])
+        request.budget.name = name
+        return None
+
+    def process_response(self, request, response):
+        budget = getattr(request, 'budget', None)
+        if budget is None:
+            return response
+        if response.streaming:
+            # the body of a streaming response is produced after this returns, its budget is closed once the
+            # last chunk has been sent and can only be logged
+            response.streaming_content = self.close_after(budget, response.streaming_content)
+            return response
+        stats = self.close(budget)
+        if settings.DEBUG:
+            response['X-Budget-View'] = stats['view'] or ''
+            response['X-Budget-Queries'] = stats['queries']
+            response['X-Budget-DB-Time'] = stats['db_time']
+            response['X-Budget-Redis-Commands'] = stats['redis_commands']
+            response['X-Budget-Celery-Tasks'] = stats['celery_tasks']
+            response['X-Budget-External-Calls'] = stats['external_calls']
+            response['X-Budget-External-Time'] = stats['external_time']
+        return response
+
+    def close_after(self, budget, content):
+        try:
+            for chunk in content:
+                yield chunk
+        finally:
+            self.close(budget)
+
+    @staticmethod
+    def close(budget):
+        budget.__exit__(None, None, None)
+        stats = budget.as_dict()
+        exceeded = budget.exceeded()
+        if len(exceeded):
+            logger.warning('request budget exceeded %s %s', stats, exceeded)
+        else:
+            logger.info('request budget %s', stats)
+        return stats
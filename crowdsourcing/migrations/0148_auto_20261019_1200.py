@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crowdsourcing', '0147_auto_20160919_1931'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='taskworker',
+            index_together=set([('updated_at', 'id')]),
+        ),
+    ]
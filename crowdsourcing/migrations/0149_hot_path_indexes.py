@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crowdsourcing', '0148_auto_20261019_1200'),
+    ]
+
+    operations = [
+        # latest revision of each task group: SELECT group_id, max(id) ... WHERE deleted_at IS NULL GROUP BY group_id
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_task_live_group_id_id
+              ON crowdsourcing_task (group_id, id)
+              WHERE deleted_at IS NULL;
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_task_live_group_id_id;'),
+        # assignable tasks: ... WHERE exclude_at IS NULL AND deleted_at IS NULL, joined to project and grouped
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_task_assignable_project_id_group_id
+              ON crowdsourcing_task (project_id, group_id, id)
+              WHERE exclude_at IS NULL AND deleted_at IS NULL;
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_task_assignable_project_id_group_id;'),
+        # own/others counts: task join reading worker_id and status without touching the heap
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_taskworker_task_id_worker_id_status
+              ON crowdsourcing_taskworker (task_id, worker_id, status);
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_taskworker_task_id_worker_id_status;'),
+        # is_done: tw.status IN (2, 3)
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_taskworker_completed_task_id
+              ON crowdsourcing_taskworker (task_id)
+              WHERE status IN (2, 3);
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_taskworker_completed_task_id;'),
+        # boomerang and worker dashboards: tw.worker_id = X AND tw.status NOT IN (4, 6, 7)
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_taskworker_active_worker_id_task_id
+              ON crowdsourcing_taskworker (worker_id, task_id)
+              WHERE status NOT IN (4, 6, 7);
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_taskworker_active_worker_id_task_id;'),
+        # expire_tasks: tw.status = 1 ordered by age
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_taskworker_in_progress_created_at
+              ON crowdsourcing_taskworker (created_at, task_id)
+              WHERE status = 1;
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_taskworker_in_progress_created_at;'),
+        # refund_task: latest non-draft revision of a project group
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_project_published_group_id_id
+              ON crowdsourcing_project (group_id, id DESC)
+              WHERE status <> 1;
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_project_published_group_id_id;'),
+    ]
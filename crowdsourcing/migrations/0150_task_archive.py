@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+TABLES = (
+    ('crowdsourcing_task', 'crowdsourcing_archivedtask'),
+    ('crowdsourcing_taskworker', 'crowdsourcing_archivedtaskworker'),
+    ('crowdsourcing_taskworkerresult', 'crowdsourcing_archivedtaskworkerresult'),
+)
+
+
+# archive tables mirror the live ones column for column, migrations that change a live table
+# have to apply the same change to its archive table and recreate the view
+def create_sql(live, archive):
+    return '''
+        CREATE TABLE {archive} (LIKE {live} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+        ALTER TABLE {archive} ADD PRIMARY KEY (id);
+        CREATE VIEW {live}_all AS SELECT * FROM {live} UNION ALL SELECT * FROM {archive};
+    '''.format(live=live, archive=archive)
+
+
+def drop_sql(live, archive):
+    return '''
+        DROP VIEW IF EXISTS {live}_all;
+        DROP TABLE IF EXISTS {archive};
+    '''.format(live=live, archive=archive)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crowdsourcing', '0149_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='tasks_archived_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunSQL(create_sql(*TABLES[0]), reverse_sql=drop_sql(*TABLES[0])),
+        migrations.RunSQL(create_sql(*TABLES[1]), reverse_sql=drop_sql(*TABLES[1])),
+        migrations.RunSQL(create_sql(*TABLES[2]), reverse_sql=drop_sql(*TABLES[2])),
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_archivedtask_project_id ON crowdsourcing_archivedtask (project_id);
+            CREATE INDEX crowdsourcing_archivedtask_batch_id ON crowdsourcing_archivedtask (batch_id);
+            CREATE INDEX crowdsourcing_archivedtask_rerun_key ON crowdsourcing_archivedtask (rerun_key);
+            CREATE INDEX crowdsourcing_archivedtaskworker_task_id ON crowdsourcing_archivedtaskworker (task_id);
+            CREATE INDEX crowdsourcing_archivedtaskworkerresult_task_worker_id
+              ON crowdsourcing_archivedtaskworkerresult (task_worker_id);
+        ''', reverse_sql=migrations.RunSQL.noop)
+    ]
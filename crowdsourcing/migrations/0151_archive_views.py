@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# the models read the views created in 0150_task_archive, nothing is created here
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0150_task_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskAll',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('revised_at', models.DateTimeField(auto_now_add=True)),
+                ('revision_log', models.CharField(blank=True, max_length=512, null=True)),
+                ('group_id', models.IntegerField(null=True)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('row_number', models.IntegerField(null=True)),
+                ('rerun_key', models.CharField(max_length=64, null=True)),
+                ('hash', models.CharField(max_length=64)),
+                ('min_rating', models.FloatField(default=3.0)),
+                ('rating_updated_at', models.DateTimeField(null=True)),
+                ('deleted_at', models.DateTimeField(null=True)),
+                ('batch', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING,
+                                            related_name='+', to='crowdsourcing.Batch')),
+                ('exclude_at', models.ForeignKey(db_column='exclude_at', null=True,
+                                                 on_delete=django.db.models.deletion.DO_NOTHING, related_name='+',
+                                                 to='crowdsourcing.Project')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+',
+                                              to='crowdsourcing.Project')),
+            ],
+            options={
+                'db_table': 'crowdsourcing_task_all',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TaskWorkerAll',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('revised_at', models.DateTimeField(auto_now_add=True)),
+                ('revision_log', models.CharField(blank=True, max_length=512, null=True)),
+                ('group_id', models.IntegerField(null=True)),
+                ('status', models.IntegerField(choices=[(1, 'In Progress'), (2, 'Submitted'), (3, 'Accepted'),
+                                                        (4, 'Rejected'), (5, 'Returned'), (6, 'Skipped'),
+                                                        (7, 'Expired')], default=1)),
+                ('is_paid', models.BooleanField(default=False)),
+                ('deleted_at', models.DateTimeField(null=True)),
+                ('collective_rejection', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING,
+                                                           related_name='+',
+                                                           to='crowdsourcing.CollectiveRejection')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING,
+                                           related_name='task_workers', to='crowdsourcing.TaskAll')),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+',
+                                             to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'crowdsourcing_taskworker_all',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TaskWorkerResultAll',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('deleted_at', models.DateTimeField(null=True)),
+                ('task_worker', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING,
+                                                  related_name='results', to='crowdsourcing.TaskWorkerAll')),
+                ('template_item', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING,
+                                                    related_name='+', to='crowdsourcing.TemplateItem')),
+            ],
+            options={
+                'db_table': 'crowdsourcing_taskworkerresult_all',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crowdsourcing', '0151_archive_views'),
+    ]
+
+    operations = [
+        # changes feed: ORDER BY updated_at, id over crowdsourcing_taskworker_all
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_archivedtaskworker_updated_at_id
+              ON crowdsourcing_archivedtaskworker (updated_at, id);
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_archivedtaskworker_updated_at_id;'),
+        # worker dashboard: tw.worker_id = X over crowdsourcing_taskworker_all
+        migrations.RunSQL('''
+            CREATE INDEX crowdsourcing_archivedtaskworker_worker_id_task_id
+              ON crowdsourcing_archivedtaskworker (worker_id, task_id);
+        ''', reverse_sql='DROP INDEX IF EXISTS crowdsourcing_archivedtaskworker_worker_id_task_id;'),
+    ]
@@ -8,6 +8,7 @@ from django.db import models
 from django.utils import timezone
 from oauth2client.django_orm import FlowField, CredentialsField
 
+from crowdsourcing import sql
 from crowdsourcing.utils import get_delimiter, get_worker_cache
 
 
@@ -289,6 +290,119 @@ class BatchFile(TimeStampable, Archivable):
         super(BatchFile, self).delete(*args, **kwargs)
 
 
+# noinspection SqlResolve
+sql.register('task_feed', '''
+    WITH projects AS (
+        SELECT
+            ratings.project_id,
+            ratings.min_rating new_min_rating,
+            requester_ratings.requester_rating,
+            requester_ratings.raw_rating,
+            p_available.remaining available_tasks
+        FROM crowdsourcing_project p
+        INNER JOIN (SELECT
+              p.id,
+              count(t.id) remaining
+
+            FROM crowdsourcing_task t INNER JOIN (SELECT
+                                                    group_id,
+                                                    max(id) id
+                                                  FROM crowdsourcing_task
+                                                  WHERE deleted_at IS NULL
+                                                  GROUP BY group_id) t_max ON t_max.id = t.id
+              INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+              INNER JOIN (
+                           SELECT
+                             t.group_id,
+                             sum(t.own)    own,
+                             sum(t.others) others
+                           FROM (
+                                  SELECT
+                                    t.group_id,
+                                    CASE WHEN tw.worker_id = (%(worker_id)s) AND tw.status <> 6
+                                      THEN 1
+                                    ELSE 0 END own,
+                                    CASE WHEN (tw.worker_id IS NOT NULL AND tw.worker_id <> (%(worker_id)s))
+                                        AND tw.status NOT IN (4, 6, 7)
+                                      THEN 1
+                                    ELSE 0 END others
+                                  FROM crowdsourcing_task t
+                                    LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
+                                                                                    tw.task_id)
+                                  WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
+                           GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
+            WHERE t_count.own = 0 AND t_count.others < p.repetition
+            GROUP BY p.id) p_available ON p_available.id = p.id
+
+        INNER JOIN (
+            SELECT
+                u.id,
+                u.username,
+                CASE WHEN e.id IS NOT NULL
+                  THEN TRUE
+                ELSE FALSE END is_denied
+            FROM auth_user u
+                LEFT OUTER JOIN crowdsourcing_requesteraccesscontrolgroup g
+                  ON g.requester_id = u.id AND g.type = 2 AND g.is_global = TRUE
+                LEFT OUTER JOIN crowdsourcing_workeraccesscontrolentry e
+                  ON e.group_id = g.id AND e.worker_id = (%(worker_id)s)) requester
+                  ON requester.id=p.owner_id
+                LEFT OUTER JOIN (
+                    SELECT
+                        qualification_id,
+                        json_agg(i.expression::JSON) expressions
+                    FROM crowdsourcing_qualificationitem i
+                    GROUP BY i.qualification_id
+                ) quals
+            ON quals.qualification_id = p.qualification_id
+        INNER JOIN get_min_project_ratings() ratings
+            ON p.id = ratings.project_id
+        LEFT OUTER JOIN (
+            SELECT
+                requester_id,
+                requester_rating AS raw_rating,
+                CASE WHEN requester_rating IS NULL AND requester_avg_rating
+                                                    IS NOT NULL
+                THEN requester_avg_rating
+                WHEN requester_rating IS NULL AND requester_avg_rating IS NULL
+                THEN 1.99
+                WHEN requester_rating IS NOT NULL AND requester_avg_rating IS NULL
+                THEN requester_rating
+                ELSE requester_rating + 0.1 * requester_avg_rating END requester_rating
+           FROM get_requester_ratings(%(worker_id)s)) requester_ratings
+            ON requester_ratings.requester_id = ratings.owner_id
+          LEFT OUTER JOIN (SELECT
+                             requester_id,
+                             CASE WHEN worker_rating IS NULL AND worker_avg_rating
+                                                                 IS NOT NULL
+                               THEN worker_avg_rating
+                             WHEN worker_rating IS NULL AND worker_avg_rating IS NULL
+                               THEN 1.99
+                             WHEN worker_rating IS NOT NULL AND worker_avg_rating IS NULL
+                               THEN worker_rating
+                             ELSE worker_rating + 0.1 * worker_avg_rating END worker_rating
+                           FROM get_worker_ratings(%(worker_id)s)) worker_ratings
+            ON worker_ratings.requester_id = ratings.owner_id
+               AND worker_ratings.worker_rating >= ratings.min_rating
+        WHERE coalesce(p.deadline, NOW() + INTERVAL '1 minute') > NOW() AND p.status = 3 AND deleted_at IS NULL
+          AND (requester.is_denied = FALSE OR p.enable_blacklist = FALSE)
+          AND is_worker_qualified(quals.expressions, (%(worker_data)s)::JSON)
+        ORDER BY requester_rating DESC
+            )
+    UPDATE crowdsourcing_project p SET min_rating=min_rating
+    FROM projects
+    WHERE projects.project_id=p.id
+    RETURNING p.id, p.name, p.price, p.owner_id, p.created_at, p.allow_feedback,
+    p.is_prototype, projects.requester_rating, projects.raw_rating, projects.available_tasks,
+    (SELECT rp.id FROM crowdsourcing_project rp
+     WHERE rp.parent_id = p.group_id AND rp.is_review = TRUE AND rp.deleted_at IS NULL
+     ORDER BY rp.id LIMIT 1) review_project_id,
+    (SELECT rp.price FROM crowdsourcing_project rp
+     WHERE rp.parent_id = p.group_id AND rp.is_review = TRUE AND rp.deleted_at IS NULL
+     ORDER BY rp.id LIMIT 1) review_project_price;
+''')
+
+
 class ProjectQueryset(models.query.QuerySet):
     def active(self):
         return self.filter(deleted_at__isnull=True)
@@ -300,113 +414,8 @@ class ProjectQueryset(models.query.QuerySet):
         worker_cache = get_worker_cache(worker.id)
         worker_data = json.dumps(worker_cache)
 
-        # noinspection SqlResolve
-        query = '''
-            WITH projects AS (
-                SELECT
-                    ratings.project_id,
-                    ratings.min_rating new_min_rating,
-                    requester_ratings.requester_rating,
-                    requester_ratings.raw_rating,
-                    p_available.remaining available_tasks
-                FROM crowdsourcing_project p
-                INNER JOIN (SELECT
-                      p.id,
-                      count(t.id) remaining
-
-                    FROM crowdsourcing_task t INNER JOIN (SELECT
-                                                            group_id,
-                                                            max(id) id
-                                                          FROM crowdsourcing_task
-                                                          WHERE deleted_at IS NULL
-                                                          GROUP BY group_id) t_max ON t_max.id = t.id
-                      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                      INNER JOIN (
-                                   SELECT
-                                     t.group_id,
-                                     sum(t.own)    own,
-                                     sum(t.others) others
-                                   FROM (
-                                          SELECT
-                                            t.group_id,
-                                            CASE WHEN tw.worker_id = (%(worker_id)s) AND tw.status <> 6
-                                              THEN 1
-                                            ELSE 0 END own,
-                                            CASE WHEN (tw.worker_id IS NOT NULL AND tw.worker_id <> (%(worker_id)s))
-                                                AND tw.status NOT IN (4, 6, 7)
-                                              THEN 1
-                                            ELSE 0 END others
-                                          FROM crowdsourcing_task t
-                                            LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
-                                                                                            tw.task_id)
-                                          WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
-                                   GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
-                    WHERE t_count.own = 0 AND t_count.others < p.repetition
-                    GROUP BY p.id) p_available ON p_available.id = p.id
-
-                INNER JOIN (
-                    SELECT
-                        u.id,
-                        u.username,
-                        CASE WHEN e.id IS NOT NULL
-                          THEN TRUE
-                        ELSE FALSE END is_denied
-                    FROM auth_user u
-                        LEFT OUTER JOIN crowdsourcing_requesteraccesscontrolgroup g
-                          ON g.requester_id = u.id AND g.type = 2 AND g.is_global = TRUE
-                        LEFT OUTER JOIN crowdsourcing_workeraccesscontrolentry e
-                          ON e.group_id = g.id AND e.worker_id = (%(worker_id)s)) requester
-                          ON requester.id=p.owner_id
-                        LEFT OUTER JOIN (
-                            SELECT
-                                qualification_id,
-                                json_agg(i.expression::JSON) expressions
-                            FROM crowdsourcing_qualificationitem i
-                            GROUP BY i.qualification_id
-                        ) quals
-                    ON quals.qualification_id = p.qualification_id
-                INNER JOIN get_min_project_ratings() ratings
-                    ON p.id = ratings.project_id
-                LEFT OUTER JOIN (
-                    SELECT
-                        requester_id,
-                        requester_rating AS raw_rating,
-                        CASE WHEN requester_rating IS NULL AND requester_avg_rating
-                                                            IS NOT NULL
-                        THEN requester_avg_rating
-                        WHEN requester_rating IS NULL AND requester_avg_rating IS NULL
-                        THEN 1.99
-                        WHEN requester_rating IS NOT NULL AND requester_avg_rating IS NULL
-                        THEN requester_rating
-                        ELSE requester_rating + 0.1 * requester_avg_rating END requester_rating
-                   FROM get_requester_ratings(%(worker_id)s)) requester_ratings
-                    ON requester_ratings.requester_id = ratings.owner_id
-                  LEFT OUTER JOIN (SELECT
-                                     requester_id,
-                                     CASE WHEN worker_rating IS NULL AND worker_avg_rating
-                                                                         IS NOT NULL
-                                       THEN worker_avg_rating
-                                     WHEN worker_rating IS NULL AND worker_avg_rating IS NULL
-                                       THEN 1.99
-                                     WHEN worker_rating IS NOT NULL AND worker_avg_rating IS NULL
-                                       THEN worker_rating
-                                     ELSE worker_rating + 0.1 * worker_avg_rating END worker_rating
-                                   FROM get_worker_ratings(%(worker_id)s)) worker_ratings
-                    ON worker_ratings.requester_id = ratings.owner_id
-                       AND worker_ratings.worker_rating >= ratings.min_rating
-                WHERE coalesce(p.deadline, NOW() + INTERVAL '1 minute') > NOW() AND p.status = 3 AND deleted_at IS NULL
-                  AND (requester.is_denied = FALSE OR p.enable_blacklist = FALSE)
-                  AND is_worker_qualified(quals.expressions, (%(worker_data)s)::JSON)
-                ORDER BY requester_rating DESC
-                    )
-            UPDATE crowdsourcing_project p SET min_rating=min_rating
-            FROM projects
-            WHERE projects.project_id=p.id
-            RETURNING p.id, p.name, p.price, p.owner_id, p.created_at, p.allow_feedback,
-            p.is_prototype, projects.requester_rating, projects.raw_rating, projects.available_tasks;
-            '''
         # DM disabled update here now happens on bg job --projects.new_min_rating
-        return self.raw(query, params={
+        return sql.raw('task_feed', self, params={
             'worker_id': worker.id,
             'st_in_progress': Project.STATUS_IN_PROGRESS,
             'worker_data': worker_data
@@ -487,6 +496,8 @@ class Project(TimeStampable, Archivable, Revisable):
     published_at = models.DateTimeField(null=True)
 
     amount_due = models.DecimalField(decimal_places=2, max_digits=8, default=0)
+    # tasks of the whole group live in the archive tables, see crowdsourcing.archive
+    tasks_archived_at = models.DateTimeField(null=True)
 
     objects = ProjectQueryset.as_manager()
 
@@ -530,6 +541,15 @@ class TemplateItem(TimeStampable):
     class Meta:
         ordering = ['position']
 
+    def save(self, *args, **kwargs):
+        super(TemplateItem, self).save(*args, **kwargs)
+        # cached template payloads are keyed by the template's updated_at
+        Template.objects.filter(id=self.template_id).update(updated_at=timezone.now())
+
+    def delete(self, *args, **kwargs):
+        super(TemplateItem, self).delete(*args, **kwargs)
+        Template.objects.filter(id=self.template_id).update(updated_at=timezone.now())
+
 
 class TemplateItemProperties(TimeStampable):
     template_item = models.ForeignKey(TemplateItem, related_name='properties')
@@ -572,6 +592,7 @@ class Task(TimeStampable, Archivable, Revisable):
 
     class Meta:
         index_together = (('rerun_key', 'hash',),)
+        # partial indexes on (group_id, id) and (project_id, group_id, id) are created in 0149_hot_path_indexes
 
 
 class TaskWorker(TimeStampable, Archivable, Revisable):
@@ -601,6 +622,8 @@ class TaskWorker(TimeStampable, Archivable, Revisable):
 
     class Meta:
         unique_together = ('task', 'worker')
+        index_together = [['updated_at', 'id']]
+        # covering and per-status partial indexes are created in 0149_hot_path_indexes
 
 
 class TaskWorkerResult(TimeStampable, Archivable):
@@ -609,6 +632,51 @@ class TaskWorkerResult(TimeStampable, Archivable):
     template_item = models.ForeignKey(TemplateItem, related_name='+')
 
 
+# read only models over the <live table>_all views of crowdsourcing.archive, results of archived project groups
+# are read through them without moving the group back into the hot tables
+class TaskAll(TimeStampable, Revisable):
+    project = models.ForeignKey(Project, related_name='+', on_delete=models.DO_NOTHING)
+    data = JSONField(null=True)
+    exclude_at = models.ForeignKey(Project, related_name='+', db_column='exclude_at', null=True,
+                                   on_delete=models.DO_NOTHING)
+    row_number = models.IntegerField(null=True)
+    rerun_key = models.CharField(max_length=64, null=True)
+    batch = models.ForeignKey('Batch', related_name='+', null=True, on_delete=models.DO_NOTHING)
+    hash = models.CharField(max_length=64)
+    min_rating = models.FloatField(default=3.0)
+    rating_updated_at = models.DateTimeField(null=True)
+    deleted_at = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'crowdsourcing_task_all'
+
+
+class TaskWorkerAll(TimeStampable, Revisable):
+    task = models.ForeignKey(TaskAll, related_name='task_workers', on_delete=models.DO_NOTHING)
+    worker = models.ForeignKey(User, related_name='+', on_delete=models.DO_NOTHING)
+    status = models.IntegerField(choices=TaskWorker.STATUS, default=TaskWorker.STATUS_IN_PROGRESS)
+    is_paid = models.BooleanField(default=False)
+    collective_rejection = models.ForeignKey(CollectiveRejection, related_name='+', null=True,
+                                             on_delete=models.DO_NOTHING)
+    deleted_at = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'crowdsourcing_taskworker_all'
+
+
+class TaskWorkerResultAll(TimeStampable):
+    task_worker = models.ForeignKey(TaskWorkerAll, related_name='results', on_delete=models.DO_NOTHING)
+    result = JSONField(null=True)
+    template_item = models.ForeignKey(TemplateItem, related_name='+', on_delete=models.DO_NOTHING)
+    deleted_at = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'crowdsourcing_taskworkerresult_all'
+
+
 class WorkerProjectScore(TimeStampable):
     project_group_id = models.IntegerField()
     worker = models.ForeignKey(User, related_name='project_scores')
@@ -1,12 +1,20 @@
 from ws4redis.publisher import redis_connection_pool, StrictRedis
 
 
+class InstrumentedStrictRedis(StrictRedis):
+    def execute_command(self, *args, **options):
+        from crowdsourcing.middleware.budget import record_redis_command
+
+        record_redis_command()
+        return super(InstrumentedStrictRedis, self).execute_command(*args, **options)
+
+
 class RedisProvider(object):
     def __init__(self, **kwargs):
-        self._connection = StrictRedis(connection_pool=redis_connection_pool)
+        self._connection = InstrumentedStrictRedis(connection_pool=redis_connection_pool)
 
-    def set(self, key, value, expire=None):
-        return self._connection.set(name=key, value=value)
+    def set(self, key, value, expire=None, nx=False):
+        return self._connection.set(name=key, value=value, ex=expire, nx=nx)
 
     def get(self, key):
         return self._connection.get(name=key)
@@ -14,17 +22,41 @@ class RedisProvider(object):
     def push(self, key, values):
         return self._connection.lpush(key, values)
 
+    def delete(self, key):
+        return self._connection.delete(key)
+
+    def expire(self, key, seconds):
+        return self._connection.expire(name=key, time=seconds)
+
     def exists(self, key):
         return self._connection.exists(name=key)
 
     def get_list(self, key):
         return self._connection.lrange(name=key, start=0, end=-1)
 
+    def pop_list(self, key, count):
+        """
+        Atomically removes and returns up to count of the oldest values pushed to a list, oldest first.
+        """
+        pipe = self._connection.pipeline()
+        pipe.lrange(key, -count, -1)
+        pipe.ltrim(key, 0, -count - 1)
+        return list(reversed(pipe.execute()[0]))
+
     def set_scan(self, key, match=None):
         return self._connection.sscan_iter(name=key, match=match)
 
-    def set_add(self, key, values):
-        return self._connection.sadd(key, values)
+    def set_add(self, key, *values):
+        return self._connection.sadd(key, *values)
+
+    def pop_set(self, key):
+        """
+        Atomically removes a set and returns its members.
+        """
+        pipe = self._connection.pipeline()
+        pipe.smembers(key)
+        pipe.delete(key)
+        return pipe.execute()[0]
 
     def set_hash(self, key, id, value):
         return self._connection.hset(key, id, value)
@@ -50,9 +82,24 @@ class RedisProvider(object):
     def hincrby(self, name, key, amount=1):
         return self._connection.hincrby(name, key, amount)
 
+    def hincrbyfloat(self, name, key, amount=1.0):
+        return self._connection.hincrbyfloat(name, key, amount)
+
     def smembers(self, name):
         return self._connection.smembers(name)
 
+    def zadd(self, name, score, value):
+        return self._connection.zadd(name, score, value)
+
+    def zscore(self, name, value):
+        return self._connection.zscore(name, value)
+
+    def zrangebyscore(self, name, min, max):
+        return self._connection.zrangebyscore(name, min, max)
+
+    def zrem(self, name, *values):
+        return self._connection.zrem(name, *values)
+
     @staticmethod
     def build_key(prefix, key):
         return str(prefix) + ':' + str(key)
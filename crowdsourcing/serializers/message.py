@@ -76,6 +76,9 @@ class ConversationSerializer(DynamicFieldsModelSerializer):
         return conversation
 
     def get_recipient_names(self, obj):
+        if obj is not None and 'recipients' in getattr(obj, '_prefetched_objects_cache', {}):
+            username = self.context.get('request').user.username
+            return [recipient.username for recipient in obj.recipients.all() if recipient.username != username]
         if obj is not None:
             return obj.recipients.values_list('username', flat=True).filter(
                 ~Q(username=self.context.get('request').user))
@@ -83,10 +86,15 @@ class ConversationSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_last_message(obj):
-        return MessageSerializer(instance=obj.messages.order_by('-created_at').first(),
-                                 fields=('body', 'created_at', 'time_relative')).data
+        if hasattr(obj, 'last_message'):
+            last_message = obj.last_message
+        else:
+            last_message = obj.messages.order_by('-created_at').first()
+        return MessageSerializer(instance=last_message, fields=('body', 'created_at', 'time_relative')).data
 
     def get_is_sender_online(self, obj):
+        if obj and obj.sender_id and 'online_senders' in self.context:
+            return self.context['online_senders'].get(obj.sender_id) > 0
         if obj and obj.sender:
             provider = RedisProvider()
             return provider.get_status('online', obj.sender.id) > 0
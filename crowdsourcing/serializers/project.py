@@ -66,12 +66,18 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
         data = super(ProjectSerializer, self).to_representation(instance)
         task_time = int(instance.task_time.total_seconds() / 60) if instance.task_time is not None else None
         timeout = int(instance.timeout.total_seconds() / 60) if instance.timeout is not None else None
-        review_project = models.Project.objects.filter(parent_id=instance.group_id, is_review=True,
-                                                       deleted_at__isnull=True).first()
-        if review_project is not None:
-            review_price = review_project.price
+        if hasattr(instance, 'review_project_id'):
+            # list queries annotate the review project instead of querying it for each project
+            has_review = instance.review_project_id is not None
+            review_price = instance.review_project_price
+        else:
+            review_project = models.Project.objects.filter(parent_id=instance.group_id, is_review=True,
+                                                           deleted_at__isnull=True).first()
+            has_review = review_project is not None
+            review_price = review_project.price if has_review else None
+        if has_review:
             data.update({'review_price': review_price})
-        data.update({'has_review': review_project is not None})
+        data.update({'has_review': has_review})
         data.update({'task_time': task_time, 'timeout': timeout})
         data.update({'price': instance.price})
         return data
@@ -183,10 +189,14 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_total_tasks(obj):
+        if hasattr(obj, 'task_count'):
+            return obj.task_count
         return obj.tasks.all().count()
 
     @staticmethod
     def get_has_comments(obj):
+        if hasattr(obj, 'comment_count'):
+            return obj.comment_count > 0
         return obj.comments.count() > 0
 
     @staticmethod
@@ -393,6 +403,8 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_revisions(obj):
+        if hasattr(obj, 'revision_ids'):
+            return obj.revision_ids
         return models.Project.objects.active().filter(group_id=obj.group_id).order_by('id').values_list('id',
                                                                                                         flat=True)
 
@@ -1,14 +1,21 @@
 from __future__ import division
 
+import copy
+from collections import OrderedDict
+
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Count, Manager, QuerySet
+from hashids import Hashids
 from operator import itemgetter
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from crowdsourcing import models
+from crowdsourcing import sql
 from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
 from crowdsourcing.serializers.message import CommentSerializer
-from crowdsourcing.serializers.template import TemplateSerializer
+from crowdsourcing.serializers.template import get_prerendered_items, get_template_payload, render_template_item
 from crowdsourcing.tasks import create_tasks
 from crowdsourcing.utils import get_template_string, hash_task
 from crowdsourcing.validators.task import ItemValidator
@@ -59,6 +66,129 @@ class TaskWorkerResultSerializer(DynamicFieldsModelSerializer):
         return None
 
 
+class TaskWorkerListSerializer(serializers.ListSerializer):
+    """
+    Resolves the per object lookups of TaskWorkerSerializer with one query per field for the whole list.
+    """
+
+    def to_representation(self, data):
+        task_workers = data.all() if isinstance(data, Manager) else data
+        if isinstance(task_workers, QuerySet):
+            task_workers = task_workers.select_related('worker', 'task__project__owner')
+            if 'results' in self.child.fields:
+                task_workers = task_workers.prefetch_related('results__template_item')
+        task_workers = list(task_workers)
+        if len(task_workers):
+            self.resolve(task_workers)
+        return [self.child.to_representation(item) for item in task_workers]
+
+    def resolve(self, task_workers):
+        fields = self.child.fields
+        task_ids = set([tw.task_id for tw in task_workers])
+
+        if 'worker_rating' in fields:
+            ratings = {}
+            for rating in models.Rating.objects.values('id', 'weight', 'origin_id', 'target_id', 'task_id') \
+                    .filter(task_id__in=task_ids, target_id__in=set([tw.worker_id for tw in task_workers])) \
+                    .order_by('-updated_at'):
+                ratings.setdefault((rating['origin_id'], rating['target_id'], rating['task_id']),
+                                   {'id': rating['id'], 'weight': rating['weight']})
+            for tw in task_workers:
+                tw.prefetched_rating = ratings.get((tw.task.project.owner_id, tw.worker_id, tw.task_id))
+
+        if 'expected' in fields:
+            counts = dict(models.TaskWorker.objects.filter(task_id__in=task_ids,
+                                                           status__in=[models.TaskWorker.STATUS_ACCEPTED,
+                                                                       models.TaskWorker.STATUS_SUBMITTED])
+                          .values('task_id').annotate(count=Count('id')).values_list('task_id', 'count'))
+            for tw in task_workers:
+                tw.prefetched_expected = counts.get(tw.task_id, 0)
+
+        if 'return_feedback' in fields:
+            feedback = {}
+            for rf in models.ReturnFeedback.objects.filter(task_worker_id__in=[tw.id for tw in task_workers]):
+                feedback.setdefault(rf.task_worker_id, rf)
+            for tw in task_workers:
+                tw.prefetched_return_feedback = feedback.get(tw.id)
+
+
+# noinspection SqlResolve
+sql.register('assign_task', '''
+    SELECT
+      t.id,
+      p.id
+
+    FROM crowdsourcing_task t INNER JOIN (SELECT
+                                            group_id,
+                                            max(id) id
+                                          FROM crowdsourcing_task
+                                          WHERE deleted_at IS NULL
+                                          GROUP BY group_id) t_max ON t_max.id = t.id
+      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      INNER JOIN (
+                   SELECT
+                     t.group_id,
+                     sum(t.own)    own,
+                     sum(t.others) others
+                   FROM (
+                          SELECT
+                            t.group_id,
+                            CASE WHEN tw.worker_id = (%(worker_id)s)
+                              THEN 1
+                            ELSE 0 END own,
+                            CASE WHEN (tw.worker_id IS NOT NULL AND tw.worker_id <> (%(worker_id)s))
+                             AND tw.status NOT IN (4, 6, 7)
+                              THEN 1
+                            ELSE 0 END others
+                          FROM crowdsourcing_task t
+                            LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
+                                                                            tw.task_id)
+                          WHERE exclude_at IS NULL AND t.deleted_at IS NULL) t
+                   GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
+    WHERE t_count.own = 0 AND t_count.others < p.repetition AND p.id=(%(project_id)s)
+    AND p.status = 3 LIMIT 1
+''')
+
+
+# noinspection SqlResolve
+sql.register('assign_skipped_task', '''
+    SELECT
+        t.id,
+        t.group_id,
+        p.id project_id
+    FROM crowdsourcing_task t INNER JOIN (SELECT
+                                            group_id,
+                                            max(id) id
+                                          FROM crowdsourcing_task
+                                          WHERE deleted_at IS NULL
+                                          GROUP BY group_id) t_max ON t_max.id = t.id
+      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      INNER JOIN (
+                   SELECT
+                     t.group_id,
+                     sum(t.own)    own,
+                     sum(t.others) others
+                   FROM (
+                          SELECT
+                            t.group_id,
+                            CASE WHEN tw.worker_id = (%(worker_id)s) AND tw.status <> 6
+                              THEN 1
+                            ELSE 0 END own,
+                            CASE WHEN (tw.worker_id IS NOT NULL
+                            AND tw.worker_id <> (%(worker_id)s))
+                             AND tw.status NOT IN (4, 6, 7)
+                              THEN 1
+                            ELSE 0 END others
+                          FROM crowdsourcing_task t
+                            LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
+                                                                            tw.task_id)
+                          WHERE exclude_at IS NULL AND t.deleted_at IS NULL) t
+                   GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
+    WHERE t_count.own = 0 AND t_count.others < p.repetition AND p.id=(%(project_id)s)
+    AND p.status = 3 LIMIT 1
+''')
+
+
 class TaskWorkerSerializer(DynamicFieldsModelSerializer):
     import multiprocessing
 
@@ -84,6 +214,7 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
                   'return_feedback', 'task_data', 'expected', 'task_group_id')
         read_only_fields = ('task', 'worker', 'results', 'created_at', 'updated_at',
                             'return_feedback', 'task_data', 'expected', 'task_group_id')
+        list_serializer_class = TaskWorkerListSerializer
 
     def create(self, **kwargs):
         project = kwargs['project']
@@ -91,85 +222,13 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
         task_worker = {}
         with self.lock:
             with transaction.atomic():  # select_for_update(nowait=False)
-                # noinspection SqlResolve
-                query = '''
-                    SELECT
-                      t.id,
-                      p.id
-
-                    FROM crowdsourcing_task t INNER JOIN (SELECT
-                                                            group_id,
-                                                            max(id) id
-                                                          FROM crowdsourcing_task
-                                                          WHERE deleted_at IS NULL
-                                                          GROUP BY group_id) t_max ON t_max.id = t.id
-                      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                      INNER JOIN (
-                                   SELECT
-                                     t.group_id,
-                                     sum(t.own)    own,
-                                     sum(t.others) others
-                                   FROM (
-                                          SELECT
-                                            t.group_id,
-                                            CASE WHEN tw.worker_id = (%(worker_id)s)
-                                              THEN 1
-                                            ELSE 0 END own,
-                                            CASE WHEN (tw.worker_id IS NOT NULL AND tw.worker_id <> (%(worker_id)s))
-                                             AND tw.status NOT IN (4, 6, 7)
-                                              THEN 1
-                                            ELSE 0 END others
-                                          FROM crowdsourcing_task t
-                                            LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
-                                                                                            tw.task_id)
-                                          WHERE exclude_at IS NULL AND t.deleted_at IS NULL) t
-                                   GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
-                    WHERE t_count.own = 0 AND t_count.others < p.repetition AND p.id=(%(project_id)s)
-                    AND p.status = 3 LIMIT 1
-                    '''
-
-                tasks = models.Task.objects.raw(query, params={'project_id': project,
-                                                               'worker_id': kwargs['worker'].id})
+
+                tasks = sql.raw('assign_task', models.Task.objects,
+                                params={'project_id': project, 'worker_id': kwargs['worker'].id})
 
                 if not len(list(tasks)):
-                    # noinspection SqlResolve
-                    tasks = models.Task.objects.raw(
-                        '''
-                            SELECT
-                                t.id,
-                                t.group_id,
-                                p.id project_id
-                            FROM crowdsourcing_task t INNER JOIN (SELECT
-                                                                    group_id,
-                                                                    max(id) id
-                                                                  FROM crowdsourcing_task
-                                                                  WHERE deleted_at IS NULL
-                                                                  GROUP BY group_id) t_max ON t_max.id = t.id
-                              INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                              INNER JOIN (
-                                           SELECT
-                                             t.group_id,
-                                             sum(t.own)    own,
-                                             sum(t.others) others
-                                           FROM (
-                                                  SELECT
-                                                    t.group_id,
-                                                    CASE WHEN tw.worker_id = (%(worker_id)s) AND tw.status <> 6
-                                                      THEN 1
-                                                    ELSE 0 END own,
-                                                    CASE WHEN (tw.worker_id IS NOT NULL
-                                                    AND tw.worker_id <> (%(worker_id)s))
-                                                     AND tw.status NOT IN (4, 6, 7)
-                                                      THEN 1
-                                                    ELSE 0 END others
-                                                  FROM crowdsourcing_task t
-                                                    LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
-                                                                                                    tw.task_id)
-                                                  WHERE exclude_at IS NULL AND t.deleted_at IS NULL) t
-                                           GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
-                            WHERE t_count.own = 0 AND t_count.others < p.repetition AND p.id=(%(project_id)s)
-                            AND p.status = 3 LIMIT 1
-                        ''', params={'project_id': project, 'worker_id': kwargs['worker'].id})
+                    tasks = sql.raw('assign_skipped_task', models.Task.objects,
+                                    params={'project_id': project, 'worker_id': kwargs['worker'].id})
                     skipped = True
                 if len(list(tasks)) and not skipped:
                     task_worker = models.TaskWorker.objects.create(worker=kwargs['worker'], task=tasks[0])
@@ -189,9 +248,12 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_worker_rating(obj):
-        rating = models.Rating.objects.values('id', 'weight') \
-            .filter(origin_id=obj.task.project.owner_id, target_id=obj.worker_id, task_id=obj.task_id) \
-            .order_by('-updated_at').first()
+        if hasattr(obj, 'prefetched_rating'):
+            rating = copy.copy(obj.prefetched_rating)
+        else:
+            rating = models.Rating.objects.values('id', 'weight') \
+                .filter(origin_id=obj.task.project.owner_id, target_id=obj.worker_id, task_id=obj.task_id) \
+                .order_by('-updated_at').first()
         if rating is None:
             rating = {
                 'id': None,
@@ -220,6 +282,8 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_return_feedback(obj):
+        if hasattr(obj, 'prefetched_return_feedback'):
+            return ReturnFeedbackSerializer(obj.prefetched_return_feedback).data
         return ReturnFeedbackSerializer(obj.return_feedback.first()).data
 
     @staticmethod
@@ -232,6 +296,8 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_expected(obj):
+        if hasattr(obj, 'prefetched_expected'):
+            return max(obj.prefetched_expected, obj.task.project.repetition)
         return max(models.TaskWorker.objects.filter(task_id=obj.task_id,
                                                     status__in=[models.TaskWorker.STATUS_ACCEPTED,
                                                                 models.TaskWorker.STATUS_SUBMITTED]).count(),
@@ -310,57 +376,68 @@ class TaskSerializer(DynamicFieldsModelSerializer):
 
     def get_template(self, obj, return_type='full'):
         task_worker = None
-        if return_type == 'full':
-            template = TemplateSerializer(instance=obj.project.template, many=False).data
-        else:
-            template = \
-                TemplateSerializer(instance=obj.project.template, many=False, fields=('id', 'items')).data
+        identifier = None
+        payload = get_template_payload(obj.project.template)
+        template = copy.copy(payload['template'])
+        if return_type != 'full':
+            template = OrderedDict([('id', template['id']), ('items', template['items'])])
         data = obj.data
         if 'task_worker' in self.context:
             task_worker = self.context['task_worker']
-        for item in template['items']:
+        prerendered = None
+        if settings.TASK_PRERENDER_ENABLED and len(payload['variable_items']):
+            prerendered = get_prerendered_items(obj.project.template, obj)
+        items = []
+        for cached_item in template['items']:
+            # only items that are going to change are copied, the cached payload is shared between renders
+            needs_render = False
+            if prerendered is not None and cached_item['id'] in prerendered:
+                item = copy.copy(cached_item)
+                item['aux_attributes'] = prerendered[item['id']]
+            elif cached_item['id'] in payload['variable_items']:
+                item = copy.deepcopy(cached_item)
+                needs_render = True
+            else:
+                item = copy.copy(cached_item)
             aux_attrib = item['aux_attributes']
-            if 'src' in aux_attrib:
-                aux_attrib['src'] = get_template_string(aux_attrib['src'], data)
-
-            if 'question' in aux_attrib:
-                aux_attrib['question']['value'] = get_template_string(aux_attrib['question']['value'], data)
-
-            if 'options' in aux_attrib:
-
-                if obj.project.is_review and 'task_workers' in obj.data:
-                    aux_attrib['options'] = []
-                    display_labels = ['Top one', 'Bottom one']
-                    sorted_task_workers = sorted(obj.data['task_workers'], key=itemgetter('task_worker'))
-                    # TODO change this to id
-                    for index, tw in enumerate(sorted_task_workers):
-                        aux_attrib['options'].append(
-                            {
-                                "value": tw['task_worker'],
-                                "display_value": display_labels[index],
-                                "data_source": [],
-                                "position": index + 1
-                            }
-                        )
-                for option in aux_attrib['options']:
-                    option['value'] = get_template_string(option['value'], data)
+
+            if 'options' in aux_attrib and obj.project.is_review and 'task_workers' in obj.data:
+                aux_attrib = item['aux_attributes'] = copy.copy(aux_attrib)
+                aux_attrib['options'] = []
+                display_labels = ['Top one', 'Bottom one']
+                sorted_task_workers = sorted(obj.data['task_workers'], key=itemgetter('task_worker'))
+                # TODO change this to id
+                for index, tw in enumerate(sorted_task_workers):
+                    aux_attrib['options'].append(
+                        {
+                            "value": get_template_string(tw['task_worker'], data, item['id']),
+                            "display_value": display_labels[index],
+                            "data_source": [],
+                            "position": index + 1
+                        }
+                    )
+
+            if needs_render:
+                render_template_item(item, data)
 
             if item['type'] == 'iframe':
-                from django.conf import settings
-                from hashids import Hashids
-                identifier = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
                 if hasattr(task_worker, 'id'):
+                    if identifier is None:
+                        identifier = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
                     item['identifier'] = identifier.encode(task_worker.id, task_worker.task.id, item['id'])
                 else:
                     item['identifier'] = 'READ_ONLY'
             if item['role'] == 'input' and task_worker is not None:
                 for result in task_worker.results.all():
                     if item['type'] == 'checkbox' and result.template_item_id == item['id']:
-                        item['aux_attributes']['options'] = result.result  # might need to loop through options
+                        # might need to loop through options
+                        item['aux_attributes'] = copy.copy(item['aux_attributes'])
+                        item['aux_attributes']['options'] = result.result
                     elif result.template_item_id == item['id']:
                         item['answer'] = result.result
+            items.append(item)
 
-        template['items'] = sorted(template['items'], key=lambda k: k['position'])
+        template['items'] = items
         return template
 
     @staticmethod
@@ -381,14 +458,20 @@ class TaskSerializer(DynamicFieldsModelSerializer):
 
     @staticmethod
     def get_worker_count(obj):
+        if hasattr(obj, 'submitted_count'):
+            return obj.submitted_count
         return obj.task_workers.filter(status__in=[2, 3, 5]).count()
 
     @staticmethod
     def get_completed(obj):
+        if hasattr(obj, 'submitted_count'):
+            return obj.submitted_count
         return obj.task_workers.filter(status__in=[2, 3, 5]).count()
 
     @staticmethod
     def get_total(obj):
+        if hasattr(obj, 'project_repetition'):
+            return obj.project_repetition
         return obj.project.repetition
 
 
@@ -1,8 +1,13 @@
 import copy
+import json
+from collections import OrderedDict
+
 from crowdsourcing import models
 from rest_framework import serializers
+from crowdsourcing.redis import RedisProvider
 from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
-from crowdsourcing.utils import create_copy
+from crowdsourcing.utils import create_copy, get_template_string, get_template_tokens
+from csp import settings
 from rest_framework.exceptions import ValidationError
 
 
@@ -118,3 +123,107 @@ class TemplateSerializer(DynamicFieldsModelSerializer):
 class TemplateItemPropertiesSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.TemplateItemProperties
+
+
+def get_template_values(aux_attributes):
+    values = []
+    if 'src' in aux_attributes:
+        values.append(aux_attributes['src'])
+    if 'question' in aux_attributes:
+        values.append(aux_attributes['question']['value'])
+    for option in aux_attributes.get('options', []):
+        values.append(option['value'])
+    return values
+
+
+def render_template_item(item, data):
+    aux_attrib = item['aux_attributes']
+    if 'src' in aux_attrib:
+        aux_attrib['src'] = get_template_string(aux_attrib['src'], data, item['id'])
+    if 'question' in aux_attrib:
+        aux_attrib['question']['value'] = get_template_string(aux_attrib['question']['value'], data, item['id'])
+    for option in aux_attrib.get('options', []):
+        option['value'] = get_template_string(option['value'], data, item['id'])
+
+
+def build_template_payload(template):
+    """
+    Serializes a template revision, items without variables are rendered here and the rest are listed in
+    variable_items to be rendered against each task's data.
+    """
+    data = OrderedDict(TemplateSerializer(instance=template, many=False).data)
+    data['items'] = sorted(data['items'], key=lambda k: k['position'])
+    variable_items = []
+    for item in data['items']:
+        if any([len(get_template_tokens(value)) for value in get_template_values(item['aux_attributes'])]):
+            variable_items.append(item['id'])
+        else:
+            render_template_item(item, {})
+    return {"template": data, "variable_items": variable_items}
+
+
+_template_payloads = {}
+
+
+def get_template_payload(template):
+    """
+    Template revisions don't change once published, so their payload is cached in-process and in Redis by
+    template id and updated_at. The returned payload is shared and must be copied before it is modified.
+    """
+    key = RedisProvider.build_key('template', '{}:{}'.format(template.id, template.updated_at.isoformat()))
+    payload = _template_payloads.get(key)
+    if payload is None:
+        provider = RedisProvider()
+        cached = provider.get(key)
+        if cached is not None:
+            payload = json.loads(cached, object_pairs_hook=OrderedDict)
+        else:
+            payload = build_template_payload(template)
+            provider.set(key, json.dumps(payload), expire=settings.TEMPLATE_PAYLOAD_TTL)
+        payload['variable_items'] = set(payload['variable_items'])
+        if len(_template_payloads) >= settings.TEMPLATE_PAYLOAD_CACHE_SIZE:
+            _template_payloads.clear()
+        _template_payloads[key] = payload
+    return payload
+
+
+def get_prerendered_key(template):
+    return RedisProvider.build_key('task_payload', '{}:{}'.format(template.id, template.updated_at.isoformat()))
+
+
+def prerender_task_items(template, tasks):
+    """
+    Stores the rendered variable items of each task under the template revision, tasks are (id, hash, data).
+    """
+    payload = get_template_payload(template)
+    if not len(payload['variable_items']):
+        return 0
+    items = [item for item in payload['template']['items'] if item['id'] in payload['variable_items']]
+    mapping = {}
+    for task_id, task_hash, data in tasks:
+        rendered = {}
+        for item in items:
+            item = copy.deepcopy(item)
+            render_template_item(item, data)
+            rendered[item['id']] = item['aux_attributes']
+        mapping[task_id] = json.dumps({"hash": task_hash, "items": rendered})
+    if len(mapping):
+        provider = RedisProvider()
+        key = get_prerendered_key(template)
+        provider.hmset(key, mapping)
+        provider.expire(key, settings.TEMPLATE_PAYLOAD_TTL)
+    return len(mapping)
+
+
+def get_prerendered_items(template, task):
+    """
+    Rendered aux_attributes of the task's variable items by item id, or None if the task was not prerendered
+    or its data changed since.
+    """
+    cached = RedisProvider().get_status(get_prerendered_key(template), task.id)
+    if cached is None:
+        return None
+    prerendered = json.loads(cached)
+    if task.hash is None or prerendered['hash'] != task.hash:
+        return None
+    return {int(item_id): aux_attributes for item_id, aux_attributes in prerendered['items'].items()}
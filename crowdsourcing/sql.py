@@ -0,0 +1,171 @@
+import importlib
+import json
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from crowdsourcing.redis import RedisProvider
+
+logger = logging.getLogger('crowdsourcing.sql')
+
+STATS_CALLS_KEY = 'sql_stats:calls'
+STATS_TIME_KEY = 'sql_stats:time'
+PLANS_KEY = 'sql_stats:plans'
+
+# modules whose named statements are registered when they are imported
+STATEMENT_MODULES = (
+    'crowdsourcing.archive',
+    'crowdsourcing.models',
+    'crowdsourcing.serializers.task',
+    'crowdsourcing.tasks',
+    'crowdsourcing.viewsets.project',
+    'crowdsourcing.viewsets.task',
+    'mturk.interface',
+    'mturk.tasks',
+)
+
+registry = {}
+_pending = {}
+_lock = threading.Lock()
+_last_flush = [time.time()]
+
+
+def register(name, query):
+    """
+    Declares a hand-written statement under its name, call sites run it by that name only.
+    """
+    if registry.get(name, query) != query:
+        raise ValueError('Statement {} is already registered with a different query'.format(name))
+    registry[name] = query
+    return query
+
+
+def get_registry():
+    """
+    Returns every named statement of the project, importing the modules that declare them.
+    """
+    for module in STATEMENT_MODULES:
+        importlib.import_module(module)
+    return dict(registry)
+
+
+def execute(name, params=None, cursor=None):
+    """
+    Runs a registered statement so that its calls and time can be followed per statement.
+    Returns the cursor it was executed on.
+    """
+    query = registry[name]
+    if cursor is None:
+        cursor = connection.cursor()
+    started = time.time()
+    cursor.execute(query, params)
+    record(name, time.time() - started, query, params)
+    return cursor
+
+
+def raw(name, manager, params=None):
+    """
+    Named counterpart of Model.objects.raw, the instances are fetched right away so the time includes the fetch.
+    """
+    query = registry[name]
+    started = time.time()
+    instances = list(manager.raw(query, params=params))
+    record(name, time.time() - started, query, params)
+    return instances
+
+
+def record(name, duration, query, params):
+    with _lock:
+        calls, total = _pending.get(name, (0, 0.0))
+        _pending[name] = (calls + 1, total + duration)
+        flush = time.time() - _last_flush[0] >= settings.SQL_STATS_FLUSH_INTERVAL
+        if flush:
+            pending = dict(_pending)
+            _pending.clear()
+            _last_flush[0] = time.time()
+    if flush:
+        flush_stats(pending)
+    if settings.SQL_EXPLAIN_SAMPLE_RATE and random.random() < settings.SQL_EXPLAIN_SAMPLE_RATE:
+        capture_plan(name, query, params, duration)
+
+
+def flush_stats(pending):
+    provider = RedisProvider()
+    for name, (calls, total) in pending.items():
+        provider.hincrby(STATS_CALLS_KEY, name, calls)
+        provider.hincrbyfloat(STATS_TIME_KEY, name, total)
+
+
+def capture_plan(name, query, params, duration):
+    """
+    Stores the latest EXPLAIN (ANALYZE, BUFFERS) of a statement. The statement runs again for this, in a
+    transaction that is always rolled back so that updates are not applied twice.
+    """
+    try:
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, params)
+            plan = cursor.fetchone()[0]
+            transaction.set_rollback(True)
+    except Exception:
+        logger.exception('Could not capture the plan of %s', name)
+        return
+    RedisProvider().set_hash(PLANS_KEY, name, json.dumps({
+        "captured_at": timezone.now().isoformat(),
+        "duration": duration,
+        "plan": plan
+    }))
+
+
+def get_stats():
+    provider = RedisProvider()
+    calls = provider.hgetall(STATS_CALLS_KEY)
+    times = provider.hgetall(STATS_TIME_KEY)
+    plans = provider.hgetall(PLANS_KEY)
+    stats = []
+    for name, count in calls.items():
+        total = float(times.get(name, 0))
+        plan = json.loads(plans[name]) if name in plans else None
+        stats.append({
+            "name": name,
+            "calls": int(count),
+            "total": total,
+            "average": total / int(count) if int(count) else 0,
+            "plan": plan
+        })
+    return sorted(stats, key=lambda s: s['total'], reverse=True)
+
+
+def reset_stats():
+    provider = RedisProvider()
+    for key in (STATS_CALLS_KEY, STATS_TIME_KEY, PLANS_KEY):
+        provider.delete(key)
+
+
+def iter_plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        for descendant in iter_plan_nodes(child):
+            yield descendant
+
+
+def find_plan_violations(plan, max_seq_scan_rows, cost_ceiling=None):
+    """
+    Returns the problems of a captured JSON plan, sequential scans of the hot tables over max_seq_scan_rows rows
+    and a total cost above cost_ceiling.
+    """
+    root = plan[0]['Plan']
+    violations = []
+    for node in iter_plan_nodes(root):
+        if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') in settings.SQL_PLAN_HOT_TABLES:
+            rows = node.get('Actual Rows', node.get('Plan Rows', 0)) * node.get('Actual Loops', 1)
+            if rows > max_seq_scan_rows:
+                violations.append('Seq Scan on {} reading {} rows'.format(node['Relation Name'], rows))
+    if cost_ceiling is not None and root.get('Total Cost', 0) > cost_ceiling:
+        violations.append('total cost {} above {}'.format(root['Total Cost'], cost_ceiling))
+    return violations
@@ -1,40 +1,51 @@
+import json
+import tempfile
 from collections import OrderedDict
 from decimal import Decimal
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.db import connection, transaction
 from django.db.models import F, Q
 from django.utils import timezone
+from ws4redis.publisher import RedisPublisher
+from ws4redis.redis_store import RedisMessage
 
 from crowdsourcing import models
 import constants
+from crowdsourcing import sql
 from crowdsourcing.emails import send_notifications_email
 from crowdsourcing.redis import RedisProvider
 from crowdsourcing.utils import PayPalBackend, hash_task
 from csp.celery import app as celery_app
+from mturk.tasks import mark_project_dirty, mark_tasks_dirty, queue_expired_task_workers
+
+
+# noinspection SqlResolve
+sql.register('expire_tasks', '''
+    WITH taskworkers AS (
+        SELECT
+          tw.id,
+          p.id project_id
+        FROM crowdsourcing_taskworker tw
+        INNER JOIN crowdsourcing_task t ON  tw.task_id = t.id
+        INNER JOIN crowdsourcing_project p ON t.project_id = p.id
+        WHERE tw.created_at + coalesce(p.timeout, INTERVAL '24 hour') < NOW()
+        AND tw.status=%(in_progress)s)
+        UPDATE crowdsourcing_taskworker tw_up SET status=%(expired)s, updated_at=now()
+    FROM taskworkers
+    WHERE taskworkers.id=tw_up.id
+    RETURNING tw_up.id, tw_up.worker_id, tw_up.task_id
+''')
 
 
 @celery_app.task(ignore_result=True)
 def expire_tasks():
     cursor = connection.cursor()
-    # noinspection SqlResolve
-    query = '''
-            WITH taskworkers AS (
-                SELECT
-                  tw.id,
-                  p.id project_id
-                FROM crowdsourcing_taskworker tw
-                INNER JOIN crowdsourcing_task t ON  tw.task_id = t.id
-                INNER JOIN crowdsourcing_project p ON t.project_id = p.id
-                WHERE tw.created_at + coalesce(p.timeout, INTERVAL '24 hour') < NOW()
-                AND tw.status=%(in_progress)s)
-                UPDATE crowdsourcing_taskworker tw_up SET status=%(expired)s
-            FROM taskworkers
-            WHERE taskworkers.id=tw_up.id
-            RETURNING tw_up.id, tw_up.worker_id
-        '''
-    cursor.execute(query,
-                   {'in_progress': models.TaskWorker.STATUS_IN_PROGRESS, 'expired': models.TaskWorker.STATUS_EXPIRED})
+    sql.execute('expire_tasks',
+                {'in_progress': models.TaskWorker.STATUS_IN_PROGRESS, 'expired': models.TaskWorker.STATUS_EXPIRED},
+                cursor)
     workers = cursor.fetchall()
     worker_list = []
     task_workers = []
@@ -43,6 +54,8 @@ def expire_tasks():
         task_workers.append({'id': w[0]})
     refund_task.delay(task_workers)
     update_worker_cache.delay(worker_list, constants.TASK_EXPIRED)
+    mark_tasks_dirty(list(set([w[2] for w in workers])))
+    queue_expired_task_workers([w[0] for w in workers])
     return 'SUCCESS'
 
 
@@ -310,150 +323,8 @@ def refund_task(task_worker_in):
     return 'SUCCESS'
 
 
-@celery_app.task(ignore_result=True)
-def update_feed_boomerang():
-    # TODO fix group_id
-    cursor = connection.cursor()
-    # noinspection SqlResolve
-    query = '''
-        WITH boomerang_ratings AS (
-            SELECT pid, min_rating, tasks_in_progress, task_count,
-             CASE WHEN task_count > 0 AND ((tasks_in_progress > 0 AND
-               task_count/tasks_in_progress >= (%(BOOMERANG_LAMBDA)s))
-               OR tasks_in_progress = 0) THEN min_rating
-            WHEN avg_worker_rating <= (%(BOOMERANG_MIDPOINT)s) AND min_rating>(%(BOOMERANG_MIDPOINT)s)
-            THEN (%(BOOMERANG_MIDPOINT)s)
-
-            ELSE avg_worker_rating
-            END new_min_rating
-        FROM (SELECT t.pid, t.min_rating, t.tasks_in_progress, t.task_count,
-               max(t.avg_worker_rating) avg_worker_rating FROM (
-            SELECT
-              p.id pid,
-              p.min_rating,
-              p.tasks_in_progress,
-              t.task_count,
-              round(coalesce(m.task_w_avg, -- mp.requester_w_avg, m_platform.platform_w_avg,
-              (%(BOOMERANG_MIDPOINT)s))::NUMERIC, 2)
-               avg_worker_rating
-            FROM crowdsourcing_project p
-              INNER JOIN (SELECT
-                            p1.group_id  pgid,
-                            count(tw.id) task_count
-                          FROM crowdsourcing_task t
-                          INNER JOIN crowdsourcing_project p1 ON t.project_id = p1.id
-                            LEFT OUTER JOIN crowdsourcing_taskworker tw
-                              ON t.id = tw.task_id AND tw.status IN (1, 2, 3, 5)
-                                 AND tw.created_at BETWEEN now() -
-                                                           ((%(HEART_BEAT_BOOMERANG)s) ||' minute')::INTERVAL AND now()
-                          GROUP BY p1.group_id) t ON t.pgid = p.group_id
-              LEFT OUTER JOIN (
-                        SELECT
-                          target_id,
-                          username,
-                          sum(weight * power((%(BOOMERANG_PLATFORM_ALPHA)s), r.row_number))
-                          / sum(power((%(BOOMERANG_PLATFORM_ALPHA)s), r.row_number)) platform_w_avg
-                        FROM (
-
-                               SELECT
-                                 r.id,
-                                 u.username                        username,
-                                 weight,
-                                 r.target_id,
-                                 -1 + row_number()
-                                 OVER (PARTITION BY target_id
-                                   ORDER BY tw.created_at DESC) AS row_number
-
-                               FROM crowdsourcing_rating r
-                                 INNER JOIN crowdsourcing_task t ON t.id = r.task_id
-                                 INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
-                                   and tw.worker_id=r.target_id
-                                 INNER JOIN auth_user u ON u.id = r.target_id
-                               WHERE origin_type = (%(origin_type)s)
-                             ) r
-                        GROUP BY target_id, username) m_platform ON TRUE
-                        --ON m_platform.platform_w_avg < p.min_rating
-
-              LEFT OUTER JOIN (
-                               SELECT
-                                 target_id,
-                                 origin_id,
-                                 sum(weight * power((%(BOOMERANG_REQUESTER_ALPHA)s), t.row_number))
-                                 / sum(power((%(BOOMERANG_REQUESTER_ALPHA)s), t.row_number)) requester_w_avg
-                               FROM (
-
-                                      SELECT
-                                        r.id,
-                                        r.origin_id,
-                                        weight,
-                                        r.target_id,
-                                        -1 + row_number()
-                                        OVER (PARTITION BY target_id
-                                          ORDER BY tw.created_at DESC) AS row_number
-
-                                      FROM crowdsourcing_rating r
-                                        INNER JOIN crowdsourcing_task t ON t.id = r.task_id
-                                        INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
-                                          and tw.worker_id=r.target_id
-                                      WHERE origin_type = (%(origin_type)s)) t
-                               GROUP BY origin_id, target_id)
-                             mp ON mp.origin_id = p.owner_id
-                             AND mp.target_id = m_platform.target_id
-                             ---AND mp.requester_w_avg < p.min_rating
-              LEFT OUTER JOIN (
-                               SELECT
-                                 target_id,
-                                 origin_id,
-                                 project_id,
-                                 sum(weight * power((%(BOOMERANG_TASK_ALPHA)s), t.row_number))
-                                 / sum(power((%(BOOMERANG_TASK_ALPHA)s), t.row_number)) task_w_avg
-                               FROM (
-
-                                      SELECT
-                                        r.id,
-                                        r.origin_id,
-                                        p.id                              project_id,
-                                        weight,
-                                        r.target_id,
-                                        -1 + row_number()
-                                        OVER (PARTITION BY target_id
-                                          ORDER BY tw.created_at DESC) AS row_number
-
-                                      FROM crowdsourcing_rating r
-                                        INNER JOIN crowdsourcing_task t ON t.id = r.task_id
-                                        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                                        INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
-                                          and tw.worker_id=r.target_id
-                                      WHERE origin_type = (%(origin_type)s)) t
-                               GROUP BY origin_id, target_id, project_id)
-                             m ON m.origin_id = p.owner_id AND p.id = m.project_id
-                             AND m.target_id = mp.target_id
-                             --AND m.task_w_avg < p.min_rating
-              INNER JOIN (SELECT
-                            group_id,
-                            max(id) max_id
-                          FROM crowdsourcing_project
-                          WHERE status = (%(in_progress)s) AND deleted_at IS NULL
-                          GROUP BY group_id) most_recent
-                ON most_recent.max_id = p.id
-            WHERE p.rating_updated_at < now() + ('4 second')::INTERVAL -
-               ((%(HEART_BEAT_BOOMERANG)s) ||' minute')::INTERVAL AND p.min_rating > 0
-            ) t WHERE t.avg_worker_rating < t.min_rating
-            GROUP BY t.pid, t.min_rating, t.task_count, t.tasks_in_progress) combined
-            )
-        UPDATE crowdsourcing_project p
-        SET min_rating = boomerang_ratings.new_min_rating, rating_updated_at = now(), tasks_in_progress = CASE WHEN
-            boomerang_ratings.new_min_rating <> p.min_rating OR (boomerang_ratings.new_min_rating = p.min_rating AND
-              boomerang_ratings.task_count > boomerang_ratings.tasks_in_progress)
-            THEN boomerang_ratings.task_count ELSE
-            boomerang_ratings.tasks_in_progress END, previous_min_rating = boomerang_ratings.min_rating
-        FROM boomerang_ratings
-        WHERE boomerang_ratings.pid = p.id
-        RETURNING p.id, p.group_id, p.min_rating, p.rating_updated_at
-    '''
-
-    # noinspection SqlResolve
-    task_boomerang_query = '''
+# noinspection SqlResolve
+sql.register('feed_boomerang_tasks', '''
         WITH boomerang_ratings AS (
         SELECT
           tid,
@@ -607,8 +478,152 @@ def update_feed_boomerang():
     FROM boomerang_ratings
     WHERE boomerang_ratings.tid = t.id
     RETURNING t.id, t.group_id, t.min_rating, t.rating_updated_at;
-    '''
+''')
+
+
+# noinspection SqlResolve
+sql.register('feed_boomerang_projects', '''
+    WITH boomerang_ratings AS (
+        SELECT pid, min_rating, tasks_in_progress, task_count,
+         CASE WHEN task_count > 0 AND ((tasks_in_progress > 0 AND
+           task_count/tasks_in_progress >= (%(BOOMERANG_LAMBDA)s))
+           OR tasks_in_progress = 0) THEN min_rating
+        WHEN avg_worker_rating <= (%(BOOMERANG_MIDPOINT)s) AND min_rating>(%(BOOMERANG_MIDPOINT)s)
+        THEN (%(BOOMERANG_MIDPOINT)s)
+
+        ELSE avg_worker_rating
+        END new_min_rating
+    FROM (SELECT t.pid, t.min_rating, t.tasks_in_progress, t.task_count,
+           max(t.avg_worker_rating) avg_worker_rating FROM (
+        SELECT
+          p.id pid,
+          p.min_rating,
+          p.tasks_in_progress,
+          t.task_count,
+          round(coalesce(m.task_w_avg, -- mp.requester_w_avg, m_platform.platform_w_avg,
+          (%(BOOMERANG_MIDPOINT)s))::NUMERIC, 2)
+           avg_worker_rating
+        FROM crowdsourcing_project p
+          INNER JOIN (SELECT
+                        p1.group_id  pgid,
+                        count(tw.id) task_count
+                      FROM crowdsourcing_task t
+                      INNER JOIN crowdsourcing_project p1 ON t.project_id = p1.id
+                        LEFT OUTER JOIN crowdsourcing_taskworker tw
+                          ON t.id = tw.task_id AND tw.status IN (1, 2, 3, 5)
+                             AND tw.created_at BETWEEN now() -
+                                                       ((%(HEART_BEAT_BOOMERANG)s) ||' minute')::INTERVAL AND now()
+                      GROUP BY p1.group_id) t ON t.pgid = p.group_id
+          LEFT OUTER JOIN (
+                    SELECT
+                      target_id,
+                      username,
+                      sum(weight * power((%(BOOMERANG_PLATFORM_ALPHA)s), r.row_number))
+                      / sum(power((%(BOOMERANG_PLATFORM_ALPHA)s), r.row_number)) platform_w_avg
+                    FROM (
+
+                           SELECT
+                             r.id,
+                             u.username                        username,
+                             weight,
+                             r.target_id,
+                             -1 + row_number()
+                             OVER (PARTITION BY target_id
+                               ORDER BY tw.created_at DESC) AS row_number
+
+                           FROM crowdsourcing_rating r
+                             INNER JOIN crowdsourcing_task t ON t.id = r.task_id
+                             INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
+                               and tw.worker_id=r.target_id
+                             INNER JOIN auth_user u ON u.id = r.target_id
+                           WHERE origin_type = (%(origin_type)s)
+                         ) r
+                    GROUP BY target_id, username) m_platform ON TRUE
+                    --ON m_platform.platform_w_avg < p.min_rating
+
+          LEFT OUTER JOIN (
+                           SELECT
+                             target_id,
+                             origin_id,
+                             sum(weight * power((%(BOOMERANG_REQUESTER_ALPHA)s), t.row_number))
+                             / sum(power((%(BOOMERANG_REQUESTER_ALPHA)s), t.row_number)) requester_w_avg
+                           FROM (
+
+                                  SELECT
+                                    r.id,
+                                    r.origin_id,
+                                    weight,
+                                    r.target_id,
+                                    -1 + row_number()
+                                    OVER (PARTITION BY target_id
+                                      ORDER BY tw.created_at DESC) AS row_number
+
+                                  FROM crowdsourcing_rating r
+                                    INNER JOIN crowdsourcing_task t ON t.id = r.task_id
+                                    INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
+                                      and tw.worker_id=r.target_id
+                                  WHERE origin_type = (%(origin_type)s)) t
+                           GROUP BY origin_id, target_id)
+                         mp ON mp.origin_id = p.owner_id
+                         AND mp.target_id = m_platform.target_id
+                         ---AND mp.requester_w_avg < p.min_rating
+          LEFT OUTER JOIN (
+                           SELECT
+                             target_id,
+                             origin_id,
+                             project_id,
+                             sum(weight * power((%(BOOMERANG_TASK_ALPHA)s), t.row_number))
+                             / sum(power((%(BOOMERANG_TASK_ALPHA)s), t.row_number)) task_w_avg
+                           FROM (
+
+                                  SELECT
+                                    r.id,
+                                    r.origin_id,
+                                    p.id                              project_id,
+                                    weight,
+                                    r.target_id,
+                                    -1 + row_number()
+                                    OVER (PARTITION BY target_id
+                                      ORDER BY tw.created_at DESC) AS row_number
+
+                                  FROM crowdsourcing_rating r
+                                    INNER JOIN crowdsourcing_task t ON t.id = r.task_id
+                                    INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                                    INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
+                                      and tw.worker_id=r.target_id
+                                  WHERE origin_type = (%(origin_type)s)) t
+                           GROUP BY origin_id, target_id, project_id)
+                         m ON m.origin_id = p.owner_id AND p.id = m.project_id
+                         AND m.target_id = mp.target_id
+                         --AND m.task_w_avg < p.min_rating
+          INNER JOIN (SELECT
+                        group_id,
+                        max(id) max_id
+                      FROM crowdsourcing_project
+                      WHERE status = (%(in_progress)s) AND deleted_at IS NULL
+                      GROUP BY group_id) most_recent
+            ON most_recent.max_id = p.id
+        WHERE p.rating_updated_at < now() + ('4 second')::INTERVAL -
+           ((%(HEART_BEAT_BOOMERANG)s) ||' minute')::INTERVAL AND p.min_rating > 0
+        ) t WHERE t.avg_worker_rating < t.min_rating
+        GROUP BY t.pid, t.min_rating, t.task_count, t.tasks_in_progress) combined
+        )
+    UPDATE crowdsourcing_project p
+    SET min_rating = boomerang_ratings.new_min_rating, rating_updated_at = now(), tasks_in_progress = CASE WHEN
+        boomerang_ratings.new_min_rating <> p.min_rating OR (boomerang_ratings.new_min_rating = p.min_rating AND
+          boomerang_ratings.task_count > boomerang_ratings.tasks_in_progress)
+        THEN boomerang_ratings.task_count ELSE
+        boomerang_ratings.tasks_in_progress END, previous_min_rating = boomerang_ratings.min_rating
+    FROM boomerang_ratings
+    WHERE boomerang_ratings.pid = p.id
+    RETURNING p.id, p.group_id, p.min_rating, p.rating_updated_at
+''')
+
 
+@celery_app.task(ignore_result=True)
+def update_feed_boomerang():
+    # TODO fix group_id
+    cursor = connection.cursor()
     params = {
         'in_progress': models.Project.STATUS_IN_PROGRESS,
         'HEART_BEAT_BOOMERANG': settings.HEART_BEAT_BOOMERANG,
@@ -619,14 +634,14 @@ def update_feed_boomerang():
         'BOOMERANG_LAMBDA': settings.BOOMERANG_LAMBDA,
         'origin_type': models.Rating.RATING_REQUESTER
     }
-    cursor.execute(query, params)
+    sql.execute('feed_boomerang_projects', params, cursor)
     projects = cursor.fetchall()
     tasks = []
     if cursor.rowcount > 0:
         params.update({'skipped': models.TaskWorker.STATUS_SKIPPED, 'rejected': models.TaskWorker.STATUS_REJECTED,
                        'expired': models.TaskWorker.STATUS_EXPIRED, 'BOOMERANG_MAX': settings.BOOMERANG_MAX,
                        'BOOMERANG_WORKERS_NEEDED': settings.BOOMERANG_WORKERS_NEEDED})
-        cursor.execute(task_boomerang_query, params)
+        sql.execute('feed_boomerang_tasks', params, cursor)
         tasks = cursor.fetchall()
 
     logs = []
@@ -638,6 +653,10 @@ def update_feed_boomerang():
                                         rating_updated_at=task[3],
                                         reason='DEFAULT'))
     models.BoomerangLog.objects.bulk_create(logs)
+    # changed thresholds move the HITs of these projects and tasks to other HIT types
+    for project in projects:
+        mark_project_dirty(project[1])
+    mark_tasks_dirty([task[0] for task in tasks])
 
     return 'SUCCESS: {} rows affected'.format(cursor.rowcount)
 
@@ -652,3 +671,75 @@ def update_project_boomerang(project_id):
         models.BoomerangLog.objects.create(object_id=project.group_id, min_rating=project.min_rating,
                                            rating_updated_at=project.rating_updated_at, reason='RESET')
     return 'SUCCESS'
+
+
+@celery_app.task(ignore_result=True)
+def export_results(owner_id, key, filters, export_format):
+    from crowdsourcing.exports import ResultsExport
+
+    provider = RedisProvider()
+    job_key = provider.build_key('export', key)
+    owner = User.objects.get(pk=owner_id)
+    redis_publisher = RedisPublisher(facility='bot', users=[owner])
+    export = ResultsExport(**filters)
+    total = export.count()
+
+    def publish(export_status, processed, url=None):
+        message = {
+            "type": "EXPORT",
+            "payload": {
+                "key": key,
+                "status": export_status,
+                "format": export_format,
+                "processed": processed,
+                "total": total,
+                "url": url
+            }
+        }
+        redis_publisher.publish_message(RedisMessage(json.dumps(message)))
+
+    try:
+        with tempfile.TemporaryFile() as output:
+            export.write(output, export_format, on_chunk=lambda processed: publish('in_progress', processed))
+            output.seek(0)
+            file_name = default_storage.save('exports/{}.{}'.format(key, export_format), File(output))
+    except Exception:
+        provider.delete(job_key)
+        publish('failed', 0)
+        raise
+
+    provider.set(job_key, file_name, expire=constants.EXPORT_FILE_TTL)
+    publish('done', total, default_storage.url(file_name))
+    return 'SUCCESS'
+
+
+@celery_app.task(ignore_result=True)
+def prerender_tasks(project_id):
+    from crowdsourcing.serializers.template import prerender_task_items
+
+    project = models.Project.objects.select_related('template').filter(pk=project_id).first()
+    if project is None or project.template is None:
+        return 'NOOP'
+    tasks = models.Task.objects.filter(project_id=project_id, hash__isnull=False)
+    if tasks.count() < settings.TASK_PRERENDER_MIN_TASKS:
+        return 'NOOP'
+    last_id = 0
+    while True:
+        chunk = list(tasks.filter(id__gt=last_id).order_by('id').values_list('id', 'hash', 'data')[:1000])
+        if not len(chunk):
+            break
+        prerender_task_items(project.template, chunk)
+        last_id = chunk[-1][0]
+    return 'SUCCESS'
+
+
+@celery_app.task(ignore_result=True)
+def archive_projects():
+    from crowdsourcing.archive import archive_project_group, get_archivable_groups
+
+    if not settings.ARCHIVE_ENABLED:
+        return 'NOOP'
+    groups = get_archivable_groups(settings.ARCHIVE_BATCH_SIZE)
+    for group_id in groups:
+        archive_project_group(group_id)
+    return 'SUCCESS' if len(groups) else 'NOOP'
@@ -1,4 +1,148 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
-import unittest
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from rest_framework.test import APIClient
+
+from crowdsourcing import models
+from crowdsourcing.archive import archive_project_group
+from crowdsourcing.benchmark import create_benchmark_data
+
+
+class RequesterProjectsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.requester, _ = create_benchmark_data(projects=3, tasks=10, workers=10, repetition=2)
+        project = models.Project.objects.filter(owner=cls.requester).order_by('id').first()
+        review = models.Project.objects.create(name='Review', owner=cls.requester, template=project.template,
+                                               parent_id=project.group_id, is_review=True, price=0.5)
+        review.group_id = review.id
+        review.save()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.requester)
+
+    def test_requester_projects(self):
+        response = self.client.get('/api/project/for-requesters/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(set(p['id'] for p in response.data),
+                         set(models.Project.objects.filter(owner=self.requester, is_review=False)
+                             .values_list('id', flat=True)))
+
+    def test_changes_limit(self):
+        project = models.Project.objects.filter(owner=self.requester, is_review=False).order_by('id').first()
+        path = '/api/project/{}/changes/'.format(project.id)
+        self.assertEqual(self.client.get(path, {'limit': 'ten'}).status_code, 400)
+        response = self.client.get(path, {'limit': -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.data['task_workers']), 1)
+
+    def test_download_results_of_others(self):
+        project = models.Project.objects.filter(owner=self.requester, is_review=False).order_by('id').first()
+        self.client.force_authenticate(user=User.objects.create(username='download_stranger'))
+        response = self.client.get('/api/file/download-results/', {'project_id': project.id})
+        self.assertEqual(response.status_code, 404)
+
+
+class ArchivedReadsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.requester, _ = create_benchmark_data(projects=1, tasks=10, workers=10, repetition=2)
+        cls.project = models.Project.objects.get(owner=cls.requester)
+        cls.task_ids = list(models.Task.objects.filter(project=cls.project).values_list('id', flat=True))
+        cls.submitted = models.TaskWorker.objects.filter(task_id=cls.task_ids[0], status__in=[2, 3, 5]).count()
+        cls.completed = models.TaskWorker.objects.filter(task__project=cls.project, status=3).count()
+        cls.worker_id = models.TaskWorker.objects.filter(task__project=cls.project).exclude(status=6) \
+            .values_list('worker_id', flat=True).first()
+        archive_project_group(cls.project.group_id)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.requester)
+
+    def test_reads_leave_the_group_archived(self):
+        response = self.client.get('/api/task/list_by_project/', {'project_id': self.project.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(t['id'] for t in response.data), sorted(self.task_ids))
+        for limit in ('ten', 0, -1):
+            response = self.client.get('/api/task/list_by_project/', {'project_id': self.project.id, 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/api/task-worker/list-submissions/', {'task_id': self.task_ids[0]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), self.submitted)
+
+        self.assertFalse(models.Task.objects.filter(project=self.project).exists())
+        self.assertIsNotNone(models.Project.objects.get(id=self.project.id).tasks_archived_at)
+
+    def test_dashboards_count_archived_tasks(self):
+        response = self.client.get('/api/project/for-requesters/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['total_tasks'], len(self.task_ids))
+        self.assertEqual(response.data[0]['completed'], self.completed)
+
+        self.client.force_authenticate(user=User.objects.get(id=self.worker_id))
+        response = self.client.get('/api/project/for-workers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in response.data], [self.project.id])
+
+
+class TaskWorkerListQueriesTest(TestCase):
+    """
+    Serializing twice as many task workers takes the same number of queries.
+    """
+    N = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.requester, _ = create_benchmark_data(projects=1, tasks=2 * cls.N, workers=0, repetition=1)
+        cls.project = models.Project.objects.get(owner=cls.requester)
+        item = models.TemplateItem.objects.get(template=cls.project.template, name='radio_0')
+        cls.tasks = list(models.Task.objects.filter(project=cls.project).order_by('id'))
+        cls.workers = [User.objects.create(username='list_worker_{}'.format(i)) for i in range(2 * cls.N)]
+        # the first task has N task workers and the second 2N, the second worker works on N tasks and the
+        # first one on all 2N
+        for index, task in enumerate(cls.tasks):
+            assigned = set([0] + ([1] if index < cls.N else []))
+            if index == 0:
+                assigned.update(range(cls.N))
+            elif index == 1:
+                assigned.update(range(2 * cls.N))
+            for worker_index in sorted(assigned):
+                task_worker = models.TaskWorker.objects.create(task=task, worker=cls.workers[worker_index],
+                                                               status=models.TaskWorker.STATUS_SUBMITTED)
+                models.TaskWorkerResult.objects.create(task_worker=task_worker, template_item=item, result='Yes')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def count_queries(self, user, method, path, data):
+        self.client.force_authenticate(user=user)
+        with CaptureQueriesContext(connection) as captured:
+            if method == 'post':
+                response = self.client.post(path, data, format='json')
+            else:
+                response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        return len(captured.captured_queries)
+
+    def test_list_submissions(self):
+        counts = [self.count_queries(self.requester, 'get', '/api/task-worker/list-submissions/', {'task_id': task.id})
+                  for task in self.tasks[:2]]
+        self.assertEqual(counts[0], counts[1])
+
+    def test_list_my_tasks(self):
+        counts = [self.count_queries(worker, 'get', '/api/task-worker/list-my-tasks/', {'project_id': self.project.id})
+                  for worker in (self.workers[1], self.workers[0])]
+        self.assertEqual(counts[0], counts[1])
+
+    def test_bulk_update_status(self):
+        task_workers = list(models.TaskWorker.objects.filter(worker=self.workers[0]).order_by('id')
+                            .values_list('id', flat=True))
+        counts = [self.count_queries(self.requester, 'post', '/api/task-worker/bulk-update-status/', {
+            'status': models.TaskWorker.STATUS_RETURNED, 'workers': ids
+        }) for ids in (task_workers[:self.N], task_workers[self.N:] + task_workers[:self.N])]
+        self.assertEqual(counts[0], counts[1])
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from crowdsourcing import models
+from crowdsourcing.benchmark import create_benchmark_data
+from crowdsourcing.exports import ResultsExport
+from crowdsourcing.middleware.budget import RequestBudget
+
+
+class RequestBudgetTest(TestCase):
+    """
+    Runs the hot endpoints against a seeded benchmark dataset and checks them against their REQUEST_BUDGETS
+    entries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.requester, _ = create_benchmark_data(projects=3, tasks=20, workers=20, repetition=3, seed=0)
+        models.Project.objects.filter(owner=cls.requester).update(status=models.Project.STATUS_IN_PROGRESS)
+        cls.project = models.Project.objects.filter(owner=cls.requester).order_by('id').first()
+        cls.worker = User.objects.create(username='budget_worker')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.worker)
+
+    def assert_within_budget(self, budget):
+        self.assertIn(budget.name, settings.REQUEST_BUDGETS)
+        self.assertIsNotNone(budget.queries)
+        budget.assert_within()
+
+    def assign(self):
+        with RequestBudget('TaskWorkerViewSet.create') as budget:
+            response = self.client.post('/api/task-worker/', {'project': self.project.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return budget, response.data
+
+    def test_assignment(self):
+        budget, _ = self.assign()
+        self.assert_within_budget(budget)
+
+    def test_submit(self):
+        _, data = self.assign()
+        item = models.TemplateItem.objects.get(template=self.project.template, name='radio_0')
+        with RequestBudget('TaskWorkerResultViewSet.submit_results') as budget:
+            response = self.client.post('/api/task-worker-result/submit-results/', {
+                'task': data['task'],
+                'status': models.TaskWorker.STATUS_SUBMITTED,
+                'saved': False,
+                'items': [{'template_item': item.id, 'result': 'Yes'}]
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_within_budget(budget)
+
+    def test_feed(self):
+        with RequestBudget('ProjectViewSet.task_feed') as budget:
+            response = self.client.get('/api/project/task-feed/')
+        self.assertEqual(response.status_code, 200)
+        self.assert_within_budget(budget)
+
+    def test_is_done(self):
+        task = models.Task.objects.filter(project=self.project).order_by('id').first()
+        with RequestBudget('TaskViewSet.is_done') as budget:
+            response = self.client.get('/api/task/{}/is-done/'.format(task.id))
+        self.assertEqual(response.status_code, 200)
+        self.assert_within_budget(budget)
+
+    def test_download(self):
+        item = models.TemplateItem.objects.get(template=self.project.template, name='radio_0')
+        models.TaskWorkerResult.objects.bulk_create([
+            models.TaskWorkerResult(task_worker_id=task_worker_id, template_item=item, result='Yes')
+            for task_worker_id in models.TaskWorker.objects.filter(
+                task__project=self.project, status__in=ResultsExport.STATUSES).values_list('id', flat=True)])
+        self.client.force_authenticate(user=self.requester)
+        with RequestBudget('FileViewSet.download_results') as budget:
+            response = self.client.get('/api/file/download-results/', {'project_id': self.project.id})
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(content.startswith(b'id,task_id'))
+        self.assert_within_budget(budget)
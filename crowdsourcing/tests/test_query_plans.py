@@ -0,0 +1,88 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from crowdsourcing import models, sql
+from crowdsourcing.benchmark import create_benchmark_data
+
+
+class QueryPlanTest(TestCase):
+    """
+    Plans every registered raw statement against a small benchmark dataset, a statement without a plan or whose
+    plan scans the hot tables or exceeds its cost ceiling fails the test.
+
+    The seeded tables are far below the production limits and small enough for the planner to prefer sequential
+    scans, so sequential scans are disabled while planning and any one left on a hot table means no index can
+    serve the statement. A disabled scan also carries a cost above every ceiling.
+    """
+    # below the size of every seeded hot table
+    MAX_SEQ_SCAN_ROWS = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.requester, _ = create_benchmark_data(projects=5, tasks=40, workers=30, repetition=3)
+        cls.project = models.Project.objects.filter(owner=cls.requester).order_by('id').first()
+        cls.task_workers = list(models.TaskWorker.objects.filter(task__project__owner=cls.requester)
+                                .values_list('id', flat=True))
+
+    def get_params(self):
+        task = models.Task.objects.filter(project=self.project).order_by('id').first()
+        return {
+            'project_id': self.project.id,
+            'current_pid': self.project.id,
+            'group_id': self.project.group_id,
+            'group_ids': [task.group_id],
+            'batch_id': 1,
+            'worker_id': models.TaskWorker.objects.filter(id__in=self.task_workers).first().worker_id,
+            'worker_data': json.dumps({}),
+            'task_worker_ids': self.task_workers[:10],
+            'origin_id': self.requester.id,
+            'origin_type': models.Rating.RATING_REQUESTER,
+            'draft': models.Project.STATUS_DRAFT,
+            'completed': models.Project.STATUS_COMPLETED,
+            'cutoff': timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS),
+            'since': time.time() - settings.MTURK_EXPIRE_HITS_OVERLAP,
+            'pending': [models.TaskWorker.STATUS_IN_PROGRESS, models.TaskWorker.STATUS_SUBMITTED],
+            'limit': 10,
+            'in_progress': models.TaskWorker.STATUS_IN_PROGRESS,
+            'skipped': models.TaskWorker.STATUS_SKIPPED,
+            'rejected': models.TaskWorker.STATUS_REJECTED,
+            'expired': models.TaskWorker.STATUS_EXPIRED,
+            'lower_bound': 1.0,
+            'upper_bound': 1.19,
+            'HEART_BEAT_BOOMERANG': settings.HEART_BEAT_BOOMERANG,
+            'BOOMERANG_TASK_ALPHA': settings.BOOMERANG_TASK_ALPHA,
+            'BOOMERANG_REQUESTER_ALPHA': settings.BOOMERANG_REQUESTER_ALPHA,
+            'BOOMERANG_PLATFORM_ALPHA': settings.BOOMERANG_PLATFORM_ALPHA,
+            'BOOMERANG_MIDPOINT': settings.BOOMERANG_MIDPOINT,
+            'BOOMERANG_LAMBDA': settings.BOOMERANG_LAMBDA,
+            'BOOMERANG_MAX': settings.BOOMERANG_MAX,
+            'BOOMERANG_WORKERS_NEEDED': settings.BOOMERANG_WORKERS_NEEDED
+        }
+
+    def test_registered_statements_have_plans(self):
+        registry = sql.get_registry()
+        self.assertIn('assign_task', registry)
+        self.assertIn('mturk_create_hits', registry)
+        params = self.get_params()
+        cursor = connection.cursor()
+        cursor.execute('ANALYZE')
+        failures = []
+        for name, query in sorted(registry.items()):
+            try:
+                with transaction.atomic():
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+                    plan = cursor.fetchone()[0]
+            except DatabaseError as e:
+                failures.append('{}: no plan, {}'.format(name, e))
+                continue
+            for violation in sql.find_plan_violations(plan, self.MAX_SEQ_SCAN_ROWS,
+                                                      settings.SQL_PLAN_COST_CEILINGS.get(name)):
+                failures.append('{}: {}'.format(name, violation))
+        self.assertEqual(failures, [], 'Query plan regressions:\n' + '\n'.join(failures))
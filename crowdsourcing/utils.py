@@ -1,4 +1,6 @@
 import ast
+import base64
+import calendar
 import datetime
 import hashlib
 import random
@@ -248,22 +250,64 @@ def replace_braces(s):
     return re.sub(r'\s(?=[^\{\}]*}})', '', unicode(s))
 
 
-def get_template_string(initial_data, data):
-    initial_data = replace_braces(initial_data)
-    html_template = Template(initial_data)
-    return_value = ''
-    for node in html_template.nodelist:
-        if isinstance(node, VariableNode):
-            return_value += unicode(data.get(node.token.contents, ''))
-        else:
-            return_value += unicode(node.token.contents)
-    return return_value
+class CompiledTemplateString(object):
+    """
+    A template string parsed once into literal and variable segments.
+    """
+
+    def __init__(self, initial_data):
+        html_template = Template(replace_braces(initial_data))
+        self.segments = [(isinstance(node, VariableNode), unicode(node.token.contents))
+                         for node in html_template.nodelist]
+        self.tokens = [value for is_variable, value in self.segments if is_variable]
+
+    def render(self, data):
+        return u''.join([unicode(data.get(value, '')) if is_variable else value
+                         for is_variable, value in self.segments])
+
+
+_compiled_template_strings = {}
+
+
+def compile_template_string(initial_data, item_id=None):
+    initial_data = unicode(initial_data)
+    key = (item_id, hashlib.sha1(initial_data.encode('utf-8')).hexdigest())
+    compiled = _compiled_template_strings.get(key)
+    if compiled is None:
+        if len(_compiled_template_strings) >= settings.TEMPLATE_STRING_CACHE_SIZE:
+            _compiled_template_strings.clear()
+        compiled = CompiledTemplateString(initial_data)
+        _compiled_template_strings[key] = compiled
+    return compiled
+
+
+def get_template_string(initial_data, data, item_id=None):
+    return compile_template_string(initial_data, item_id).render(data)
 
 
 def get_template_tokens(initial_data):
-    initial_data = replace_braces(initial_data)
-    html_template = Template(initial_data)
-    return [node.token.contents for node in html_template.nodelist if isinstance(node, VariableNode)]
+    return list(compile_template_string(initial_data).tokens)
+
+
+def encode_cursor(time_stamp, pk):
+    """
+    Opaque keyset cursor made of a timestamp (in microseconds since the epoch) and a primary key.
+    """
+    micro_seconds = calendar.timegm(time_stamp.utctimetuple()) * 1000000 + time_stamp.microsecond
+    return base64.urlsafe_b64encode('{}:{}'.format(micro_seconds, pk))
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (timestamp, pk) pair of a cursor created by encode_cursor, raises ValueError if it is malformed.
+    """
+    try:
+        micro_seconds, pk = base64.urlsafe_b64decode(str(cursor)).split(':')
+        time_stamp = datetime.datetime.utcfromtimestamp(int(micro_seconds) // 1000000).replace(
+            microsecond=int(micro_seconds) % 1000000, tzinfo=timezone.utc)
+        return time_stamp, int(pk)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
 
 
 def flatten_dict(d, separator='_', prefix=''):
@@ -279,3 +323,12 @@ def hash_task(data):
 
 def hash_as_set(data):
     return hashlib.sha256(repr(sorted(frozenset(data)))).hexdigest()
+
+
+class PseudoBuffer(object):
+    """
+    A file-like object that returns what is written to it, used to stream csv rows.
+    """
+
+    def write(self, value):
+        return value
@@ -1,15 +1,21 @@
-import StringIO
-from collections import OrderedDict
+import csv
+from itertools import chain
 
-import pandas as pd
+from django.core.files.storage import default_storage
+from django.http import StreamingHttpResponse
 from rest_framework import status, mixins
 from rest_framework.decorators import list_route
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
-from crowdsourcing.models import BatchFile, TaskWorker, TaskWorkerResult
+from crowdsourcing import constants
+from crowdsourcing.exports import ResultsExport, EXPORT_FORMATS, FORMAT_CSV, encode_csv_value
+from crowdsourcing.models import BatchFile
+from crowdsourcing.redis import RedisProvider
 from crowdsourcing.serializers.file import BatchFileSerializer
+from crowdsourcing.tasks import export_results
+from crowdsourcing.utils import PseudoBuffer
 
 
 class FileViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.DestroyModelMixin, GenericViewSet):
@@ -28,60 +34,50 @@ class FileViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.Des
 
     @list_route(methods=['get'], url_path='download-results')
     def download_results(self, request, *args, **kwargs):
-        project_id = request.query_params.get('project_id', -1)
+        export = ResultsExport(project_id=request.query_params.get('project_id', -1), owner_id=request.user.id)
+        if not export.has_tasks():
+            return Response(data={"message": "No project of yours matches this export."},
+                            status=status.HTTP_404_NOT_FOUND)
+        if export.is_empty():
+            return Response(data=[], status=status.HTTP_204_NO_CONTENT)
 
-        task_worker_results = TaskWorkerResult.objects.select_related('task_worker__task', 'template_item',
-                                                                      'task_worker__worker').filter(
-            task_worker__task__project_id=project_id,
-            task_worker__status__in=[TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_REJECTED,
-                                     TaskWorker.STATUS_SUBMITTED]).order_by(
-            'task_worker__task_id',
-            'task_worker__worker_id',
-            'template_item__position')
+        columns = export.get_columns()
+        writer = csv.writer(PseudoBuffer())
+        rows = (writer.writerow([encode_csv_value(row.get(c)) for c in columns]) for row in export.iter_rows())
+        response = StreamingHttpResponse(chain([writer.writerow([encode_csv_value(c) for c in columns])], rows),
+                                         content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="results.csv"'
+        return response
 
-        if task_worker_results.count() == 0:
-            return Response(data=[], status=status.HTTP_204_NO_CONTENT)
+    @list_route(methods=['post'], url_path='export-results')
+    def export_results(self, request, *args, **kwargs):
+        export_format = request.data.get('format', FORMAT_CSV)
+        if export_format not in EXPORT_FORMATS:
+            return Response(data={"message": "Unsupported export format."}, status=status.HTTP_400_BAD_REQUEST)
 
-        task_worker_id = -1
-        results = []
-        for result in task_worker_results:
-            if result.task_worker_id != task_worker_id:
-                task_worker_id = result.task_worker_id
-                results.append(OrderedDict([
-                    ("id", result.task_worker_id),
-                    ("task_id", result.task_worker.task_id),
-                    ("created_at", result.task_worker.created_at),
-                    ("submitted_timestamp", result.updated_at),
-                    ("worker_alias", result.task_worker.worker.username),
-                    ("status", [x[1] for x in TaskWorker.STATUS if x[0] == result.task_worker.status][0])
-                ]))
-                task_data = result.task_worker.task.data
-                if task_data:
-                    results[len(results) - 1].update(task_data)
-            result_dict = self._to_dict(result)
-            results[len(results) - 1].update(result_dict)
-        df = pd.DataFrame(results)
-        output = StringIO.StringIO()
-        df.to_csv(output, columns=results[0].keys(), index=False, encoding="utf-8")
-        data = output.getvalue()
-        output.close()
-        return Response(data, status.HTTP_200_OK)
+        filters = {
+            'project_id': request.data.get('project_id', None),
+            'batch_id': request.data.get('batch_id', None),
+            'rerun_key': request.data.get('rerun_key', None),
+            'owner_id': request.user.id
+        }
+        export = ResultsExport(**filters)
+        if not export.has_tasks():
+            return Response(data={"message": "No project of yours matches this export."},
+                            status=status.HTTP_404_NOT_FOUND)
+        if export.is_empty():
+            return Response(data={}, status=status.HTTP_204_NO_CONTENT)
 
-    @staticmethod
-    def _to_dict(result):
-        if result.template_item.type == 'checkbox':
-            return {
-                str(result.template_item.aux_attributes['question']['value']): ",".join(
-                    [x['value'] for x in result.result if
-                     'answer' in x and x['answer']])
-            }
-        elif result.template_item.type == 'iframe' and isinstance(result.result, list):
-            return {
-                "result": result.result
-            }
-        elif result.template_item.type == 'iframe' and isinstance(result.result, dict):
-            return result.result
-        else:
-            return {
-                str(result.template_item.aux_attributes['question']['value']): result.result
-            }
+        key = export.get_cache_key(export_format)
+        provider = RedisProvider()
+        job_key = provider.build_key('export', key)
+        file_name = provider.get(job_key)
+
+        if file_name is not None and file_name != constants.EXPORT_IN_PROGRESS:
+            return Response(data={"key": key, "status": "done", "url": default_storage.url(file_name)},
+                            status=status.HTTP_200_OK)
+
+        if file_name is None and provider.set(job_key, constants.EXPORT_IN_PROGRESS,
+                                              expire=constants.EXPORT_JOB_TIMEOUT, nx=True):
+            export_results.delay(request.user.id, key, filters, export_format)
+        return Response(data={"key": key, "status": "in_progress"}, status=status.HTTP_202_ACCEPTED)
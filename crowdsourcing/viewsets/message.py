@@ -15,7 +15,7 @@ from crowdsourcing.models import Conversation, Message, ConversationRecipient
 from crowdsourcing.redis import RedisProvider
 from crowdsourcing.serializers.message import ConversationSerializer, MessageSerializer, RedisMessageSerializer, \
     ConversationRecipientSerializer
-from crowdsourcing.utils import get_relative_time
+from crowdsourcing.utils import get_relative_time, encode_cursor, decode_cursor
 
 
 class ConversationViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
@@ -23,6 +23,7 @@ class ConversationViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
     queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
+    PAGE_SIZE = 100
 
     def create(self, request, *args, **kwargs):
         # check if conversation already exists
@@ -49,13 +50,58 @@ class ConversationViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
                             status=status.HTTP_400_BAD_REQUEST)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.queryset.exclude(messages__isnull=True).active() \
-            .filter(recipients__in=ConversationRecipient.objects.values_list('recipient', flat=True).active()
-                    .filter(recipient=request.user))
-
-        serializer = self.serializer_class(instance=queryset, many=True, context={"request": request})
-
-        return Response(serializer.data)
+        # noinspection SqlResolve
+        last_message = '''
+            SELECT {} FROM crowdsourcing_message m
+            WHERE m.conversation_id = crowdsourcing_conversation.id
+            ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+        '''
+        queryset = self.queryset.active().filter(conversationrecipient__recipient=request.user,
+                                                 conversationrecipient__deleted_at__isnull=True) \
+            .select_related('sender').prefetch_related('recipients') \
+            .extra(select={'last_message_id': last_message.format('m.id'),
+                           'last_message_at': last_message.format('m.created_at')},
+                   where=['({}) IS NOT NULL'.format(last_message.format('m.id'))],
+                   order_by=['-last_message_at', '-id'])
+
+        limit = request.query_params.get('limit', None)
+        cursor = request.query_params.get('cursor', None)
+        try:
+            if cursor is not None:
+                last_message_at, conversation_id = decode_cursor(cursor)
+                queryset = queryset.extra(
+                    where=['(({}), crowdsourcing_conversation.id) < (%s, %s)'.format(
+                        last_message.format('m.created_at'))],
+                    params=[last_message_at, conversation_id])
+            if limit is not None:
+                limit = min(int(limit), self.PAGE_SIZE)
+                conversations = list(queryset[:limit + 1])
+            else:
+                conversations = list(queryset)
+        except ValueError:
+            return Response(data={"message": "Invalid cursor or limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        has_more = limit is not None and len(conversations) > limit
+        if has_more:
+            conversations = conversations[:limit]
+
+        messages = Message.objects.in_bulk([c.last_message_id for c in conversations])
+        for conversation in conversations:
+            conversation.last_message = messages.get(conversation.last_message_id)
+        sender_ids = list(set([c.sender_id for c in conversations]))
+        online = RedisProvider().hmget('online', sender_ids) if len(sender_ids) else []
+
+        serializer = self.serializer_class(instance=conversations, many=True,
+                                           context={"request": request,
+                                                    "online_senders": dict(zip(sender_ids, online))})
+        if limit is None:
+            return Response(serializer.data)
+
+        next_cursor = None
+        if len(conversations):
+            next_cursor = encode_cursor(conversations[-1].last_message_at, conversations[-1].id)
+        return Response(data={"cursor": next_cursor, "has_more": has_more, "conversations": serializer.data},
+                        status=status.HTTP_200_OK)
 
     @list_route(methods=['get'], url_path='list-open')
     def list_open(self, request, *args, **kwargs):
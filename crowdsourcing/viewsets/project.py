@@ -1,7 +1,9 @@
 import json
+from datetime import timedelta
 from textwrap import dedent
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.db import connection
 from django.db.models import F
 from django.http import HttpResponse
@@ -11,20 +13,145 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from yapf.yapflib.yapf_api import FormatCode
 
+from crowdsourcing import sql
+from crowdsourcing.archive import restore_project_group
 from crowdsourcing.models import Category, Project, Task
 from crowdsourcing.permissions.project import IsProjectOwnerOrCollaborator, ProjectChangesAllowed
 from crowdsourcing.serializers.project import *
 from crowdsourcing.serializers.task import *
-from crowdsourcing.tasks import create_tasks_for_project
-from crowdsourcing.utils import get_pk, get_template_tokens
+from crowdsourcing.tasks import create_tasks_for_project, prerender_tasks
+from crowdsourcing.utils import get_pk, get_template_tokens, encode_cursor, decode_cursor
 from crowdsourcing.validators.project import validate_account_balance
-from mturk.tasks import mturk_disable_hit
+from mturk.tasks import mark_project_dirty, mark_tasks_dirty, mturk_disable_hit
+
+
+def attach_owners(projects):
+    """
+    Raw querysets can't select_related, owners of the whole list are loaded with one query instead.
+    """
+    projects = list(projects)
+    owners = User.objects.in_bulk(set([project.owner_id for project in projects]))
+    for project in projects:
+        project.owner = owners.get(project.owner_id)
+    return projects
+
+
+# noinspection SqlResolve
+PROJECT_IS_DONE_TEMPLATE = '''
+    SELECT
+      count(t.id) remaining
+
+    FROM crowdsourcing_task t INNER JOIN (SELECT
+                                            group_id,
+                                            max(id) id
+                                          FROM crowdsourcing_task
+                                          WHERE deleted_at IS NULL {batch_filter}
+                                          GROUP BY group_id) t_max ON t_max.id = t.id
+      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      INNER JOIN (
+                   SELECT
+                     t.group_id,
+                     sum(t.others) OTHERS
+                   FROM (
+                          SELECT
+                            t.group_id,
+                            CASE WHEN tw.id IS NOT NULL THEN 1 ELSE 0 END OTHERS
+                          FROM crowdsourcing_task t
+                            LEFT OUTER JOIN crowdsourcing_taskworker tw
+                            ON (t.id = tw.task_id AND tw.status NOT IN (4, 6, 7))
+                          WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
+                   GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
+    WHERE t_count.others < p.repetition AND p.id=(%(project_id)s)
+    GROUP BY p.id;
+'''
+sql.register('project_is_done', PROJECT_IS_DONE_TEMPLATE.format(batch_filter=''))
+sql.register('project_batch_is_done', PROJECT_IS_DONE_TEMPLATE.format(
+    batch_filter='AND batch_id=(%(batch_id)s)'))
+
+
+# noinspection SqlResolve
+sql.register('publish_payment', '''
+    WITH RECURSIVE cte(id, group_id, project_id, price, exclude_at, level) AS (
+      SELECT
+        t.id,
+        t.group_id,
+        project_id,
+        p.price,
+        exclude_at,
+        1 AS level
+      FROM crowdsourcing_task t
+        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      WHERE project_id = (%(current_pid)s)
+      UNION ALL
+      SELECT
+        t.id,
+        t.group_id,
+        t.project_id,
+        p.price,
+        t.exclude_at,
+        c.level + 1 AS level
+      FROM crowdsourcing_task t
+        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+        INNER JOIN cte c
+          ON t.id = c.id
+      WHERE c.level < p.repetition AND t.project_id = (%(current_pid)s)
+    )
+    SELECT sum(to_pay) AS total_needed
+    FROM (
+           SELECT
+             cte.id       task_id,
+             cte.group_id group_id,
+             cte.price    new_price,
+             prev.id      prev_task_id,
+             prev.price   old_price,
+             prev.status,
+             prev.exclude_at,
+             CASE WHEN prev.status = 3 AND (cte.id IS NULL OR (cte.id IS NOT NULL AND prev.exclude_at IS NULL))
+               THEN 0
+             WHEN prev.status <> 3 AND cte.id IS NULL
+               THEN
+                 prev.price
+             WHEN prev.id IS NULL OR (cte.id IS NOT NULL AND prev.exclude_at IS NOT NULL AND prev.status = 3)
+               THEN
+                 cte.price
+             WHEN prev.id IS NOT NULL AND cte.id IS NOT NULL AND prev.exclude_at IS NULL AND prev.status <> 3
+               THEN greatest(prev.price, cte.price)
+             WHEN prev.id IS NOT NULL AND cte.id IS NOT NULL
+                AND prev.exclude_at IS NOT NULL AND prev.status <> 3
+               THEN
+                 greatest(COALESCE(cte.price, 0), COALESCE(prev.price, 0))
+             END          to_pay
+           FROM cte
+             FULL OUTER JOIN (
+                               SELECT
+                                 t.id,
+                                 t.group_id,
+                                 p.price,
+                                 p.id                      project_id,
+                                 tw.status,
+                                 tw.worker_id,
+                                 t.exclude_at,
+                                 row_number()
+                                 OVER (PARTITION BY t.group_id
+                                   ORDER BY t.group_id) AS level
+                               FROM crowdsourcing_taskworker tw
+                                 INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
+                                 INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                               WHERE tw.status NOT IN (4, 6, 7)
+                             ) prev
+               ON cte.group_id = prev.group_id AND cte.level = prev.level AND
+                  coalesce(prev.exclude_at, cte.project_id) = cte.project_id
+           ORDER BY cte.group_id, cte.level) w;
+''')
 
 
 class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.active()
     serializer_class = ProjectSerializer
     permission_classes = [IsProjectOwnerOrCollaborator, IsAuthenticated, ProjectChangesAllowed]
+    CHANGES_PAGE_SIZE = 100
+    CHANGES_MAX_PAGE_SIZE = 1000
+    CHANGES_VISIBILITY_DELAY = timedelta(seconds=2)
 
     def create(self, request, with_defaults=True, *args, **kwargs):
         serializer = ProjectSerializer(
@@ -94,6 +221,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
     @detail_route(methods=['PUT'])
     def update_status(self, request, *args, **kwargs):
         instance = self.get_object()
+        restore_project_group(instance.group_id)
         serializer = self.serializer_class(instance=instance, data=request.data)
         serializer.update_status()
         return Response({}, status=status.HTTP_200_OK)
@@ -109,6 +237,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
             filter_by.update({'pk': project_id})
         cursor = connection.cursor()
         instance = self.queryset.filter(**filter_by).order_by('-id').first()
+        self.check_object_permissions(request, instance)
+        restore_project_group(instance.group_id)
         if num_rows > 0:
             instance.tasks.filter(row_number__gt=num_rows).delete()
 
@@ -124,82 +254,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
                                                         project__group_id=instance.group_id)
             task_serializer = TaskSerializer()
             task_serializer.bulk_update(tasks, {'exclude_at': instance.id})
-        # noinspection SqlResolve
-        payment_query = '''
-            WITH RECURSIVE cte(id, group_id, project_id, price, exclude_at, level) AS (
-              SELECT
-                t.id,
-                t.group_id,
-                project_id,
-                p.price,
-                exclude_at,
-                1 AS level
-              FROM crowdsourcing_task t
-                INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-              WHERE project_id = (%(current_pid)s)
-              UNION ALL
-              SELECT
-                t.id,
-                t.group_id,
-                t.project_id,
-                p.price,
-                t.exclude_at,
-                c.level + 1 AS level
-              FROM crowdsourcing_task t
-                INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                INNER JOIN cte c
-                  ON t.id = c.id
-              WHERE c.level < p.repetition AND t.project_id = (%(current_pid)s)
-            )
-            SELECT sum(to_pay) AS total_needed
-            FROM (
-                   SELECT
-                     cte.id       task_id,
-                     cte.group_id group_id,
-                     cte.price    new_price,
-                     prev.id      prev_task_id,
-                     prev.price   old_price,
-                     prev.status,
-                     prev.exclude_at,
-                     CASE WHEN prev.status = 3 AND (cte.id IS NULL OR (cte.id IS NOT NULL AND prev.exclude_at IS NULL))
-                       THEN 0
-                     WHEN prev.status <> 3 AND cte.id IS NULL
-                       THEN
-                         prev.price
-                     WHEN prev.id IS NULL OR (cte.id IS NOT NULL AND prev.exclude_at IS NOT NULL AND prev.status = 3)
-                       THEN
-                         cte.price
-                     WHEN prev.id IS NOT NULL AND cte.id IS NOT NULL AND prev.exclude_at IS NULL AND prev.status <> 3
-                       THEN greatest(prev.price, cte.price)
-                     WHEN prev.id IS NOT NULL AND cte.id IS NOT NULL
-                        AND prev.exclude_at IS NOT NULL AND prev.status <> 3
-                       THEN
-                         greatest(COALESCE(cte.price, 0), COALESCE(prev.price, 0))
-                     END          to_pay
-                   FROM cte
-                     FULL OUTER JOIN (
-                                       SELECT
-                                         t.id,
-                                         t.group_id,
-                                         p.price,
-                                         p.id                      project_id,
-                                         tw.status,
-                                         tw.worker_id,
-                                         t.exclude_at,
-                                         row_number()
-                                         OVER (PARTITION BY t.group_id
-                                           ORDER BY t.group_id) AS level
-                                       FROM crowdsourcing_taskworker tw
-                                         INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
-                                         INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                                       WHERE tw.status NOT IN (4, 6, 7)
-                                     ) prev
-                       ON cte.group_id = prev.group_id AND cte.level = prev.level AND
-                          coalesce(prev.exclude_at, cte.project_id) = cte.project_id
-                   ORDER BY cte.group_id, cte.level) w;
-        '''
 
-        cursor.execute(payment_query, {'current_pid': instance.id})
+        sql.execute('publish_payment', {'current_pid': instance.id}, cursor)
         total_needed = cursor.fetchall()[0][0]
         # to_pay = (Decimal(total_needed) - instance.amount_due).quantize(Decimal('.01'), rounding=ROUND_UP)
         instance.amount_due = total_needed if total_needed is not None else 0
@@ -210,6 +266,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
             with transaction.atomic():
                 serializer.publish(0)
+            mark_project_dirty(instance.group_id)
+            if settings.TASK_PRERENDER_ENABLED:
+                prerender_tasks.delay(instance.id)
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -222,14 +281,24 @@ class ProjectViewSet(viewsets.ModelViewSet):
               p.id,
               p.name,
               p.owner_id,
-              p.status
-            FROM crowdsourcing_taskworker tw
-              INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+              p.status,
+              review.id review_project_id,
+              review.price review_project_price
+            FROM crowdsourcing_taskworker_all tw
+              INNER JOIN crowdsourcing_task_all t ON tw.task_id = t.id
               INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+              LEFT OUTER JOIN LATERAL (
+                           SELECT
+                             rp.id,
+                             rp.price
+                           FROM crowdsourcing_project rp
+                           WHERE rp.parent_id = p.group_id AND rp.is_review = TRUE AND rp.deleted_at IS NULL
+                           ORDER BY rp.id
+                           LIMIT 1) review ON TRUE
             WHERE tw.status <> 6 AND tw.worker_id = (%(worker_id)s) AND p.is_review=FALSE
-            GROUP BY p.id, p.name, p.owner_id, p.status
+            GROUP BY p.id, p.name, p.owner_id, p.status, review.id, review.price
         '''
-        projects = Project.objects.raw(query, params={'worker_id': request.user.id})
+        projects = attach_owners(Project.objects.raw(query, params={'worker_id': request.user.id}))
 
         serializer = ProjectSerializer(instance=projects, many=True,
                                        fields=('id', 'name', 'owner', 'status'),
@@ -241,16 +310,22 @@ class ProjectViewSet(viewsets.ModelViewSet):
         # noinspection SqlResolve
         query = '''
             SELECT
-              id,
-              name,
-              created_at,
-              updated_at,
-              status,
-              price,
-              published_at,
-              completed,
-              awaiting_review,
-              in_progress
+              p.id,
+              p.name,
+              p.created_at,
+              p.updated_at,
+              p.status,
+              p.price,
+              p.published_at,
+              t.completed,
+              t.awaiting_review,
+              t.in_progress,
+              (SELECT count(*) FROM crowdsourcing_task_all WHERE project_id = p.id) task_count,
+              coalesce((SELECT array_agg(r.id ORDER BY r.id)
+                        FROM crowdsourcing_project r
+                        WHERE r.group_id = p.group_id AND r.deleted_at IS NULL), '{}') revision_ids,
+              review.id review_project_id,
+              review.price review_project_price
             FROM crowdsourcing_project p
               INNER JOIN (
                            SELECT
@@ -270,9 +345,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
                                       THEN 1
                                     ELSE 0 END awaiting_review
                                   FROM crowdsourcing_project p
-                                    LEFT OUTER JOIN crowdsourcing_task t ON t.project_id = p.id
+                                    LEFT OUTER JOIN crowdsourcing_task_all t ON t.project_id = p.id
                                       AND t.deleted_at IS NULL
-                                    LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id
+                                    LEFT OUTER JOIN crowdsourcing_taskworker_all tw ON tw.task_id = t.id
                                   WHERE p.owner_id = (%(owner_id)s) AND p.deleted_at IS NULL AND is_review = FALSE) c
                              INNER JOIN (SELECT
                                            group_id,
@@ -283,7 +358,15 @@ class ProjectViewSet(viewsets.ModelViewSet):
                              INNER JOIN crowdsourcing_project p0 ON p0.id=p_max.id
                            GROUP BY p_max.id, p0.repetition) t
                 ON t.project_id = p.id
-            ORDER BY updated_at DESC;
+              LEFT OUTER JOIN LATERAL (
+                           SELECT
+                             rp.id,
+                             rp.price
+                           FROM crowdsourcing_project rp
+                           WHERE rp.parent_id = p.group_id AND rp.is_review = TRUE AND rp.deleted_at IS NULL
+                           ORDER BY rp.id
+                           LIMIT 1) review ON TRUE
+            ORDER BY p.updated_at DESC;
         '''
         projects = Project.objects.raw(query, params={'owner_id': request.user.id})
         serializer = ProjectSerializer(instance=projects, many=True,
@@ -296,6 +379,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
     @detail_route(methods=['post'])
     def fork(self, request, *args, **kwargs):
         instance = self.get_object()
+        restore_project_group(instance.group_id)
         project_serializer = ProjectSerializer(instance=instance, data=request.data, partial=True,
                                                fields=('id', 'name', 'price', 'repetition',
                                                        'is_prototype', 'template', 'status', 'batch_files'))
@@ -315,7 +399,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
     @list_route(methods=['get'], url_path='task-feed')
     def task_feed(self, request, *args, **kwargs):
-        projects = Project.objects.filter_by_boomerang(request.user)
+        projects = attach_owners(Project.objects.filter_by_boomerang(request.user))
         project_serializer = ProjectSerializer(instance=projects, many=True,
                                                fields=('id', 'name',
                                                        'timeout',
@@ -376,6 +460,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
     @detail_route(methods=['post'], url_path='create-revision')
     def create_revision(self, request, *args, **kwargs):
         project = self.get_object()
+        restore_project_group(project.group_id)
         with transaction.atomic():
             revision = self.serializer_class.create_revision(instance=project)
         return Response(data={'id': revision.id}, status=status.HTTP_200_OK)
@@ -399,6 +484,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
         else:
             filter_by.update({'pk': project_id})
         project = self.queryset.filter(**filter_by).order_by('-id').first()
+        self.check_object_permissions(request, project)
+        restore_project_group(project.group_id)
 
         existing_tasks = Task.objects.filter(project=project, rerun_key=run_key, exclude_at__isnull=True)
 
@@ -429,27 +516,33 @@ class ProjectViewSet(viewsets.ModelViewSet):
         # TODO uncomment when we stop using MTurk: validate_account_balance(request, to_pay)
         task_serializer = TaskSerializer()
 
-        for t in existing_tasks:
-            if t.hash in all_hashes:
-                task_workers = models.TaskWorker.objects.filter(task__group_id=t.group_id,
-                                                                status__in=[models.TaskWorker.STATUS_ACCEPTED,
-                                                                            models.TaskWorker.STATUS_SUBMITTED,
-                                                                            models.TaskWorker.STATUS_REJECTED])
-                response['tasks'].append({
-                    "id": t.id,
-                    "group_id": t.group_id,
-                    "data": t.data,
-                    "expected": max(task_workers.exclude(status=models.TaskWorker.STATUS_REJECTED).count(),
-                                    project.repetition),
-                    "task_workers": TaskWorkerSerializer(
-                        task_workers,
-                        many=True,
-                        fields=(
-                            'id', 'task_group_id', 'worker', 'status', 'created_at',
-                            'updated_at', 'task',
-                            'worker_alias', 'results', 'project_data',
-                            'task_data')).data
-                })
+        matched_tasks = [t for t in existing_tasks if t.hash in all_hashes]
+        task_workers = models.TaskWorker.objects.filter(task__group_id__in=[t.group_id for t in matched_tasks],
+                                                        status__in=[models.TaskWorker.STATUS_ACCEPTED,
+                                                                    models.TaskWorker.STATUS_SUBMITTED,
+                                                                    models.TaskWorker.STATUS_REJECTED])
+        serialized_task_workers = TaskWorkerSerializer(
+            task_workers,
+            many=True,
+            fields=(
+                'id', 'task_group_id', 'worker', 'status', 'created_at',
+                'updated_at', 'task',
+                'worker_alias', 'results', 'project_data',
+                'task_data')).data
+        task_workers_by_group = {}
+        for task_worker in serialized_task_workers:
+            task_workers_by_group.setdefault(task_worker['task_group_id'], []).append(task_worker)
+
+        for t in matched_tasks:
+            group_task_workers = task_workers_by_group.get(t.group_id, [])
+            response['tasks'].append({
+                "id": t.id,
+                "group_id": t.group_id,
+                "data": t.data,
+                "expected": max(len([tw for tw in group_task_workers
+                                     if tw['status'] != models.TaskWorker.STATUS_REJECTED]), project.repetition),
+                "task_workers": group_task_workers
+            })
 
         with transaction.atomic():
             task_serializer.bulk_create(task_objects)
@@ -473,6 +566,10 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 # project.amount_due += to_pay
                 # project.save()
 
+        if project.status != Project.STATUS_DRAFT:
+            mark_tasks_dirty([t.id for t in task_objects])
+        if settings.TASK_PRERENDER_ENABLED and len(task_objects) and project.status != Project.STATUS_DRAFT:
+            prerender_tasks.delay(project.id)
         # serializer = TaskSerializer(instance=task_objects, many=True)
         return Response(data=response, status=status.HTTP_201_CREATED)
 
@@ -487,47 +584,59 @@ class ProjectViewSet(viewsets.ModelViewSet):
         batch_id = request.query_params.get('batch_id', -1)
         if project.deadline is not None and timezone.now() > project.deadline:
             return Response(data={"is_done": True}, status=status.HTTP_200_OK)
-        extra_query = ' AND batch_id=(%(batch_id)s) '
-        if batch_id < 0:
-            extra_query = ''
-        # noinspection SqlResolve
-        query = '''
-            SELECT
-              count(t.id) remaining
-
-            FROM crowdsourcing_task t INNER JOIN (SELECT
-                                                    group_id,
-                                                    max(id) id
-                                                  FROM crowdsourcing_task
-                                                  WHERE deleted_at IS NULL
-            '''
-        query += extra_query
-
-        query += '''
-                                                  GROUP BY group_id) t_max ON t_max.id = t.id
-              INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-              INNER JOIN (
-                           SELECT
-                             t.group_id,
-                             sum(t.others) OTHERS
-                           FROM (
-                                  SELECT
-                                    t.group_id,
-                                    CASE WHEN tw.id IS NOT NULL THEN 1 ELSE 0 END OTHERS
-                                  FROM crowdsourcing_task t
-                                    LEFT OUTER JOIN crowdsourcing_taskworker tw
-                                    ON (t.id = tw.task_id AND tw.status NOT IN (4, 6, 7))
-                                  WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
-                           GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
-            WHERE t_count.others < p.repetition AND p.id=(%(project_id)s)
-            GROUP BY p.id;
-        '''
-
+        statement = 'project_is_done' if batch_id < 0 else 'project_batch_is_done'
         cursor = connection.cursor()
-        cursor.execute(query, {'project_id': project.id, 'batch_id': batch_id})
+        sql.execute(statement, {'project_id': project.id, 'batch_id': batch_id}, cursor)
         remaining_count = cursor.fetchall()[0][0] if cursor.rowcount > 0 else 0
         return Response(data={"is_done": remaining_count == 0}, status=status.HTTP_200_OK)
 
+    @detail_route(methods=['get'], url_path='changes')
+    def changes(self, request, pk=None, *args, **kwargs):
+        project_id, is_hash = get_pk(pk)
+        if not is_hash:
+            project = self.get_object()
+        else:
+            project = Project.objects.filter(group_id=project_id).order_by('-id').first()
+            if project is None:
+                return Response(data={"message": "Project not found."}, status=status.HTTP_404_NOT_FOUND)
+            self.check_object_permissions(request, project)
+
+        try:
+            limit = int(request.query_params.get('limit', self.CHANGES_PAGE_SIZE))
+        except ValueError:
+            return Response(data={"message": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(min(limit, self.CHANGES_MAX_PAGE_SIZE), 1)
+        rerun_key = request.query_params.get('rerun_key', None)
+        cursor = request.query_params.get('cursor', None)
+
+        # rows touched in the last few seconds may still be in uncommitted transactions, they are left for the
+        # next poll so that the cursor never moves past a row that is not visible yet
+        task_workers = models.TaskWorkerAll.objects.select_related('worker', 'task').prefetch_related(
+            'results__template_item').filter(task__project__group_id=project.group_id,
+                                             updated_at__lt=timezone.now() - self.CHANGES_VISIBILITY_DELAY)
+        if rerun_key is not None:
+            task_workers = task_workers.filter(task__rerun_key=rerun_key)
+        if cursor is not None:
+            try:
+                updated_at, task_worker_id = decode_cursor(cursor)
+            except ValueError:
+                return Response(data={"message": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+            task_workers = task_workers.extra(
+                where=['(crowdsourcing_taskworker_all.updated_at, crowdsourcing_taskworker_all.id) > (%s, %s)'],
+                params=[updated_at, task_worker_id])
+        task_workers = list(task_workers.order_by('updated_at', 'id')[:limit + 1])
+
+        has_more = len(task_workers) > limit
+        task_workers = task_workers[:limit]
+        if len(task_workers):
+            cursor = encode_cursor(task_workers[-1].updated_at, task_workers[-1].id)
+
+        serializer = TaskWorkerSerializer(instance=task_workers, many=True,
+                                          fields=('id', 'task', 'task_group_id', 'worker', 'worker_alias', 'status',
+                                                  'created_at', 'updated_at', 'results'))
+        return Response(data={"cursor": cursor, "has_more": has_more, "task_workers": serializer.data},
+                        status=status.HTTP_200_OK)
+
     @detail_route(methods=['get'], url_path='sample-script')
     def sample_script(self, request, *args, **kwargs):
         project = self.get_object()
@@ -4,7 +4,7 @@ from urlparse import urlsplit
 import trueskill
 
 from django.db import connection
-from django.db.models import Q
+from django.db.models import Case, F, IntegerField, Q, Sum, When
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.timezone import utc
@@ -17,6 +17,7 @@ from ws4redis.publisher import RedisPublisher
 from ws4redis.redis_store import RedisMessage
 
 from crowdsourcing import constants
+from crowdsourcing import sql
 from crowdsourcing.models import Task, TaskWorker, TaskWorkerResult, UserPreferences, ReturnFeedback, \
     User, MatchGroup, Batch, Match, WorkerMatchScore, MatchWorker
 from crowdsourcing.permissions.task import IsTaskOwner  # HasExceededReservedLimit
@@ -26,7 +27,7 @@ from crowdsourcing.serializers.task import *
 from crowdsourcing.tasks import update_worker_cache, post_approve, refund_task
 from crowdsourcing.utils import get_model_or_none, hash_as_set, \
     get_review_redis_message
-from mturk.tasks import mturk_hit_update, mturk_approve, mturk_reject
+from mturk.tasks import mark_tasks_dirty, mturk_approve, mturk_reject, schedule_hit_update
 
 
 def setup_peer_review(review_project, task_workers, is_inter_task, rerun_key, ids_hash):
@@ -250,6 +251,36 @@ def update_ts_scores(task_worker, winner_id):
             match.save()
 
 
+# noinspection SqlResolve
+sql.register('task_is_done', '''
+    SELECT greatest(t_count.completed, p.repetition) expected, t_count.completed, p.repetition
+    FROM crowdsourcing_task t
+      INNER JOIN (SELECT
+                    group_id,
+                    max(id) id
+                  FROM crowdsourcing_task
+                  WHERE deleted_at IS NULL
+                  GROUP BY group_id) t_max ON t_max.id = t.id
+      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      INNER JOIN (
+                   SELECT
+                     t.group_id,
+                     coalesce(sum(t.others), 0) completed
+                   FROM (
+                          SELECT
+                            t.group_id,
+                            CASE WHEN tw.id IS NOT NULL
+                              THEN 1
+                            ELSE 0 END OTHERS
+                          FROM crowdsourcing_task t
+                            LEFT OUTER JOIN crowdsourcing_taskworker tw
+                              ON (t.id = tw.task_id AND tw.status IN (2, 3))
+                          WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
+                   GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
+    WHERE t.group_id = (%(group_id)s);
+''')
+
+
 class TaskViewSet(viewsets.ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
@@ -296,8 +327,21 @@ class TaskViewSet(viewsets.ModelViewSet):
         serializer = TaskSerializer(tasks, many=True, fields=('id', 'data', 'row_number'))
         return Response({'headers': headers, 'tasks': serializer.data})
 
+    @staticmethod
+    def annotate_statistics(queryset):
+        """
+        Counts what TaskSerializer's worker_count, completed and total need in the same query as the tasks.
+        """
+        return queryset.annotate(
+            submitted_count=Sum(Case(When(task_workers__status__in=[TaskWorker.STATUS_SUBMITTED,
+                                                                    TaskWorker.STATUS_ACCEPTED,
+                                                                    TaskWorker.STATUS_RETURNED], then=1),
+                                     default=0, output_field=IntegerField())),
+            project_repetition=F('project__repetition'))
+
     def retrieve(self, request, *args, **kwargs):
-        obj = self.get_object()
+        obj = get_object_or_404(self.annotate_statistics(self.get_queryset()), pk=kwargs['pk'])
+        self.check_object_permissions(request, obj)
         serializer = TaskSerializer(instance=obj, fields=('id', 'template', 'project_data',
                                                           'worker_count', 'completed', 'total'))
         return Response(data=serializer.data, status=status.HTTP_200_OK)
@@ -354,7 +398,21 @@ class TaskViewSet(viewsets.ModelViewSet):
 
     @list_route(methods=['get'])
     def list_by_project(self, request, **kwargs):
-        tasks = Task.objects.filter(project=request.query_params.get('project_id')).order_by('id')
+        # archived projects are read through the view, browsing them does not move their tasks back
+        tasks = self.annotate_statistics(models.TaskAll.objects.filter(project=request.query_params.get('project_id')))
+        after = request.query_params.get('after', None)
+        limit = request.query_params.get('limit', None)
+        try:
+            if after is not None:
+                tasks = tasks.filter(id__gt=int(after))
+            tasks = tasks.order_by('id')
+            if limit is not None:
+                limit = int(limit)
+                if limit <= 0:
+                    raise ValueError
+                tasks = tasks[:limit]
+        except ValueError:
+            return Response(data={"message": "Invalid after or limit."}, status=status.HTTP_400_BAD_REQUEST)
         task_serializer = TaskSerializer(instance=tasks, many=True, fields=('id', 'updated_at',
                                                                             'worker_count', 'completed', 'total'))
         return Response(data=task_serializer.data, status=status.HTTP_200_OK)
@@ -433,36 +491,8 @@ class TaskViewSet(viewsets.ModelViewSet):
     @detail_route(methods=['get'], url_path='is-done')
     def is_done(self, request, *args, **kwargs):
         group_id = self.get_object().group_id
-        # noinspection SqlResolve
-        query = '''
-            SELECT greatest(t_count.completed, p.repetition) expected, t_count.completed, p.repetition
-            FROM crowdsourcing_task t
-              INNER JOIN (SELECT
-                            group_id,
-                            max(id) id
-                          FROM crowdsourcing_task
-                          WHERE deleted_at IS NULL
-                          GROUP BY group_id) t_max ON t_max.id = t.id
-              INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-              INNER JOIN (
-                           SELECT
-                             t.group_id,
-                             coalesce(sum(t.others), 0) completed
-                           FROM (
-                                  SELECT
-                                    t.group_id,
-                                    CASE WHEN tw.id IS NOT NULL
-                                      THEN 1
-                                    ELSE 0 END OTHERS
-                                  FROM crowdsourcing_task t
-                                    LEFT OUTER JOIN crowdsourcing_taskworker tw
-                                      ON (t.id = tw.task_id AND tw.status IN (2, 3))
-                                  WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
-                           GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
-            WHERE t.group_id = (%(group_id)s);
-        '''
         cursor = connection.cursor()
-        cursor.execute(query, {'group_id': group_id})
+        sql.execute('task_is_done', {'group_id': group_id}, cursor)
         task = cursor.fetchall()[0] if cursor.rowcount > 0 else None
         done = task[0] <= task[1]
         return Response(data={"is_done": done, 'expected': task[0]},
@@ -485,7 +515,7 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         if http_status == 200:
             serialized_data = TaskWorkerSerializer(instance=instance, fields=('id', 'task')).data
             update_worker_cache.delay([instance.worker_id], constants.TASK_ACCEPTED)
-            mturk_hit_update.delay({'id': instance.task.id})
+            schedule_hit_update(instance.task_id)
         return Response(serialized_data, http_status)
 
     def destroy(self, request, *args, **kwargs):
@@ -502,7 +532,8 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         obj.save()
         refund_task.delay([{'id': obj.id}])
         update_worker_cache.delay([obj.worker_id], constants.TASK_SKIPPED)
-        mturk_hit_update.delay({'id': obj.task.id})
+        schedule_hit_update(obj.task_id)
+        mark_tasks_dirty([obj.task_id])
         serialized_data = {}
         if http_status == status.HTTP_200_OK:
             serialized_data = TaskWorkerSerializer(instance=instance).data
@@ -557,7 +588,8 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
     def drop_saved_tasks(self, request, *args, **kwargs):
         task_ids = request.data.get('task_ids', [])
         for task_id in task_ids:
-            mturk_hit_update.delay({'id': task_id})
+            schedule_hit_update(task_id)
+        mark_tasks_dirty(task_ids)
         task_workers = self.queryset.filter(task_id__in=task_ids, worker=request.user)
         task_workers.update(
             status=TaskWorker.STATUS_SKIPPED, updated_at=timezone.now())
@@ -586,7 +618,7 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
     @list_route(methods=['get'], url_path="list-submissions")
     def list_submissions(self, request, *args, **kwargs):
         task_id = request.query_params.get('task_id', -1)
-        workers = TaskWorker.objects.filter(status__in=[2, 3, 5], task_id=task_id)
+        workers = models.TaskWorkerAll.objects.filter(status__in=[2, 3, 5], task_id=task_id)
         serializer = TaskWorkerSerializer(instance=workers, many=True,
                                           fields=('id', 'results',
                                                   'worker_alias', 'worker_rating', 'worker', 'status'))
@@ -594,7 +626,9 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
 
     @detail_route(methods=['get'], url_path='retrieve-with-data')
     def retrieve_with_data(self, request, *args, **kwargs):
-        task_worker = self.get_object()
+        task_worker = get_object_or_404(models.TaskWorkerAll.objects.select_related('worker', 'task__project'),
+                                        pk=kwargs['pk'])
+        self.check_object_permissions(request, task_worker)
         task = task_worker.task
         serializer = TaskSerializer(instance=task,
                                     fields=('id', 'template',),
@@ -774,6 +808,8 @@ class ExternalSubmit(APIView):
                 if task_worker.status in [1, 2, 5]:
                     task_worker_result.result = request.data
                     task_worker_result.save()
+                    # keeps the task worker visible to the results changes feed
+                    task_worker.save()
                     update_worker_cache.delay([task_worker.worker_id], constants.TASK_SUBMITTED)
                     return Response(request.data, status=status.HTTP_200_OK)
                 else:
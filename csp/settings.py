@@ -86,6 +86,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'crowdsourcing.middleware.budget.RequestBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -229,22 +230,44 @@ MAX_TASKS_IN_PROGRESS = int(os.environ.get('MAX_TASKS_IN_PROGRESS', 8))
 
 # Task Expiration
 TASK_EXPIRATION_BEAT = os.environ.get('TASK_EXPIRATION_BEAT', 1)
+# expire_hits also reconciles the task workers expired since its previous run, less this overlap (seconds)
+MTURK_EXPIRE_HITS_OVERLAP = int(os.environ.get('MTURK_EXPIRE_HITS_OVERLAP', 300))
 
 # MTurk
 MTURK_CLIENT_ID = os.environ.get('MTURK_CLIENT_ID', 'INVALID')
 MTURK_CLIENT_SECRET = os.environ.get('MTURK_CLIENT_SECRET', 'INVALID')
 MTURK_HOST = os.environ.get('MTURK_HOST', 'mechanicalturk.sandbox.amazonaws.com')
+# plain http and a port are only used against a local stand-in, see mturk.fake_server
+MTURK_PORT = int(os.environ['MTURK_PORT']) if 'MTURK_PORT' in os.environ else None
+MTURK_IS_SECURE = os.environ.get('MTURK_IS_SECURE', 'True') == 'True'
 MTURK_WORKER_HOST = os.environ.get('MTURK_WORKER_HOST', 'https://workersandbox.mturk.com/mturk/externalSubmit')
 ID_HASH_MIN_LENGTH = 8
 MTURK_WORKER_USERNAME = 'mturk'
 MTURK_QUALIFICATIONS = os.environ.get('MTURK_QUALIFICATIONS', True)
 MTURK_BEAT = os.environ.get('MTURK_BEAT', 1)
+# Every beat publishes the projects with queued changes, each project is fully synced at least every so many seconds
+MTURK_PUBLISH_FULL_SYNC = int(os.environ.get('MTURK_PUBLISH_FULL_SYNC', 900))
 AWS_DAEMO_KEY = os.environ.get('AWS_DAEMO_KEY')
 MTURK_ONLY = os.environ.get('MTURK_ONLY', False)
 MTURK_COMPLETION_TIME = int(os.environ.get('MTURK_COMPLETION_TIME', 12))
 MTURK_THRESHOLD = 0.61
 POST_TO_MTURK = os.environ.get('POST_TO_MTURK', True)
 MTURK_SYS_QUALIFICATIONS = os.environ.get('MTURK_SYS_QUALIFICATIONS', True)
+# Concurrent MTurk calls per operation, requests per second per account and retries of throttled calls,
+# the backoff (seconds) doubles on every retry
+MTURK_POOL_SIZE = int(os.environ.get('MTURK_POOL_SIZE', 8))
+MTURK_RATE_LIMIT = float(os.environ.get('MTURK_RATE_LIMIT', 5))
+MTURK_MAX_RETRIES = int(os.environ.get('MTURK_MAX_RETRIES', 5))
+MTURK_BACKOFF = float(os.environ.get('MTURK_BACKOFF', 0.5))
+# HIT updates of a task are coalesced for this many seconds, 0 sends each update right away
+MTURK_HIT_UPDATE_DELAY = int(os.environ.get('MTURK_HIT_UPDATE_DELAY', 5))
+# Seconds a requester's MTurk provider and its connections are reused within a process
+MTURK_PROVIDER_TTL = int(os.environ.get('MTURK_PROVIDER_TTL', 300))
+# MTurk notifications are queued in redis and applied in batches every beat (seconds)
+MTURK_NOTIFICATION_BATCH_SIZE = int(os.environ.get('MTURK_NOTIFICATION_BATCH_SIZE', 500))
+MTURK_NOTIFICATION_BEAT = int(os.environ.get('MTURK_NOTIFICATION_BEAT', 2))
+# Seconds an assignment id checked against MTurk is trusted on later loads of its HIT page
+MTURK_ASSIGNMENT_CACHE_TTL = int(os.environ.get('MTURK_ASSIGNMENT_CACHE_TTL', 3600))
 
 # AWS
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto.S3BotoStorage'
@@ -275,6 +298,51 @@ BOOMERANG_PLATFORM_ALPHA = float(os.environ.get('BOOMERANG_PLATFORM_ALPHA', 0.5)
 
 COLLECTIVE_REJECTION_THRESHOLD = 7
 
+# Number of parsed task template strings kept per process
+TEMPLATE_STRING_CACHE_SIZE = int(os.environ.get('TEMPLATE_STRING_CACHE_SIZE', 20000))
+# Serialized template revisions kept per process and in redis (seconds)
+TEMPLATE_PAYLOAD_CACHE_SIZE = int(os.environ.get('TEMPLATE_PAYLOAD_CACHE_SIZE', 1000))
+TEMPLATE_PAYLOAD_TTL = int(os.environ.get('TEMPLATE_PAYLOAD_TTL', 86400))
+# Render the task specific template items once when a project with at least this many tasks is published
+TASK_PRERENDER_ENABLED = os.environ.get('TASK_PRERENDER_ENABLED', 'False') == 'True'
+TASK_PRERENDER_MIN_TASKS = int(os.environ.get('TASK_PRERENDER_MIN_TASKS', 1000))
+
+# Named raw SQL statistics, flushed to redis at most every interval (seconds), and the share of statements that
+# also get an EXPLAIN (ANALYZE, BUFFERS) captured
+SQL_STATS_FLUSH_INTERVAL = int(os.environ.get('SQL_STATS_FLUSH_INTERVAL', 10))
+SQL_EXPLAIN_SAMPLE_RATE = float(os.environ.get('SQL_EXPLAIN_SAMPLE_RATE', 0))
+# Limits checked against captured plans by the check_query_plans command
+SQL_PLAN_HOT_TABLES = ('crowdsourcing_task', 'crowdsourcing_taskworker', 'crowdsourcing_taskworkerresult')
+SQL_PLAN_MAX_SEQ_SCAN_ROWS = int(os.environ.get('SQL_PLAN_MAX_SEQ_SCAN_ROWS', 10000))
+SQL_PLAN_COST_CEILINGS = {
+    'assign_task': 50000,
+    'assign_skipped_task': 50000,
+    'task_feed': 100000,
+    'task_is_done': 1000,
+    'project_is_done': 20000,
+    'project_batch_is_done': 20000,
+    'publish_payment': 100000,
+}
+
+# Move tasks of project groups finished for this many days out of the hot tables, a batch of groups per run (hours)
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'False') == 'True'
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 50))
+ARCHIVE_BEAT = int(os.environ.get('ARCHIVE_BEAT', 24))
+
+# Per request limits by view and action, requests over budget are logged as warnings. Queries are counted for
+# every request with DEBUG on and for this share of the requests otherwise
+REQUEST_BUDGET_SAMPLE_RATE = float(os.environ.get('REQUEST_BUDGET_SAMPLE_RATE', 0.01))
+REQUEST_BUDGETS = {
+    'TaskWorkerViewSet.create': {'queries': 15},
+    'TaskWorkerResultViewSet.submit_results': {'queries': 30},
+    'ProjectViewSet.task_feed': {'queries': 5},
+    'TaskViewSet.is_done': {'queries': 10},
+    # rows are read through a server-side cursor that is not captured, only the setup queries are counted
+    'FileViewSet.download_results': {'queries': 5},
+    'MTurkAssignmentViewSet.create': {'external_calls': 0},
+}
+
 IS_SANDBOX = os.environ.get('SANDBOX', 'False') == 'True'
 
 # Sessions
@@ -370,6 +438,11 @@ LOGGING = {
         'py.warnings': {
             'handlers': ['console'],
         },
+        'crowdsourcing.budget': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_BUDGET_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
     }
 }
 
@@ -417,6 +490,18 @@ CELERYBEAT_SCHEDULE = {
     'update-feed-boomerang': {
         'task': 'crowdsourcing.tasks.update_feed_boomerang',
         'schedule': timedelta(minutes=HEART_BEAT_BOOMERANG),
+    },
+    'mturk-flush-hit-updates': {
+        'task': 'mturk.tasks.mturk_flush_hit_updates',
+        'schedule': timedelta(seconds=max(MTURK_HIT_UPDATE_DELAY, 1)),
+    },
+    'mturk-process-notifications': {
+        'task': 'mturk.tasks.mturk_process_notifications',
+        'schedule': timedelta(seconds=MTURK_NOTIFICATION_BEAT),
+    },
+    'archive-projects': {
+        'task': 'crowdsourcing.tasks.archive_projects',
+        'schedule': timedelta(hours=ARCHIVE_BEAT),
     }
 }
 
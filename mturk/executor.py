@@ -0,0 +1,122 @@
+import httplib
+import random
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from boto.exception import BotoClientError, BotoServerError
+from boto.mturk.connection import MTurkRequestError
+from django.conf import settings
+
+from crowdsourcing.middleware.budget import record_external_call
+
+THROTTLING_ERRORS = ('AWS.ServiceUnavailable', 'ServiceUnavailable', 'Throttling', 'RequestThrottled',
+                     'AWS.MechanicalTurk.RequestThrottled')
+# answers that settle an assignment id as unknown to MTurk, unlike throttling or outages
+INVALID_ASSIGNMENT_ERRORS = ('AWS.MechanicalTurk.AssignmentDoesNotExist', 'AWS.ParameterOutOfRange',
+                             'AWS.MechanicalTurk.InvalidParameterValue')
+# connection failures and timeouts, socket.timeout and ssl.SSLError are socket errors
+TRANSPORT_ERRORS = (socket.error, httplib.HTTPException)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_error_code(error):
+    if isinstance(error, MTurkRequestError) and getattr(error, 'errors', None):
+        return error.errors[0][0]
+    return getattr(error, 'reason', None)
+
+
+def is_throttled(error):
+    return isinstance(error, MTurkRequestError) and (error.status == 503 or get_error_code(error) in THROTTLING_ERRORS)
+
+
+def is_transient(error):
+    """
+    Errors worth retrying, throttling, server side failures and lost connections.
+    """
+    if isinstance(error, TRANSPORT_ERRORS):
+        return True
+    return isinstance(error, BotoServerError) and (is_throttled(error) or (error.status or 0) >= 500)
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by every executor of one MTurk account in this process.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_rate_limiter(account):
+    with _limiters_lock:
+        if account not in _limiters:
+            _limiters[account] = RateLimiter(settings.MTURK_RATE_LIMIT)
+        return _limiters[account]
+
+
+class MTurkExecutor(object):
+    """
+    Runs MTurk operations on a bounded thread pool, every call waits for the account's rate limiter and
+    throttled or otherwise transient failures are retried with exponential backoff.
+    """
+
+    def __init__(self, account, pool_size=None, max_retries=None, backoff=None):
+        self.limiter = get_rate_limiter(account)
+        self.pool_size = pool_size or settings.MTURK_POOL_SIZE
+        self.max_retries = settings.MTURK_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.MTURK_BACKOFF if backoff is None else backoff
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Returns (result, True) on success and (error, False) once the call failed for good, a failing call never
+        raises so that one item can not abort a whole map.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            started = time.time()
+            try:
+                return fn(*args, **kwargs), True
+            except TRANSPORT_ERRORS + (BotoClientError, BotoServerError) as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    return e, False
+            finally:
+                record_external_call(time.time() - started)
+            time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+
+    def map(self, fn, items):
+        """
+        Calls fn(item) for every item, returns (item, result, success) tuples in the order of items.
+        """
+        items = list(items)
+        if not len(items):
+            return []
+        if len(items) == 1 or self.pool_size <= 1:
+            return [(item,) + self.call(fn, item) for item in items]
+        pool = ThreadPool(min(self.pool_size, len(items)))
+        try:
+            return pool.map(lambda item: (item,) + self.call(fn, item), items)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,260 @@
+import itertools
+import random
+import threading
+import time
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs
+from xml.sax.saxutils import escape
+
+THROTTLED_ERROR = 'AWS.ServiceUnavailable'
+
+
+def new_id(prefix):
+    return (prefix + uuid.uuid4().hex.upper())[:30]
+
+
+class FakeMTurkState(object):
+    """
+    What the fake service remembers between requests, every request is counted per operation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hit_types = {}
+        self.hits = {}
+        self.assignments = {}
+        self.qualification_types = {}
+        self.worker_qualifications = {}
+        self.notifications = {}
+        self.calls = {}
+        self.throttled = 0
+        self._sequence = itertools.count(1)
+
+    def add_assignment(self, hit_id, worker_id=None):
+        assignment_id = new_id('A')
+        with self.lock:
+            self.assignments[assignment_id] = {
+                'hit_id': hit_id,
+                'worker_id': worker_id or 'W{}'.format(next(self._sequence)),
+                'status': 'Submitted'
+            }
+        return assignment_id
+
+
+class FakeMTurkHandler(BaseHTTPRequestHandler):
+    """
+    Implements the subset of the MTurk REST API that MTurkProvider uses, as boto parses it.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_operation(parse_qs(self.path.partition('?')[2]))
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        params = parse_qs(self.rfile.read(length))
+        params.update(parse_qs(self.path.partition('?')[2]))
+        self.handle_operation(params)
+
+    def handle_operation(self, params):
+        params = {k: v[0] for k, v in params.items()}
+        operation = params.get('Operation', '')
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * (0.5 + random.random()))
+
+        with server.state.lock:
+            server.state.calls[operation] = server.state.calls.get(operation, 0) + 1
+        if server.is_throttled(params.get('AWSAccessKeyId', '')):
+            with server.state.lock:
+                server.state.throttled += 1
+            return self.respond_error(operation, THROTTLED_ERROR, 'Your requests are being throttled.')
+
+        handler = getattr(self, 'op_' + operation, None)
+        if handler is None:
+            return self.respond_error(operation, 'AWS.InvalidOperation', 'Unsupported operation ' + operation)
+        result = handler(params, server.state)
+        if isinstance(result, tuple):
+            return self.respond_error(operation, *result)
+        self.respond(operation, result)
+
+    def respond(self, operation, body):
+        xml = '<{0}Response><OperationRequest><RequestId>{1}</RequestId></OperationRequest>' \
+              '<{0}Result><Request><IsValid>True</IsValid></Request>{2}</{0}Result></{0}Response>'
+        self.write(xml.format(operation, uuid.uuid4(), body))
+
+    def respond_error(self, operation, code, message):
+        xml = '<{0}Response><OperationRequest><RequestId>{1}</RequestId>' \
+              '<Errors><Error><Code>{2}</Code><Message>{3}</Message></Error></Errors>' \
+              '</OperationRequest></{0}Response>'
+        self.write(xml.format(operation, uuid.uuid4(), code, escape(message)))
+
+    def write(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def op_GetAccountBalance(params, state):
+        return '<AvailableBalance><Amount>10000.00</Amount><CurrencyCode>USD</CurrencyCode>' \
+               '<FormattedPrice>$10,000.00</FormattedPrice></AvailableBalance>'
+
+    @staticmethod
+    def op_RegisterHITType(params, state):
+        hit_type_id = new_id('T')
+        with state.lock:
+            state.hit_types[hit_type_id] = {'title': params.get('Title')}
+        return '<HITTypeId>{}</HITTypeId>'.format(hit_type_id)
+
+    @staticmethod
+    def op_SetHITTypeNotification(params, state):
+        with state.lock:
+            state.notifications[params.get('HITTypeId')] = params.get('Notification.1.Destination')
+        return ''
+
+    @staticmethod
+    def op_CreateHIT(params, state):
+        hit_type_id = params.get('HITTypeId')
+        if hit_type_id not in state.hit_types:
+            return 'AWS.MechanicalTurk.HITTypeDoesNotExist', 'Unknown HIT type ' + str(hit_type_id)
+        hit_id = new_id('H')
+        with state.lock:
+            state.hits[hit_id] = {
+                'hit_type_id': hit_type_id,
+                'max_assignments': int(params.get('MaxAssignments', 1)),
+                'status': 'Assignable'
+            }
+        return '<HIT><HITId>{}</HITId><HITTypeId>{}</HITTypeId></HIT>'.format(hit_id, hit_type_id)
+
+    @staticmethod
+    def _update_hit(params, state, **values):
+        hit = state.hits.get(params.get('HITId'))
+        if hit is None:
+            return 'AWS.MechanicalTurk.HITDoesNotExist', 'Unknown HIT ' + str(params.get('HITId'))
+        with state.lock:
+            hit.update(values)
+        return ''
+
+    def op_ChangeHITTypeOfHIT(self, params, state):
+        return self._update_hit(params, state, hit_type_id=params.get('HITTypeId'))
+
+    def op_ExtendHIT(self, params, state):
+        hit = state.hits.get(params.get('HITId'))
+        increment = int(params.get('MaxAssignmentsIncrement', 0))
+        return self._update_hit(params, state, status='Assignable',
+                                max_assignments=(hit or {}).get('max_assignments', 0) + increment)
+
+    def op_ForceExpireHIT(self, params, state):
+        return self._update_hit(params, state, status='Expired')
+
+    def op_DisableHIT(self, params, state):
+        return self._update_hit(params, state, status='Disposed')
+
+    @staticmethod
+    def op_GetAssignment(params, state):
+        assignment = state.assignments.get(params.get('AssignmentId'))
+        if assignment is None:
+            return 'AWS.MechanicalTurk.AssignmentDoesNotExist', 'Unknown assignment'
+        return '<Assignment><AssignmentId>{0}</AssignmentId><WorkerId>{1}</WorkerId><HITId>{2}</HITId>' \
+               '<AssignmentStatus>{3}</AssignmentStatus></Assignment><HIT><HITId>{2}</HITId></HIT>' \
+            .format(params.get('AssignmentId'), assignment['worker_id'], assignment['hit_id'], assignment['status'])
+
+    @staticmethod
+    def _review_assignment(params, state, status):
+        assignment = state.assignments.get(params.get('AssignmentId'))
+        if assignment is None:
+            # assignments made up by a benchmark are accepted as they come
+            assignment = state.assignments.setdefault(params.get('AssignmentId'), {
+                'hit_id': None, 'worker_id': None, 'status': 'Submitted'
+            })
+        if assignment['status'] != 'Submitted':
+            return 'AWS.MechanicalTurk.InvalidAssignmentState', 'Assignment is ' + assignment['status']
+        with state.lock:
+            assignment['status'] = status
+        return ''
+
+    def op_ApproveAssignment(self, params, state):
+        return self._review_assignment(params, state, 'Approved')
+
+    def op_RejectAssignment(self, params, state):
+        return self._review_assignment(params, state, 'Rejected')
+
+    @staticmethod
+    def op_CreateQualificationType(params, state):
+        type_id = new_id('Q')
+        with state.lock:
+            state.qualification_types[type_id] = {'name': params.get('Name')}
+        return '<QualificationType><QualificationTypeId>{}</QualificationTypeId></QualificationType>'.format(type_id)
+
+    @staticmethod
+    def _set_qualification(params, state, value):
+        key = (params.get('QualificationTypeId'), params.get('WorkerId') or params.get('SubjectId'))
+        with state.lock:
+            if value is None:
+                state.worker_qualifications.pop(key, None)
+            else:
+                state.worker_qualifications[key] = value
+        return ''
+
+    def op_AssignQualification(self, params, state):
+        return self._set_qualification(params, state, params.get('IntegerValue', 1))
+
+    def op_UpdateQualificationScore(self, params, state):
+        return self._set_qualification(params, state, params.get('IntegerValue', 1))
+
+    def op_RevokeQualification(self, params, state):
+        return self._set_qualification(params, state, None)
+
+
+class FakeMTurkServer(ThreadingMixIn, HTTPServer):
+    """
+    A local stand-in for the MTurk service, for throughput tests of the mturk app.
+
+    latency is the mean seconds added to every request, throttle_rate the share of requests answered with a
+    throttling error and max_rps the requests per second accepted per access key before throttling.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, throttle_rate=0.0, max_rps=None):
+        HTTPServer.__init__(self, (host, port), FakeMTurkHandler)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.state = FakeMTurkState()
+        self._windows = {}
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def is_throttled(self, access_key):
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return True
+        if self.max_rps is None:
+            return False
+        second = int(time.time())
+        with self.state.lock:
+            window = self._windows.get(access_key)
+            if window is None or window[0] != second:
+                window = [second, 0]
+                self._windows[access_key] = window
+            window[1] += 1
+            return window[1] > self.max_rps
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -15,8 +15,10 @@ from hashids import Hashids
 from ws4redis.publisher import RedisPublisher
 from ws4redis.redis_store import RedisMessage
 
+from crowdsourcing import sql
 from crowdsourcing.models import Task, TaskWorker, Rating
 from csp import settings
+from mturk.executor import INVALID_ASSIGNMENT_ERRORS, MTurkExecutor, get_error_code
 from mturk.models import MTurkHIT, MTurkHITType, MTurkQualification, MTurkWorkerQualification
 from mturk.utils import MultiLocaleRequirement, BoomerangRequirement
 
@@ -42,6 +44,82 @@ WAIT_LIST_BUCKETS = [(1.80, 1.98), (1.60, 1.79), (1.40, 1.59), (1.20, 1.39), (1.
 BOOMERANG_QUAL_INITIAL = 300
 
 
+# noinspection SqlResolve
+CREATE_HITS_TEMPLATE = '''
+    SELECT
+      max(id)                   id,
+      repetition,
+      group_id,
+      repetition - sum(existing_assignments) remaining_assignments,
+      min_rating
+    FROM (
+           SELECT
+             t_rev.id,
+             t.group_id,
+             t.min_rating,
+             p.repetition,
+             CASE WHEN ma.id IS NULL OR ma.status IN (%(skipped)s, %(rejected)s, %(expired)s)
+               THEN 0
+             ELSE 1 END existing_assignments
+           FROM crowdsourcing_task t
+             INNER JOIN crowdsourcing_project p ON t.project_id = p.id
+             INNER JOIN crowdsourcing_task t_rev ON t_rev.group_id = t.group_id
+             LEFT OUTER JOIN mturk_mturkhit mh ON mh.task_id = t_rev.id
+             LEFT OUTER JOIN mturk_mturkassignment ma ON ma.hit_id = mh.id
+           WHERE t.project_id = (%(project_id)s) AND t_rev.exclude_at IS NULL
+           AND t_rev.deleted_at IS NULL {group_filter}
+    ) t
+    GROUP BY group_id, repetition, min_rating HAVING sum(existing_assignments) < repetition;
+'''
+sql.register('mturk_create_hits', CREATE_HITS_TEMPLATE.format(group_filter=''))
+sql.register('mturk_create_group_hits', CREATE_HITS_TEMPLATE.format(
+    group_filter='AND t.group_id = ANY(%(group_ids)s)'))
+
+# noinspection SqlResolve
+QUALIFICATION_RATINGS_QUERY = sql.register('boomerang_qualification_ratings', '''
+    SELECT * FROM (
+        SELECT
+          task.target_id,
+          task.username,
+          round(task.task_w_avg::NUMERIC, 2) rating
+          --round(coalesce(task.task_w_avg, requester.requester_w_avg,
+          --  platform.platform_w_avg)::NUMERIC, 2) rating
+        FROM (
+                       SELECT
+                         target_id,
+                         origin_id,
+                         project_id,
+                         username,
+                         sum(weight * power((%(BOOMERANG_TASK_ALPHA)s), t.row_number))
+                         / sum(power((%(BOOMERANG_TASK_ALPHA)s), t.row_number)) task_w_avg
+                       FROM (
+
+                              SELECT
+                                r.id,
+                                r.origin_id,
+                                p.group_id                              project_id,
+                                weight,
+                                r.target_id,
+                                -1 + row_number()
+                                OVER (PARTITION BY target_id
+                                  ORDER BY tw.created_at DESC) AS row_number,
+                                  u.username username
+
+                              FROM crowdsourcing_rating r
+                                INNER JOIN crowdsourcing_task t ON t.id = r.task_id
+                                INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                                INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
+                                  AND tw.worker_id=r.target_id
+                                INNER JOIN auth_user u ON u.id = r.target_id
+                              WHERE origin_id = (%(origin_id)s) AND origin_type = (%(origin_type)s)) t
+                       GROUP BY origin_id, target_id, project_id, username)
+                     task WHERE task.project_id = (%(project_id)s)
+    ) r
+''')
+sql.register('boomerang_waitlist_ratings', QUALIFICATION_RATINGS_QUERY +
+             'WHERE rating BETWEEN (%(lower_bound)s) AND (%(upper_bound)s);')
+
+
 class MTurkProvider(object):
     description = 'This is a task authored by a requester on Daemo, a research crowdsourcing platform. ' \
                   'Mechanical Turk workers are welcome to do it'
@@ -54,9 +132,14 @@ class MTurkProvider(object):
         self.connection = MTurkConnection(
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
-            host=settings.MTURK_HOST
+            host=settings.MTURK_HOST,
+            port=settings.MTURK_PORT,
+            is_secure=settings.MTURK_IS_SECURE
         )
         self.connection.APIVersion = "2014-08-15"
+        self.executor = MTurkExecutor(account=aws_access_key_id)
+        # qualification types resolved during the current create_hits run, keyed by (owner, flag, name)
+        self._qualification_types = {}
         if not self.host:
             raise ValueError("Please provide a host url")
 
@@ -120,42 +203,17 @@ class MTurkProvider(object):
                 requirements.append(boomerang)
         return Qualifications(requirements), boomerang_qual
 
-    def create_hits(self, project, tasks=None, repetition=None):
+    def create_hits(self, project, tasks=None, repetition=None, group_ids=None):
         # if project.min_rating > 0:
         #     return 'NOOP'
         if not tasks:
             cursor = connection.cursor()
-            # noinspection SqlResolve
-            query = '''
-                SELECT
-                  max(id)                   id,
-                  repetition,
-                  group_id,
-                  repetition - sum(existing_assignments) remaining_assignments,
-                  min_rating
-                FROM (
-                       SELECT
-                         t_rev.id,
-                         t.group_id,
-                         t.min_rating,
-                         p.repetition,
-                         CASE WHEN ma.id IS NULL OR ma.status IN (%(skipped)s, %(rejected)s, %(expired)s)
-                           THEN 0
-                         ELSE 1 END existing_assignments
-                       FROM crowdsourcing_task t
-                         INNER JOIN crowdsourcing_project p ON t.project_id = p.id
-                         INNER JOIN crowdsourcing_task t_rev ON t_rev.group_id = t.group_id
-                         LEFT OUTER JOIN mturk_mturkhit mh ON mh.task_id = t_rev.id
-                         LEFT OUTER JOIN mturk_mturkassignment ma ON ma.hit_id = mh.id
-                       WHERE t.project_id = (%(project_id)s) AND t_rev.exclude_at IS NULL
-                       AND t_rev.deleted_at IS NULL
-                ) t
-                GROUP BY group_id, repetition, min_rating HAVING sum(existing_assignments) < repetition;
-            '''
-            cursor.execute(query, {'skipped': TaskWorker.STATUS_SKIPPED,
-                                   'rejected': TaskWorker.STATUS_REJECTED,
-                                   'expired': TaskWorker.STATUS_EXPIRED,
-                                   'project_id': project.id})
+            statement = 'mturk_create_hits' if group_ids is None else 'mturk_create_group_hits'
+            sql.execute(statement, {'skipped': TaskWorker.STATUS_SKIPPED,
+                                    'rejected': TaskWorker.STATUS_REJECTED,
+                                    'expired': TaskWorker.STATUS_EXPIRED,
+                                    'project_id': project.id,
+                                    'group_ids': list(group_ids or [])}, cursor)
             tasks = cursor.fetchall()
 
         rated_workers = Rating.objects.filter(origin_type=Rating.RATING_REQUESTER).count()
@@ -165,55 +223,79 @@ class MTurkProvider(object):
         lifetime = project.deadline - timezone.now() if project.deadline is not None else datetime.timedelta(
             days=7)
 
+        # qualifications and hit types only depend on the boomerang threshold of a task, they are resolved
+        # once per distinct threshold and shared by all tasks of this run
+        self._qualification_types = {}
+        hit_types = {}
+        mturk_hits = {hit.task_id: hit for hit in MTurkHIT.objects.filter(task_id__in=[task[0] for task in tasks])}
+
+        new_hits = []
+        changed_hits = []
         for task in tasks:
-            question = self.create_external_question(task[0])
-            mturk_hit = MTurkHIT.objects.filter(task_id=task[0]).first()
-            qualifications, boomerang_qual = self.get_qualifications(project=project,
-                                                                     boomerang_threshold=int(
-                                                                         round(task[4], 2) * 100),
-                                                                     add_boomerang=add_boomerang)
-            qualifications_mask = 0
-            if qualifications is not None:
-                qualifications_mask = FLAG_Q_LOCALE + FLAG_Q_HITS + FLAG_Q_RATE + FLAG_Q_BOOMERANG
-            hit_type, success = self.create_hit_type(title=project.name, description=self.description,
-                                                     price=project.price,
-                                                     duration=duration, keywords=self.keywords,
-                                                     approval_delay=datetime.timedelta(days=2),
-                                                     qual_req=qualifications,
-                                                     qualifications_mask=qualifications_mask,
-                                                     boomerang_threshold=int(round(task[4], 2) * 100),
-                                                     owner_id=project.owner_id, boomerang_qual=boomerang_qual)
-            if not success:
-                return 'FAILURE'
+            mturk_hit = mturk_hits.get(task[0])
+            boomerang_threshold = int(round(task[4], 2) * 100)
+            if boomerang_threshold not in hit_types:
+                qualifications, boomerang_qual = self.get_qualifications(project=project,
+                                                                         boomerang_threshold=boomerang_threshold,
+                                                                         add_boomerang=add_boomerang)
+                qualifications_mask = 0
+                if qualifications is not None:
+                    qualifications_mask = FLAG_Q_LOCALE + FLAG_Q_HITS + FLAG_Q_RATE + FLAG_Q_BOOMERANG
+                hit_type, success = self.create_hit_type(title=project.name, description=self.description,
+                                                         price=project.price,
+                                                         duration=duration, keywords=self.keywords,
+                                                         approval_delay=datetime.timedelta(days=2),
+                                                         qual_req=qualifications,
+                                                         qualifications_mask=qualifications_mask,
+                                                         boomerang_threshold=boomerang_threshold,
+                                                         owner_id=project.owner_id, boomerang_qual=boomerang_qual)
+                if not success:
+                    return 'FAILURE'
+                hit_types[boomerang_threshold] = hit_type
+            hit_type = hit_types[boomerang_threshold]
 
             if mturk_hit is None:
-                try:
-                    hit = self.connection.create_hit(hit_type=hit_type.string_id,
-                                                     max_assignments=task[3],
-                                                     lifetime=lifetime,
-                                                     question=question)[0]
-                    self.set_notification(hit_type_id=hit.HITTypeId)
-                    mturk_hit = MTurkHIT(hit_id=hit.HITId, hit_type=hit_type, task_id=task[0])
-                except MTurkRequestError as e:
-                    error = e.errors[0][0]
-                    if error == 'AWS.MechanicalTurk.InsufficientFunds':
-                        message = {
-                            "type": "ERROR",
-                            "detail": "Insufficient funds on your Mechanical Turk account!",
-                            "code": error
-                        }
-
-                        redis_publisher = RedisPublisher(facility='bot', users=[project.owner])
-                        message = RedisMessage(json.dumps(message))
-                        redis_publisher.publish_message(message)
-                    return 'FAILED'
-            else:
-                if mturk_hit.hit_type_id != hit_type.id:
-                    result, success = self.change_hit_type_of_hit(hit_id=mturk_hit.hit_id,
-                                                                  hit_type_id=hit_type.string_id)
-                    if success:
-                        mturk_hit.hit_type = hit_type
-            mturk_hit.save()
+                new_hits.append((task, hit_type))
+            elif mturk_hit.hit_type_id != hit_type.id:
+                changed_hits.append((mturk_hit, hit_type))
+
+        def create_hit(item):
+            return self.connection.create_hit(hit_type=item[1].string_id, max_assignments=item[0][3],
+                                              lifetime=lifetime, question=self.create_external_question(item[0][0]))[0]
+
+        created = []
+        error = None
+        for (task, hit_type), hit, success in self.executor.map(create_hit, new_hits):
+            if success:
+                created.append(MTurkHIT(hit_id=hit.HITId, hit_type=hit_type, task_id=task[0]))
+            elif error is None:
+                error = get_error_code(hit)
+        MTurkHIT.objects.bulk_create(created)
+        for hit_type_id in set([hit.hit_type.string_id for hit in created]):
+            self.set_notification(hit_type_id=hit_type_id)
+
+        def change_hit_type(item):
+            return self.connection.change_hit_type_of_hit(hit_id=item[0].hit_id, hit_type=item[1].string_id)
+
+        changed = {}
+        for (mturk_hit, hit_type), _, success in self.executor.map(change_hit_type, changed_hits):
+            if success:
+                changed.setdefault(hit_type.id, []).append(mturk_hit.id)
+        for hit_type_id, hit_ids in changed.items():
+            MTurkHIT.objects.filter(id__in=hit_ids).update(hit_type_id=hit_type_id, updated_at=timezone.now())
+
+        if error is not None:
+            if error == 'AWS.MechanicalTurk.InsufficientFunds':
+                message = {
+                    "type": "ERROR",
+                    "detail": "Insufficient funds on your Mechanical Turk account!",
+                    "code": error
+                }
+
+                redis_publisher = RedisPublisher(facility='bot', users=[project.owner])
+                message = RedisMessage(json.dumps(message))
+                redis_publisher.publish_message(message)
+            return 'FAILED'
         return 'SUCCESS'
 
     def create_hit_type(self, owner_id, title, description, price, duration, boomerang_threshold, keywords=None,
@@ -261,8 +343,10 @@ class MTurkProvider(object):
                                                                         TaskWorker.STATUS_SKIPPED,
                                                                         TaskWorker.STATUS_EXPIRED])).count()
         remaining_assignments = task.project.repetition - assignments_completed
+        # reviewed assignments keep their approval outcome as status, they still count as submitted here
         if remaining_assignments > 0 and mturk_hit.num_assignments == mturk_hit.mturk_assignments. \
-            filter(status=TaskWorker.STATUS_SUBMITTED).count() and \
+            filter(status__in=[TaskWorker.STATUS_SUBMITTED, TaskWorker.STATUS_ACCEPTED,
+                               TaskWorker.STATUS_REJECTED]).count() and \
                 mturk_hit.mturk_assignments.filter(status=TaskWorker.STATUS_IN_PROGRESS).count() == 0:
             self.add_assignments(hit_id=mturk_hit.hit_id, increment=1)
             self.extend_hit(hit_id=mturk_hit.hit_id)
@@ -280,13 +364,20 @@ class MTurkProvider(object):
         return 'SUCCESS'
 
     def get_assignment(self, assignment_id):
-        try:
-            return self.connection.get_assignment(assignment_id)[0], True
-        except MTurkRequestError as e:
-            error = e.errors[0][0]
-            if error == 'AWS.MechanicalTurk.InvalidAssignmentState':
-                return assignment_id, False
+        """
+        Returns (assignment, True), (assignment_id, False) for an assignment in a state that cannot be read and
+        (None, False) for one MTurk does not know. Any other error is raised since it says nothing about the
+        assignment.
+        """
+        result, success = self.executor.call(self.connection.get_assignment, assignment_id)
+        if success:
+            return result[0], True
+        error_code = get_error_code(result)
+        if error_code == 'AWS.MechanicalTurk.InvalidAssignmentState':
+            return assignment_id, False
+        if error_code in INVALID_ASSIGNMENT_ERRORS:
             return None, False
+        raise result
 
     def set_notification(self, hit_type_id):
         self.connection.set_rest_notification(hit_type=hit_type_id,
@@ -297,48 +388,50 @@ class MTurkProvider(object):
     def approve_assignment(self, task_worker):
         task_worker_obj = TaskWorker.objects.get(id=task_worker['id'])
         if hasattr(task_worker_obj, 'mturk_assignments') and task_worker_obj.mturk_assignments.first() is not None:
-            try:
-                self.connection.approve_assignment(task_worker_obj.mturk_assignments.first().assignment_id)
-            except MTurkRequestError:
-                return False
+            return self.executor.call(self.connection.approve_assignment,
+                                      task_worker_obj.mturk_assignments.first().assignment_id)[1]
         return True
 
     def reject_assignment(self, task_worker):
         task_worker_obj = TaskWorker.objects.get(id=task_worker['id'])
         if hasattr(task_worker_obj, 'mturk_assignments') and task_worker_obj.mturk_assignments.first() is not None:
-            try:
-                self.connection.reject_assignment(task_worker_obj.mturk_assignments.first().assignment_id)
-            except MTurkRequestError:
-                return False
+            return self.executor.call(self.connection.reject_assignment,
+                                      task_worker_obj.mturk_assignments.first().assignment_id)[1]
         return True
 
     def expire_hit(self, hit_id):
-        try:
-            self.connection.expire_hit(hit_id)
-        except MTurkRequestError:
-            return False
-        return True
+        return self.executor.call(self.connection.expire_hit, hit_id)[1]
 
     def disable_hit(self, hit_id):
-        try:
-            self.connection.disable_hit(hit_id)
-        except MTurkRequestError:
-            return False
-        return True
+        return self.executor.call(self.connection.disable_hit, hit_id)[1]
 
     def extend_hit(self, hit_id):
-        try:
-            self.connection.extend_hit(hit_id=hit_id, expiration_increment=604800)  # 7 days
-        except MTurkRequestError:
-            return False
-        return True
+        return self.executor.call(self.connection.extend_hit, hit_id=hit_id, expiration_increment=604800)[1]  # 7 days
 
     def add_assignments(self, hit_id, increment=1):
-        try:
-            self.connection.extend_hit(hit_id=hit_id, assignments_increment=increment)
-        except MTurkRequestError:
-            return False
-        return True
+        return self.executor.call(self.connection.extend_hit, hit_id=hit_id, assignments_increment=increment)[1]
+
+    def _run_all(self, fn, items):
+        return [item for item, _, success in self.executor.map(fn, items) if success]
+
+    def approve_assignments(self, assignment_ids):
+        """
+        Approves assignments concurrently, returns the ids that were approved.
+        """
+        return self._run_all(self.connection.approve_assignment, assignment_ids)
+
+    def reject_assignments(self, assignment_ids):
+        return self._run_all(self.connection.reject_assignment, assignment_ids)
+
+    def expire_hits(self, hit_ids):
+        return self._run_all(self.connection.expire_hit, hit_ids)
+
+    def disable_hits(self, hit_ids):
+        return self._run_all(self.connection.disable_hit, hit_ids)
+
+    def extend_hits(self, hit_ids):
+        return self._run_all(lambda hit_id: self.connection.extend_hit(hit_id=hit_id, expiration_increment=604800),
+                             hit_ids)
 
     def test_connection(self):
         try:
@@ -357,48 +450,18 @@ class MTurkProvider(object):
 
     def create_qualification_type(self, owner_id, name, flag, description, project_id, auto_granted=False,
                                   auto_granted_value=None, deny=False, bucket=None):
-        # noinspection SqlResolve
-        query = '''
-            SELECT * FROM (
-                SELECT
-                  task.target_id,
-                  task.username,
-                  round(task.task_w_avg::NUMERIC, 2) rating
-                  --round(coalesce(task.task_w_avg, requester.requester_w_avg,
-                  --  platform.platform_w_avg)::NUMERIC, 2) rating
-                FROM (
-                               SELECT
-                                 target_id,
-                                 origin_id,
-                                 project_id,
-                                 username,
-                                 sum(weight * power((%(BOOMERANG_TASK_ALPHA)s), t.row_number))
-                                 / sum(power((%(BOOMERANG_TASK_ALPHA)s), t.row_number)) task_w_avg
-                               FROM (
-
-                                      SELECT
-                                        r.id,
-                                        r.origin_id,
-                                        p.group_id                              project_id,
-                                        weight,
-                                        r.target_id,
-                                        -1 + row_number()
-                                        OVER (PARTITION BY target_id
-                                          ORDER BY tw.created_at DESC) AS row_number,
-                                          u.username username
-
-                                      FROM crowdsourcing_rating r
-                                        INNER JOIN crowdsourcing_task t ON t.id = r.task_id
-                                        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                                        INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
-                                          AND tw.worker_id=r.target_id
-                                        INNER JOIN auth_user u ON u.id = r.target_id
-                                      WHERE origin_id = (%(origin_id)s) AND origin_type = (%(origin_type)s)) t
-                               GROUP BY origin_id, target_id, project_id, username)
-                             task WHERE task.project_id = (%(project_id)s)
-            ) r
-        '''
-        extra_query = 'WHERE rating BETWEEN (%(lower_bound)s) AND (%(upper_bound)s);'
+        cache_key = (owner_id, flag, name)
+        if cache_key in self._qualification_types:
+            return self._qualification_types[cache_key]
+        result = self._create_qualification_type(owner_id=owner_id, name=name, flag=flag, description=description,
+                                                 project_id=project_id, auto_granted=auto_granted,
+                                                 auto_granted_value=auto_granted_value, deny=deny, bucket=bucket)
+        if result[1]:
+            self._qualification_types[cache_key] = result
+        return result
+
+    def _create_qualification_type(self, owner_id, name, flag, description, project_id, auto_granted,
+                                   auto_granted_value, deny, bucket):
         params = {
             'origin_type': Rating.RATING_REQUESTER, 'origin_id': owner_id, 'project_id': project_id,
             'BOOMERANG_REQUESTER_ALPHA': settings.BOOMERANG_REQUESTER_ALPHA,
@@ -406,18 +469,19 @@ class MTurkProvider(object):
             'BOOMERANG_TASK_ALPHA': settings.BOOMERANG_TASK_ALPHA
         }
         obj_params = {'upper_bound': 300, 'lower_bound': 100}
+        statement = 'boomerang_qualification_ratings'
         if deny and bucket is not None:
-            query += extra_query
+            statement = 'boomerang_waitlist_ratings'
             params.update({'upper_bound': bucket[1], 'lower_bound': bucket[0]})
             obj_params.update({'upper_bound': bucket[1] * 100, 'lower_bound': bucket[0] * 100, 'is_blacklist': True})
         cursor = connection.cursor()
-        cursor.execute(query, params=params)
+        sql.execute(statement, params, cursor)
         worker_ratings_raw = cursor.fetchall()
         worker_ratings = [{"worker_id": r[0], "worker_username": r[1], "rating": r[2]} for
                           r in worker_ratings_raw]
 
         qualification = MTurkQualification.objects.filter(owner_id=owner_id, flag=flag, name=name).first()
-        assigned_workers = []
+        assigned_workers = {}
         if qualification is None:
             try:
                 qualification_type = self.connection. \
@@ -434,27 +498,72 @@ class MTurkProvider(object):
             except MTurkRequestError:
                 return None, False
         else:
-            assigned_workers = MTurkWorkerQualification.objects.values('worker').filter(
-                qualification=qualification).values_list('worker', flat=True)
+            assigned_workers = {
+                q.worker: q for q in MTurkWorkerQualification.objects.filter(qualification=qualification)
+            }
 
+        scores = {}
         for rating in worker_ratings:
             user_name = rating["worker_username"].split('.')
             if len(user_name) == 2 and user_name[0] == 'mturk':
-                mturk_worker_id = user_name[1].upper()
-                if mturk_worker_id not in assigned_workers:
-                    self.assign_qualification(
-                        qualification_type_id=qualification.type_id, worker_id=mturk_worker_id,
-                        value=int(rating['rating'] * 100))
-                defaults = {
-                    'qualification': qualification,
-                    'worker': mturk_worker_id,
-                    'score': int(rating['rating'] * 100)
-                }
-                MTurkWorkerQualification.objects.update_or_create(qualification=qualification,
-                                                                  worker=mturk_worker_id,
-                                                                  defaults=defaults)
+                scores[user_name[1].upper()] = int(rating['rating'] * 100)
+        self.sync_worker_qualifications(qualification, scores, assigned_workers=assigned_workers)
         return qualification, True
 
+    def sync_worker_qualifications(self, qualification, scores, overwritten=None, assigned_workers=None):
+        """
+        Brings the scores of a qualification on MTurk and in MTurkWorkerQualification to the given ones, only
+        workers that are new or whose score changed cost an MTurk call.
+        Args:
+            qualification: MTurkQualification
+            scores: score by MTurk worker id
+            overwritten: stored on the changed rows unless None
+            assigned_workers: the qualification's MTurkWorkerQualification rows by worker, if already loaded
+
+        Returns:
+            int, the number of workers changed
+        """
+        if assigned_workers is None:
+            assigned_workers = {
+                q.worker: q for q in MTurkWorkerQualification.objects.filter(qualification=qualification,
+                                                                             worker__in=scores.keys())
+            }
+        new_scores = []
+        changed_scores = []
+        flagged = []
+        for worker_id, score in scores.items():
+            worker_qual = assigned_workers.get(worker_id)
+            if worker_qual is None:
+                new_scores.append((worker_id, score))
+            elif worker_qual.score != score:
+                changed_scores.append((worker_qual, score))
+            elif overwritten is not None and worker_qual.overwritten != overwritten:
+                flagged.append(worker_qual.id)
+
+        def assign(item):
+            return self.connection.assign_qualification(qualification.type_id, item[0], item[1],
+                                                        send_notification=False)
+
+        def change_score(item):
+            return self.connection.update_qualification_score(qualification.type_id, item[0].worker, item[1])
+
+        MTurkWorkerQualification.objects.bulk_create([
+            MTurkWorkerQualification(qualification=qualification, worker=worker_id, score=score,
+                                     overwritten=bool(overwritten))
+            for (worker_id, score), _, success in self.executor.map(assign, new_scores) if success
+        ])
+        updated = {}
+        for (worker_qual, score), _, success in self.executor.map(change_score, changed_scores):
+            if success:
+                updated.setdefault(score, []).append(worker_qual.id)
+        values = {} if overwritten is None else {'overwritten': overwritten}
+        for score, ids in updated.items():
+            MTurkWorkerQualification.objects.filter(id__in=ids).update(score=score, updated_at=timezone.now(),
+                                                                       **values)
+        if len(flagged):
+            MTurkWorkerQualification.objects.filter(id__in=flagged).update(updated_at=timezone.now(), **values)
+        return len(new_scores) + len(changed_scores)
+
     def change_hit_type_of_hit(self, hit_id, hit_type_id):
         try:
             result = self.connection.change_hit_type_of_hit(hit_id=hit_id, hit_type=hit_type_id)
@@ -462,37 +571,26 @@ class MTurkProvider(object):
             return None, False
         return result, True
 
-    def update_worker_boomerang(self, project_id, worker_id, task_avg, requester_avg):
+    def update_worker_boomerang(self, project_id, scores):
         """
         Update boomerang for project
         Args:
             project_id:
-            worker_id:
-            task_avg:
-            requester_avg
+            scores: task average score by MTurk worker id
 
         Returns:
             str
         """
         hit = MTurkHIT.objects.select_related('hit_type__boomerang_qualification').filter(
             task__project__group_id=project_id).first()
-        if hit is not None:
-            qualification = hit.hit_type.boomerang_qualification
-            worker_qual = MTurkWorkerQualification.objects.filter(qualification=qualification,
-                                                                  worker=worker_id).first()
-            if worker_qual is not None:
-                self.update_score(worker_qual, score=int(task_avg * 100), override=True)
-            else:
-                MTurkWorkerQualification.objects.create(qualification=qualification, worker=worker_id,
-                                                        score=int(task_avg * 100), overwritten=True)
-                self.assign_qualification(qualification_type_id=qualification.type_id, worker_id=worker_id,
-                                          value=int(task_avg * 100))
-
-                # other_quals = MTurkWorkerQualification.objects.filter(~Q(qualification=qualification),
-                #                                                       worker=worker_id,
-                #                                                       overwritten=False)
-                # for q in other_quals:
-                #     self.update_score(q, score=int(requester_avg * 100))
+        if hit is not None and hit.hit_type.boomerang_qualification is not None:
+            self.sync_worker_qualifications(hit.hit_type.boomerang_qualification, scores, overwritten=True)
+
+            # other_quals = MTurkWorkerQualification.objects.filter(~Q(qualification=qualification),
+            #                                                       worker=worker_id,
+            #                                                       overwritten=False)
+            # for q in other_quals:
+            #     self.update_score(q, score=int(requester_avg * 100))
         return 'SUCCESS'
 
     def update_score(self, worker_qual, score, override=False):
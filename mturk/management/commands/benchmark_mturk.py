@@ -0,0 +1,113 @@
+import time
+from urllib import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from hashids import Hashids
+from rest_framework.test import APIRequestFactory
+
+from crowdsourcing.models import Project
+from csp import settings as csp_settings
+from mturk.fake_server import FakeMTurkServer
+from mturk.interface import MTurkProvider
+from mturk.models import MTurkHIT
+from mturk.tasks import mturk_process_notifications
+from mturk.viewsets import MTurkAssignmentViewSet
+
+MTURK_SETTINGS = ('MTURK_HOST', 'MTURK_PORT', 'MTURK_IS_SECURE')
+
+
+class Command(BaseCommand):
+    help = 'Publishes projects to a local MTurk stand-in and drives the assignment and notification endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, nargs='*', help='project ids, all in progress ones by default')
+        parser.add_argument('--assignments', type=int, default=500)
+        parser.add_argument('--notifications', type=int, default=1000)
+        parser.add_argument('--latency', type=float, default=0.05, help='mean seconds per MTurk request')
+        parser.add_argument('--throttle-rate', type=float, default=0.0)
+        parser.add_argument('--max-rps', type=int, default=None)
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='allow running when DEBUG is off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Refusing to publish benchmark HITs with DEBUG off, use --force')
+        projects = Project.objects.active().filter(status=Project.STATUS_IN_PROGRESS)
+        if options['projects']:
+            projects = projects.filter(id__in=options['projects'])
+
+        server = FakeMTurkServer(latency=options['latency'], throttle_rate=options['throttle_rate'],
+                                 max_rps=options['max_rps']).start()
+        previous = {name: getattr(csp_settings, name) for name in MTURK_SETTINGS}
+        csp_settings.MTURK_HOST, csp_settings.MTURK_PORT, csp_settings.MTURK_IS_SECURE = \
+            '127.0.0.1', server.port, False
+        try:
+            provider = MTurkProvider(host='http://localhost', aws_access_key_id='BENCHMARK',
+                                     aws_secret_access_key='BENCHMARK')
+            self.publish(provider, projects)
+            hit_ids = list(MTurkHIT.objects.filter(task__project__in=projects).values_list('hit_id', 'task_id'))
+            if not len(hit_ids):
+                raise CommandError('No HITs were published')
+            self.assign(server, hit_ids[:options['assignments']])
+            self.notify(hit_ids, options['notifications'])
+            self.approve(server, provider, hit_ids[:options['assignments']])
+        finally:
+            for name, value in previous.items():
+                setattr(csp_settings, name, value)
+            server.stop()
+
+        self.stdout.write('MTurk calls: {}'.format(', '.join(
+            '{} {}'.format(op, count) for op, count in sorted(server.state.calls.items()))))
+        self.stdout.write('throttled: {}'.format(server.state.throttled))
+
+    def report(self, name, count, duration):
+        self.stdout.write('{:<14} {:>6} in {:8.3f}s ({:.1f}/s)'.format(name, count, duration,
+                                                                      count / max(duration, 1e-9)))
+
+    def publish(self, provider, projects):
+        start = time.time()
+        before = MTurkHIT.objects.count()
+        for project in projects:
+            provider.create_hits(project)
+        self.report('publish', MTurkHIT.objects.count() - before, time.time() - start)
+
+    def assign(self, server, hit_ids):
+        task_hash = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
+        view = MTurkAssignmentViewSet.as_view({'post': 'create'})
+        factory = APIRequestFactory()
+        start = time.time()
+        for i, (hit_id, task_id) in enumerate(hit_ids):
+            worker_id = 'BENCHMARK{}'.format(i)
+            data = {
+                'workerId': worker_id,
+                'taskId': task_hash.encode(task_id),
+                'hitId': hit_id,
+                'assignmentId': server.state.add_assignment(hit_id, worker_id=worker_id)
+            }
+            view(factory.post('/api/mturk', data, format='json'))
+        self.report('assignments', len(hit_ids), time.time() - start)
+
+    def notify(self, hit_ids, count):
+        view = MTurkAssignmentViewSet.as_view({'post': 'notification'})
+        factory = APIRequestFactory()
+        start = time.time()
+        for i in range(count):
+            hit_id = hit_ids[i % len(hit_ids)][0]
+            params = {
+                'Event.1.EventType': 'AssignmentAccepted',
+                'Event.1.HITId': hit_id,
+                'Event.1.AssignmentId': 'BENCHMARK{}'.format(i)
+            }
+            view(factory.post('/api/mturk/notification?' + urlencode(params)))
+        self.report('notifications', count, time.time() - start)
+        start = time.time()
+        mturk_process_notifications()
+        self.report('applied', count, time.time() - start)
+
+    def approve(self, server, provider, hit_ids):
+        hits = set([hit_id for hit_id, _ in hit_ids])
+        assignment_ids = [a for a, assignment in server.state.assignments.items() if assignment['hit_id'] in hits]
+        start = time.time()
+        approved = provider.approve_assignments(assignment_ids)
+        self.report('approvals', len(approved), time.time() - start)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mturk', '0011_auto_20160830_0621'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mturknotification',
+            name='assignment_id',
+            field=models.CharField(max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='mturknotification',
+            name='event_type',
+            field=models.CharField(max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='mturknotification',
+            name='hit_id',
+            field=models.CharField(max_length=128, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='mturknotification',
+            index_together=set([('assignment_id', 'hit_id', 'event_type')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mturk', '0012_auto_20261019_1300'),
+    ]
+
+    operations = [
+        # keep the first of the events recorded more than once before the constraint existed
+        migrations.RunSQL('''
+            DELETE FROM mturk_mturknotification n
+            USING mturk_mturknotification d
+            WHERE n.assignment_id = d.assignment_id AND n.hit_id = d.hit_id AND n.event_type = d.event_type
+              AND n.id > d.id;
+        ''', reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='mturknotification',
+            unique_together=set([('assignment_id', 'hit_id', 'event_type')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='mturknotification',
+            index_together=set([]),
+        ),
+    ]
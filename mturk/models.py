@@ -45,6 +45,12 @@ class MTurkAssignment(Timed):
 
 class MTurkNotification(Timed):
     data = JSONField(null=True)
+    hit_id = models.CharField(max_length=128, null=True)
+    assignment_id = models.CharField(max_length=128, null=True)
+    event_type = models.CharField(max_length=32, null=True)
+
+    class Meta:
+        unique_together = [['assignment_id', 'hit_id', 'event_type']]
 
 
 class MTurkAccount(Timed):
@@ -1,26 +1,87 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
 from django.contrib.auth.models import User
 from django.db.models import Q
 from django.conf import settings
-from django.db import connection
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from crowdsourcing import sql
 from crowdsourcing.crypto import AESUtil
 from crowdsourcing.models import Project, TaskWorker, Task, Rating
+from crowdsourcing.redis import RedisProvider
 from csp.celery import app as celery_app
 from csp.settings import SITE_HOST, AWS_DAEMO_KEY
 from mturk.interface import MTurkProvider
-from mturk.models import MTurkHIT
+from mturk.models import MTurkAssignment, MTurkHIT, MTurkNotification
+
+
+DIRTY_PROJECTS_KEY = 'mturk:dirty_projects'
+DIRTY_TASKS_KEY = 'mturk:dirty_tasks'
+PUBLISH_WATERMARKS_KEY = 'mturk:publish_watermarks'
+
+
+def mark_project_dirty(project_group_id):
+    """
+    Queues every task group of the project for the next mturk_publish, e.g. after tasks were added.
+    """
+    RedisProvider().set_add(DIRTY_PROJECTS_KEY, project_group_id)
+
+
+def mark_tasks_dirty(task_ids):
+    """
+    Queues the task groups of the tasks for the next mturk_publish, e.g. after task workers were skipped.
+    """
+    if len(task_ids):
+        RedisProvider().set_add(DIRTY_TASKS_KEY, *task_ids)
+
+
+def get_dirty_groups():
+    """
+    Takes the changes queued since the last run, task group ids by project group id where None stands for
+    the whole project.
+    """
+    provider = RedisProvider()
+    dirty = {int(group_id): None for group_id in provider.pop_set(DIRTY_PROJECTS_KEY)}
+    task_ids = [int(task_id) for task_id in provider.pop_set(DIRTY_TASKS_KEY)]
+    groups = Task.objects.filter(id__in=task_ids).values_list('project__group_id', 'group_id')
+    for project_group_id, group_id in groups:
+        if dirty.get(project_group_id, ()) is not None:
+            dirty.setdefault(project_group_id, set()).add(group_id)
+    return dirty
 
 
 @celery_app.task(ignore_result=True)
 def mturk_publish():
+    """
+    Creates the missing HITs of projects with queued changes, a project's watermark is the time of its last
+    full sync and every project is fully synced at least every MTURK_PUBLISH_FULL_SYNC seconds.
+    """
+    dirty = get_dirty_groups()
+    redis_provider = RedisProvider()
+    watermarks = redis_provider.hgetall(PUBLISH_WATERMARKS_KEY)
+    now = time.time()
     projects = Project.objects.active().filter(~Q(owner__mturk_account=None),
                                                # min_rating__lt=MTURK_THRESHOLD,
                                                post_mturk=True, status=Project.STATUS_IN_PROGRESS)
     for project in projects:
+        is_full_sync = float(watermarks.pop(str(project.id), 0)) + settings.MTURK_PUBLISH_FULL_SYNC <= now
+        if not is_full_sync and project.group_id not in dirty:
+            continue
         try:
             provider = get_provider(project.owner)
-            provider.create_hits(project)
+            result = provider.create_hits(project, group_ids=None if is_full_sync else dirty[project.group_id])
         except Exception:
-            pass
+            result = None
+        if result != 'SUCCESS':
+            mark_project_dirty(project.group_id)
+        elif is_full_sync:
+            redis_provider.set_hash(PUBLISH_WATERMARKS_KEY, project.id, now)
+    # projects that are no longer published
+    for project_id in watermarks:
+        redis_provider.del_hash(PUBLISH_WATERMARKS_KEY, project_id)
     return {'message': 'SUCCESS'}
 
 
@@ -34,6 +95,209 @@ def mturk_hit_update(task):
     return provider.update_max_assignments(task)
 
 
+PENDING_HIT_UPDATES_KEY = 'mturk:pending_hit_updates'
+
+
+def schedule_hit_update(task_id):
+    """
+    Queues a HIT update for the task, updates of the same task within MTURK_HIT_UPDATE_DELAY seconds
+    are applied once by mturk_flush_hit_updates.
+    """
+    if not settings.MTURK_HIT_UPDATE_DELAY:
+        return mturk_hit_update.delay({'id': task_id})
+    provider = RedisProvider()
+    if provider.zscore(PENDING_HIT_UPDATES_KEY, task_id) is None:
+        provider.zadd(PENDING_HIT_UPDATES_KEY, time.time() + settings.MTURK_HIT_UPDATE_DELAY, task_id)
+
+
+@celery_app.task(ignore_result=True)
+def mturk_flush_hit_updates():
+    provider = RedisProvider()
+    due = provider.zrangebyscore(PENDING_HIT_UPDATES_KEY, '-inf', time.time())
+    # a task is only updated by the worker that managed to remove it from the set
+    task_ids = [int(task_id) for task_id in due if provider.zrem(PENDING_HIT_UPDATES_KEY, task_id)]
+    if not len(task_ids):
+        return 'NOOP'
+    # the ids are out of the set, an update that fails is scheduled again instead of being lost
+    try:
+        by_owner = {}
+        for task_id, owner_id in Task.objects.filter(id__in=task_ids).values_list('id', 'project__owner'):
+            by_owner.setdefault(owner_id, []).append(task_id)
+        owners = list(User.objects.filter(id__in=by_owner.keys()).select_related('mturk_account'))
+    except Exception:
+        for task_id in task_ids:
+            schedule_hit_update(task_id)
+        raise
+    failed = []
+    for owner in owners:
+        try:
+            mturk_provider = get_provider(owner)
+        except Exception:
+            failed.extend(by_owner[owner.id])
+            continue
+        if mturk_provider is None:
+            continue
+        for task_id in by_owner[owner.id]:
+            try:
+                mturk_provider.update_max_assignments({'id': task_id})
+            except MTurkHIT.DoesNotExist:
+                pass
+            except Exception:
+                failed.append(task_id)
+    for task_id in failed:
+        schedule_hit_update(task_id)
+    return 'SUCCESS'
+
+
+NOTIFICATIONS_KEY = 'mturk:notifications'
+# notifications that can not be parsed are parked here for inspection instead of blocking the queue
+FAILED_NOTIFICATIONS_KEY = 'mturk:notifications:failed'
+RETURN_EVENTS = ('AssignmentReturned', 'AssignmentAbandoned')
+EVENT_FIELD_LENGTHS = (128, 128, 32)
+
+
+def get_notification_events(data):
+    """
+    The (hit id, assignment id, event type) of every event in a REST notification, data maps each query
+    parameter to its list of values.
+    """
+    events = []
+    i = 1
+    while 'Event.{}.EventType'.format(i) in data:
+        events.append(tuple(data.get('Event.{}.{}'.format(i, name), [None])[0]
+                            for name in ('HITId', 'AssignmentId', 'EventType')))
+        i += 1
+    return events
+
+
+def parse_notification(raw):
+    """
+    The notification data of a queued notification, None when it is not valid JSON or its events do not fit the
+    columns of MTurkNotification.
+    """
+    try:
+        data = json.loads(raw)
+        if not isinstance(data, dict):
+            return None
+        for event in get_notification_events(data):
+            for value, length in zip(event, EVENT_FIELD_LENGTHS):
+                if value is not None and (not isinstance(value, basestring) or len(value) > length):
+                    return None
+    except (ValueError, TypeError, IndexError):
+        return None
+    return data
+
+
+def apply_notifications(notifications, retry=True):
+    """
+    Records a batch of notifications and skips the assignments of returned or abandoned events, events
+    already recorded for the same HIT, assignment and type are ignored so that replays are harmless.
+    """
+    events = OrderedDict()
+    for data in notifications:
+        for event in get_notification_events(data) or [(None, None, None)]:
+            events.setdefault(event, data)
+    recorded = set(MTurkNotification.objects.filter(
+        assignment_id__in=[event[1] for event in events if event[1] is not None]
+    ).values_list('hit_id', 'assignment_id', 'event_type'))
+    new_events = [(event, data) for event, data in events.items() if event not in recorded or event[1] is None]
+
+    returned = [Q(hit__hit_id=hit_id, assignment_id=assignment_id)
+                for (hit_id, assignment_id, event_type), _ in new_events if event_type in RETURN_EVENTS]
+    assignments = []
+    if len(returned):
+        assignments = MTurkAssignment.objects.filter(reduce(lambda a, b: a | b, returned),
+                                                     status=TaskWorker.STATUS_IN_PROGRESS) \
+            .values_list('id', 'task_worker_id', 'hit__task_id')
+    assignment_ids = [a[0] for a in assignments]
+    task_worker_ids = [a[1] for a in assignments if a[1] is not None]
+
+    try:
+        with transaction.atomic():
+            MTurkAssignment.objects.filter(id__in=assignment_ids).update(status=TaskWorker.STATUS_SKIPPED,
+                                                                         updated_at=timezone.now())
+            TaskWorker.objects.filter(id__in=task_worker_ids).update(status=TaskWorker.STATUS_SKIPPED,
+                                                                     updated_at=timezone.now())
+            MTurkNotification.objects.bulk_create([
+                MTurkNotification(data=data, hit_id=event[0], assignment_id=event[1], event_type=event[2])
+                for event, data in new_events
+            ])
+    except IntegrityError:
+        # a concurrent run recorded some of the events first, they are filtered out by the retry
+        if not retry:
+            raise
+        return apply_notifications(notifications, retry=False)
+    mark_tasks_dirty(list(set([a[2] for a in assignments])))
+    return len(new_events)
+
+
+@celery_app.task(ignore_result=True)
+def mturk_process_notifications():
+    provider = RedisProvider()
+    processed = 0
+    while True:
+        batch = provider.pop_list(NOTIFICATIONS_KEY, settings.MTURK_NOTIFICATION_BATCH_SIZE)
+        if not len(batch):
+            break
+        notifications = []
+        valid = []
+        for n in batch:
+            data = parse_notification(n)
+            if data is None:
+                provider.push(FAILED_NOTIFICATIONS_KEY, n)
+            else:
+                notifications.append(data)
+                valid.append(n)
+        try:
+            apply_notifications(notifications)
+        except Exception:
+            # processing is idempotent, the batch goes back to be retried on the next run
+            for n in valid:
+                provider.push(NOTIFICATIONS_KEY, n)
+            raise
+        processed += len(batch)
+    return 'SUCCESS' if processed else 'NOOP'
+
+
+VALIDATED_ASSIGNMENT_PREFIX = 'mturk:assignment'
+
+
+def is_assignment_validated(assignment_id, hit_id):
+    provider = RedisProvider()
+    return provider.get(provider.build_key(VALIDATED_ASSIGNMENT_PREFIX, assignment_id)) == hit_id
+
+
+@celery_app.task(bind=True, ignore_result=True)
+def mturk_validate_assignment(self, mturk_assignment_id):
+    """
+    Checks an assignment against MTurk after its HIT page was served, valid assignment ids are remembered for
+    MTURK_ASSIGNMENT_CACHE_TTL seconds and the task worker of an invalid one is skipped. Throttling and outages
+    are retried, only an unknown assignment or one of another HIT is revoked.
+    """
+    assignment = MTurkAssignment.objects.select_related('hit__task__project__owner__mturk_account') \
+        .filter(id=mturk_assignment_id).first()
+    if assignment is None:
+        return 'NOOP'
+    provider = get_provider(assignment.hit.task.project.owner)
+    if provider is None:
+        return 'NOOP'
+    try:
+        result, is_valid = provider.get_assignment(assignment.assignment_id)
+    except Exception as e:
+        self.retry(countdown=30, exc=e, max_retries=5)
+    if result is not None and not (is_valid and result.HITId != assignment.hit.hit_id):
+        redis_provider = RedisProvider()
+        redis_provider.set(redis_provider.build_key(VALIDATED_ASSIGNMENT_PREFIX, assignment.assignment_id),
+                           assignment.hit.hit_id, expire=settings.MTURK_ASSIGNMENT_CACHE_TTL)
+        return 'SUCCESS'
+    with transaction.atomic():
+        MTurkAssignment.objects.filter(id=assignment.id).update(status=TaskWorker.STATUS_SKIPPED,
+                                                                updated_at=timezone.now())
+        TaskWorker.objects.filter(id=assignment.task_worker_id, status=TaskWorker.STATUS_IN_PROGRESS) \
+            .update(status=TaskWorker.STATUS_SKIPPED, updated_at=timezone.now())
+    return 'SUCCESS'
+
+
 @celery_app.task(ignore_result=True)
 def mturk_approve(list_workers):
     user_id = TaskWorker.objects.values('task__project__owner').get(
@@ -42,8 +306,10 @@ def mturk_approve(list_workers):
     provider = get_provider(user)
     if provider is None:
         return
-    for task_worker_id in list_workers:
-        provider.approve_assignment({'id': task_worker_id})
+    assignments = get_assignments(list_workers)
+    approved = provider.approve_assignments(assignments.keys())
+    MTurkAssignment.objects.filter(id__in=[assignments[a] for a in approved]).update(
+        status=TaskWorker.STATUS_ACCEPTED, updated_at=timezone.now())
     return 'SUCCESS'
 
 
@@ -55,8 +321,10 @@ def mturk_reject(list_workers):
     provider = get_provider(user)
     if provider is None:
         return
-    for task_worker_id in list_workers:
-        provider.reject_assignment({'id': task_worker_id})
+    assignments = get_assignments(list_workers)
+    rejected = provider.reject_assignments(assignments.keys())
+    MTurkAssignment.objects.filter(id__in=[assignments[a] for a in rejected]).update(
+        status=TaskWorker.STATUS_REJECTED, updated_at=timezone.now())
     return 'SUCCESS'
 
 
@@ -67,19 +335,15 @@ def mturk_update_status(project):
     provider = get_provider(user)
     if provider is None:
         return
-    hits = MTurkHIT.objects.filter(task__project_id=project['id'])
-    for hit in hits:
-        if project['status'] == Project.STATUS_IN_PROGRESS:
-            provider.extend_hit(hit.hit_id)
-            hit.status = MTurkHIT.STATUS_IN_PROGRESS
-        elif project['status'] == Project.STATUS_CROWD_REJECTED:
-            # TODO delete? for now only expire
-            provider.expire_hit(hit.hit_id)
-            hit.status = MTurkHIT.STATUS_EXPIRED
-        else:
-            provider.expire_hit(hit.hit_id)
-            hit.status = MTurkHIT.STATUS_EXPIRED
-        hit.save()
+    hits = dict(MTurkHIT.objects.filter(task__project_id=project['id']).values_list('hit_id', 'id'))
+    if project.get('status') == Project.STATUS_IN_PROGRESS:
+        updated = provider.extend_hits(hits.keys())
+        hit_status = MTurkHIT.STATUS_IN_PROGRESS
+    else:
+        # TODO delete crowd rejected hits? for now only expire
+        updated = provider.expire_hits(hits.keys())
+        hit_status = MTurkHIT.STATUS_EXPIRED
+    MTurkHIT.objects.filter(id__in=[hits[h] for h in updated]).update(status=hit_status, updated_at=timezone.now())
     return 'SUCCESS'
 
 
@@ -102,65 +366,65 @@ def mturk_disable_hit(project):
     provider = get_provider(user)
     if provider is None:
         return
-    hits = MTurkHIT.objects.filter(task__project__group_id=project['id'])
-    for hit in hits:
-        provider.disable_hit(hit.hit_id)
-        hit.status = MTurkHIT.STATUS_DELETED
-        hit.save()
+    hits = dict(MTurkHIT.objects.filter(task__project__group_id=project['id']).values_list('hit_id', 'id'))
+    disabled = provider.disable_hits(hits.keys())
+    MTurkHIT.objects.filter(id__in=[hits[h] for h in disabled]).update(status=MTurkHIT.STATUS_DELETED,
+                                                                       updated_at=timezone.now())
     return 'SUCCESS'
 
 
+def get_assignments(task_worker_ids):
+    """
+    The first MTurk assignment of each task worker, as {assignment_id: id}.
+    """
+    assignments = MTurkAssignment.objects.filter(task_worker_id__in=task_worker_ids) \
+        .order_by('task_worker_id', 'id').distinct('task_worker_id').values_list('assignment_id', 'id')
+    return dict(assignments)
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
 def get_provider(user, host=None):
+    """
+    Providers are kept per process for MTURK_PROVIDER_TTL seconds so that their connections are reused,
+    the encrypted secret is part of the key so that changed credentials get a new provider.
+    """
     if not hasattr(user, 'mturk_account'):
         return None
     if host is None:
         host = SITE_HOST
-    client_secret = AESUtil(key=AWS_DAEMO_KEY).decrypt(user.mturk_account.client_secret)
-    return MTurkProvider(host=host, aws_access_key_id=user.mturk_account.client_id,
-                         aws_secret_access_key=client_secret)
+    account = user.mturk_account
+    key = (account.id, account.client_id, account.client_secret, host)
+    now = time.time()
+    with _providers_lock:
+        cached = _providers.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+    client_secret = AESUtil(key=AWS_DAEMO_KEY).decrypt(account.client_secret)
+    provider = MTurkProvider(host=host, aws_access_key_id=account.client_id,
+                             aws_secret_access_key=client_secret)
+    with _providers_lock:
+        for k in [k for k, v in _providers.items() if v[1] <= now]:
+            del _providers[k]
+        _providers[key] = (provider, now + settings.MTURK_PROVIDER_TTL)
+    return provider
 
 
-@celery_app.task(ignore_result=True)
-def update_worker_boomerang(owner_id, project_id):
-    # TODO fix group_id
-    # noinspection SqlResolve
-    query = '''
-        SELECT
-          t.target_id target_id,
-          t.username username,
-          t.task_w_avg task_avg,
-          r.requester_w_avg requester_avg
-        FROM (
-               SELECT
-                 target_id,
-                 username,
-                 sum(weight * power((%(BOOMERANG_TASK_ALPHA)s), t.row_number))
-                   / sum(power((%(BOOMERANG_TASK_ALPHA)s), t.row_number)) task_w_avg
-               FROM (
-
-                      SELECT
-                        r.id,
-                        u.username username,
-                        weight,
-                        r.target_id,
-                        -1 + row_number()
-                        OVER (PARTITION BY target_id
-                          ORDER BY tw.created_at DESC) AS row_number
-
-                      FROM crowdsourcing_rating r
-                        INNER JOIN crowdsourcing_task t ON t.id = r.task_id
-                        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                        INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
-                          AND tw.worker_id=r.target_id
-                        INNER JOIN auth_user u ON u.id = r.target_id
-                      WHERE p.group_id = (%(project_id)s) AND origin_type=(%(origin_type)s)) t
-               GROUP BY target_id, username) t
-          INNER JOIN
-          (SELECT
+# noinspection SqlResolve
+sql.register('worker_boomerang', '''
+    SELECT
+      t.target_id target_id,
+      t.username username,
+      t.task_w_avg task_avg,
+      r.requester_w_avg requester_avg
+    FROM (
+           SELECT
              target_id,
              username,
-             sum(weight * power((%(BOOMERANG_REQUESTER_ALPHA)s), r.row_number))
-               / sum(power((%(BOOMERANG_REQUESTER_ALPHA)s), r.row_number)) requester_w_avg
+             sum(weight * power((%(BOOMERANG_TASK_ALPHA)s), t.row_number))
+               / sum(power((%(BOOMERANG_TASK_ALPHA)s), t.row_number)) task_w_avg
            FROM (
 
                   SELECT
@@ -174,17 +438,48 @@ def update_worker_boomerang(owner_id, project_id):
 
                   FROM crowdsourcing_rating r
                     INNER JOIN crowdsourcing_task t ON t.id = r.task_id
+                    INNER JOIN crowdsourcing_project p ON p.id = t.project_id
                     INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
                       AND tw.worker_id=r.target_id
                     INNER JOIN auth_user u ON u.id = r.target_id
-                  WHERE origin_id=(%(origin_id)s) AND origin_type=(%(origin_type)s)
-                ) r
-           GROUP BY target_id, username) r ON r.target_id = t.target_id;
-    '''
+                  WHERE p.group_id = (%(project_id)s) AND origin_type=(%(origin_type)s)) t
+           GROUP BY target_id, username) t
+      INNER JOIN
+      (SELECT
+         target_id,
+         username,
+         sum(weight * power((%(BOOMERANG_REQUESTER_ALPHA)s), r.row_number))
+           / sum(power((%(BOOMERANG_REQUESTER_ALPHA)s), r.row_number)) requester_w_avg
+       FROM (
+
+              SELECT
+                r.id,
+                u.username username,
+                weight,
+                r.target_id,
+                -1 + row_number()
+                OVER (PARTITION BY target_id
+                  ORDER BY tw.created_at DESC) AS row_number
+
+              FROM crowdsourcing_rating r
+                INNER JOIN crowdsourcing_task t ON t.id = r.task_id
+                INNER JOIN crowdsourcing_taskworker tw ON t.id = tw.task_id
+                  AND tw.worker_id=r.target_id
+                INNER JOIN auth_user u ON u.id = r.target_id
+              WHERE origin_id=(%(origin_id)s) AND origin_type=(%(origin_type)s)
+            ) r
+       GROUP BY target_id, username) r ON r.target_id = t.target_id;
+''')
+
+
+@celery_app.task(ignore_result=True)
+def update_worker_boomerang(owner_id, project_id):
+    # TODO fix group_id
     cursor = connection.cursor()
-    cursor.execute(query, {'project_id': project_id, 'origin_type': Rating.RATING_REQUESTER, 'origin_id': owner_id,
-                           'BOOMERANG_REQUESTER_ALPHA': settings.BOOMERANG_REQUESTER_ALPHA,
-                           'BOOMERANG_TASK_ALPHA': settings.BOOMERANG_TASK_ALPHA})
+    sql.execute('worker_boomerang',
+                {'project_id': project_id, 'origin_type': Rating.RATING_REQUESTER, 'origin_id': owner_id,
+                 'BOOMERANG_REQUESTER_ALPHA': settings.BOOMERANG_REQUESTER_ALPHA,
+                 'BOOMERANG_TASK_ALPHA': settings.BOOMERANG_TASK_ALPHA}, cursor)
     worker_ratings_raw = cursor.fetchall()
     worker_ratings = [{"worker_id": r[0], "worker_username": r[1], "task_avg": r[2], "requester_avg": r[3]} for r in
                       worker_ratings_raw]
@@ -193,31 +488,75 @@ def update_worker_boomerang(owner_id, project_id):
 
     user = User.objects.get(id=owner_id)
     provider = get_provider(user=user)
+    if provider is None:
+        return 'NOOP'
+    scores = {}
     for rating in worker_ratings:
         user_name = rating["worker_username"].split('.')
         if len(user_name) == 2 and user_name[0] == 'mturk':
-            mturk_worker_id = user_name[1].upper()
-            provider.update_worker_boomerang(project_id, worker_id=mturk_worker_id, task_avg=rating['task_avg'],
-                                             requester_avg=rating['requester_avg'])
-    return 'SUCCESS'
+            scores[user_name[1].upper()] = int(rating['task_avg'] * 100)
+    return provider.update_worker_boomerang(project_id, scores)
+
+
+EXPIRED_TASK_WORKERS_KEY = 'mturk:expired_task_workers'
+EXPIRE_HITS_WATERMARK_KEY = 'mturk:expire_hits_watermark'
+
+
+def queue_expired_task_workers(task_worker_ids):
+    """
+    Outbox of expire_tasks, the MTurk assignments of these task workers are expired by the next expire_hits.
+    """
+    if len(task_worker_ids):
+        RedisProvider().set_add(EXPIRED_TASK_WORKERS_KEY, *task_worker_ids)
+
+
+# noinspection SqlResolve
+sql.register('expire_hits', '''
+    UPDATE mturk_mturkassignment ma SET status=(%(expired)s), updated_at=now()
+    FROM crowdsourcing_taskworker tw, mturk_mturkhit h
+    WHERE tw.id = ANY(%(task_worker_ids)s) AND ma.task_worker_id = tw.id AND h.id = ma.hit_id
+      AND tw.status = (%(expired)s) AND ma.status <> tw.status
+    RETURNING h.task_id;
+''')
+
+# noinspection SqlResolve
+sql.register('expire_hits_since', '''
+    UPDATE mturk_mturkassignment ma SET status=(%(expired)s), updated_at=now()
+    FROM crowdsourcing_taskworker tw, mturk_mturkhit h
+    WHERE tw.updated_at > to_timestamp(%(since)s) AND ma.task_worker_id = tw.id AND h.id = ma.hit_id
+      AND tw.status = (%(expired)s) AND ma.status <> tw.status
+    RETURNING h.task_id;
+''')
 
 
 @celery_app.task(ignore_result=True)
 def expire_hits():
-    # noinspection SqlResolve
-    query = '''
-        WITH assignments AS (
-            SELECT
-              ma.id assignment_id,
-              ma.status
-            FROM crowdsourcing_taskworker tw
-              INNER JOIN mturk_mturkassignment ma ON ma.task_worker_id = tw.id
-            WHERE tw.status = (%(expired)s) AND ma.status <> tw.status
-        )
-        UPDATE mturk_mturkassignment SET status=(%(expired)s) FROM assignments
-        WHERE assignments.assignment_id=id;
-    '''
-    cursor = connection.cursor()
-    cursor.execute(query, {'expired': TaskWorker.STATUS_EXPIRED})
+    """
+    Expires the MTurk assignments of the task workers expired since the last run and queues an update of
+    their HITs, so that the expired assignments are offered again.
 
-    return 'SUCCESS'
+    The outbox is written after expire_tasks committed, a worker dying in between loses its entries. Every run
+    also reconciles the task workers expired since the previous run's watermark, less an overlap for
+    transactions that committed late, so a lost entry is picked up by the next run.
+    """
+    provider = RedisProvider()
+    task_worker_ids = [int(task_worker_id) for task_worker_id in provider.pop_set(EXPIRED_TASK_WORKERS_KEY)]
+    started = time.time()
+    watermark = float(provider.get(EXPIRE_HITS_WATERMARK_KEY) or started)
+    cursor = connection.cursor()
+    task_ids = set()
+    if len(task_worker_ids):
+        try:
+            sql.execute('expire_hits', {'expired': TaskWorker.STATUS_EXPIRED, 'task_worker_ids': task_worker_ids},
+                        cursor)
+        except Exception:
+            queue_expired_task_workers(task_worker_ids)
+            raise
+        task_ids.update([row[0] for row in cursor.fetchall()])
+    sql.execute('expire_hits_since', {'expired': TaskWorker.STATUS_EXPIRED,
+                                      'since': watermark - settings.MTURK_EXPIRE_HITS_OVERLAP}, cursor)
+    task_ids.update([row[0] for row in cursor.fetchall()])
+    provider.set(EXPIRE_HITS_WATERMARK_KEY, started)
+    for task_id in task_ids:
+        schedule_hit_update(task_id)
+    return 'SUCCESS' if len(task_ids) else 'NOOP'
@@ -12,16 +12,18 @@ from ws4redis.redis_store import RedisMessage
 
 from crowdsourcing import constants
 from crowdsourcing.models import TaskWorker, TaskWorkerResult, MatchGroup
+from crowdsourcing.redis import RedisProvider
 from crowdsourcing.serializers.project import ProjectSerializer
 from crowdsourcing.serializers.task import (TaskSerializer,
                                             TaskWorkerResultSerializer, CollectiveRejectionSerializer)
 from crowdsourcing.viewsets.task import is_final_review, update_ts_scores
 from crowdsourcing.tasks import update_worker_cache
 from csp import settings
-from mturk.models import MTurkAssignment, MTurkHIT, MTurkNotification, MTurkAccount
+from mturk.models import MTurkAssignment, MTurkHIT, MTurkAccount
 from mturk.permissions import IsValidHITAssignment
 from mturk.serializers import MTurkAccountSerializer
-from mturk.tasks import get_provider, mturk_hit_collective_reject
+from mturk.tasks import (NOTIFICATIONS_KEY, is_assignment_validated, mturk_hit_collective_reject,
+                         mturk_validate_assignment)
 from mturk.utils import get_or_create_worker, is_allowed_to_work
 
 
@@ -38,16 +40,13 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
             task_id = -1
         task_id = task_id[0]
         hit_id = request.data.get('hitId', -1)
-        mturk_hit = get_object_or_404(MTurkHIT, task_id=task_id, hit_id=hit_id)
+        mturk_hit = get_object_or_404(MTurkHIT.objects.select_related('task__project__owner__mturk_account'),
+                                      task_id=task_id, hit_id=hit_id)
         assignment_id = request.data.get('assignmentId', -1)
         mturk_assignment_id = None
         task_worker = None
-        provider = get_provider(mturk_hit.task.project.owner, host='https://' + request.get_host())
 
         if assignment_id != 'ASSIGNMENT_ID_NOT_AVAILABLE':
-            assignment, is_valid = provider.get_assignment(assignment_id)
-            if not assignment or (is_valid and assignment.HITId != hit_id):
-                return Response(data={"message": "Invalid assignment"}, status=status.HTTP_400_BAD_REQUEST)
             if not is_allowed_to_work(worker, task_id, assignment_id):
                 return Response(data={"message": "You are not allowed to work on this HIT, please skip it."},
                                 status=status.HTTP_403_FORBIDDEN)
@@ -62,6 +61,9 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
             if created:
                 assignment.status = TaskWorker.STATUS_IN_PROGRESS
                 assignment.save()
+            if not is_assignment_validated(assignment_id, hit_id):
+                # checked against MTurk off the page load, invalid assignments get their task worker skipped
+                mturk_validate_assignment.delay(assignment.id)
         task_serializer = TaskSerializer(instance=mturk_hit.task,
                                          fields=('id', 'template', 'project_data', 'status'),
                                          context={'task_worker': task_worker})
@@ -172,24 +174,8 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
 
     @list_route(methods=['post', 'get'], url_path='notification')
     def notification(self, request, *args, **kwargs):
-        hit_id = request.query_params.get('Event.1.HITId')
-        # hit_type_id = request.query_params.get('Event.1.HITTypeId')
-        assignment_id = request.query_params.get('Event.1.AssignmentId')
-
-        event_type = request.query_params.get('Event.1.EventType')
-        if event_type in ['AssignmentReturned', 'AssignmentAbandoned']:
-            mturk_assignment = MTurkAssignment.objects.filter(hit__hit_id=hit_id, assignment_id=assignment_id,
-                                                              status=TaskWorker.STATUS_IN_PROGRESS).first()
-            if mturk_assignment is not None:
-                mturk_assignment.status = TaskWorker.STATUS_SKIPPED
-                mturk_assignment.save()
-                if mturk_assignment.task_worker is not None:
-                    mturk_assignment.task_worker.status = TaskWorker.STATUS_SKIPPED
-                    mturk_assignment.task_worker.save()
-
-        # MTurkNotification.objects.create(event_type=event_type, hit_id=hit_id, hit_type_id=hit_type_id,
-        #                                  assignment_id=assignment_id)
-        MTurkNotification.objects.create(data=request.query_params)
+        # applied in batches by mturk_process_notifications
+        RedisProvider().push(NOTIFICATIONS_KEY, json.dumps(dict(request.query_params.lists())))
         return Response(data={}, status=status.HTTP_201_CREATED)
 
 